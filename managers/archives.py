@@ -0,0 +1,193 @@
+'''
+Reading the files of raw datasets directly from tar archives
+
+Raw Landsat scenes are distributed as tar archives (usually gzipped) of one GeoTIFF per band, plus metadata.
+Instead of extracting every archive in full, a LandsatScene can be given the path to the archive itself:
+the archive's members are indexed once (the index is cached in a JSON sidecar next to the archive,
+'<archive>.index.json', and in memory), and only the bands that are used are read:
+
+- from an uncompressed archive, each member is read in place through GDAL's /vsisubfile/ virtual file system,
+  using the member's offset and size from the index, so that nothing is extracted
+  (and GDAL does not need to scan the archive itself, as it would with /vsitar/);
+
+- a gzipped archive cannot be read at an offset, so the members that are used are extracted once,
+  in a single pass over the archive, to a directory next to it (or in settings.ARCHIVE_EXTRACT_ROOT),
+  and are then read from there.
+
+Like the statistics sidecars, the index records the size and modification time of its archive,
+and is ignored if the archive has changed.
+'''
+
+import os
+import json
+import tarfile
+import threading
+
+from . import settings
+
+
+ARCHIVE_SUFFIXES = ('.tar', '.tar.gz', '.tgz')
+
+INDEX_SUFFIX = '.index.json'
+
+# the first bytes of a gzipped file
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+# the indexes that have been loaded or built in this process, keyed by (path, size, mtime)
+_indexes = {}
+_lock = threading.Lock()
+
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def archive_name(path):
+    '''
+    The name of an archive without its suffix (e.g., the scene name of a Landsat archive)
+    '''
+    filename = os.path.basename(path)
+    for suffix in sorted(ARCHIVE_SUFFIXES, key=len, reverse=True):
+        if filename.lower().endswith(suffix):
+            return filename[:-len(suffix)]
+    return filename
+
+
+def real_path(filepath):
+    '''
+    The path to the file that contains a member read through /vsisubfile/ (or the filepath itself),
+    e.g., to check whether the member has changed
+    '''
+    if filepath.startswith('/vsisubfile/'):
+        return filepath.split(',', 1)[1]
+    return filepath
+
+
+def _file_key(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime]
+
+
+def _build_index(path):
+    '''
+    Scan an archive for its regular files
+    (for a gzipped archive, this decompresses the whole archive, but writes nothing)
+    '''
+
+    with open(path, 'rb') as file:
+        compressed = file.read(2) == GZIP_MAGIC
+
+    members = {}
+    with tarfile.open(path, 'r:*') as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            members[os.path.basename(member.name)] = [member.name, member.offset_data, member.size]
+
+    return {'compressed': compressed, 'members': members}
+
+
+def index(path):
+    '''
+    The index of an archive: a dict of {'compressed': <whether the archive is gzipped>, 'members': ...},
+    where members is a dict of [member name, offset, size] lists keyed by the members' filenames
+    '''
+
+    file_key = _file_key(path)
+    key = (path, *file_key)
+    with _lock:
+        if key in _indexes:
+            return _indexes[key]
+
+    index_path = path + INDEX_SUFFIX
+    props = None
+    if os.path.isfile(index_path):
+        with open(index_path, 'r') as file:
+            props = json.load(file)
+        if props.get('file') != file_key:
+            props = None
+
+    if props is None:
+        props = dict(file=file_key, **_build_index(path))
+
+        # the archive may be on a read-only drive, in which case the index is cached only in memory
+        try:
+            with open(index_path, 'w') as file:
+                json.dump(props, file)
+        except OSError:
+            pass
+
+    with _lock:
+        _indexes[key] = props
+    return props
+
+
+def extract_dir(path):
+    '''
+    The directory to which the members of a gzipped archive are extracted
+    '''
+    root = settings.ARCHIVE_EXTRACT_ROOT or os.path.dirname(path)
+    return os.path.join(root, '%s_extracted' % archive_name(path))
+
+
+def extract(path, filenames):
+    '''
+    Extract members of an archive (that have not already been extracted) in one pass over the archive
+
+    filenames : the filenames of the members (as they are keyed in the index)
+    Returns the paths to the extracted files, in the same order
+    '''
+
+    members = index(path)['members']
+    directory = extract_dir(path)
+    filepaths = [os.path.join(directory, filename) for filename in filenames]
+
+    with _lock:
+        remaining = {
+            members[filename][0]: filepath
+            for filename, filepath in zip(filenames, filepaths) if not os.path.isfile(filepath)}
+        if not remaining:
+            return filepaths
+
+        os.makedirs(directory, exist_ok=True)
+        with tarfile.open(path, 'r:*') as archive:
+            for member in archive:
+                filepath = remaining.pop(member.name, None)
+                if filepath is None:
+                    continue
+
+                # extract to a temporary file, so that an interrupted extraction is never mistaken for a complete one
+                with archive.extractfile(member) as src, open(filepath + '.part', 'wb') as dst:
+                    while True:
+                        data = src.read(2**24)
+                        if not data:
+                            break
+                        dst.write(data)
+                os.replace(filepath + '.part', filepath)
+
+                # the members are in the order of the archive, so there is no need to scan the rest of it
+                if not remaining:
+                    break
+
+    return filepaths
+
+
+def member_path(path, filename, local=False):
+    '''
+    A path from which a member of an archive can be read
+
+    For an uncompressed archive, this is a GDAL /vsisubfile/ path (which only GDAL can read),
+    unless local is True; otherwise, and for a gzipped archive, the member is extracted
+    and the path is that of the extracted file
+    '''
+
+    props = index(path)
+    if filename not in props['members']:
+        raise FileNotFoundError('%s is not in the archive %s' % (filename, path))
+
+    if props['compressed'] or local:
+        return extract(path, [filename])[0]
+
+    _, offset, size = props['members'][filename]
+    return '/vsisubfile/%d_%d,%s' % (offset, size, path)
@@ -0,0 +1,254 @@
+'''
+A process-wide LRU cache of decoded raster blocks
+
+Within a session the same datasets are read again and again (e.g., a stack is written and then read
+to compute its statistics and again by autogain, and the sources of multiply_rgb are re-read for each
+new gamma or weight), and decoding (decompressing) GeoTIFF blocks is often the largest part of the cost of a read.
+Readers opened with raster_io.open therefore cache the arrays that they read, keyed by the dataset's path,
+modification time and size, by the bands and the window that were read, and by the other options of the read
+(e.g., whether the read is masked or boundless), so that the masked reads of merge are cached too.
+
+Only reads of at most one block (of windows.BLOCK_SIZE pixels square) of each band are cached,
+so that reading a whole band (or a large window) does not flush the blocks of every other dataset from the cache.
+Resampled reads (with a `resampling` option, or an `out_shape` that differs from the shape of the window)
+are not cached either: they are rarely repeated with the same window, and they depend on the resampling.
+
+Because the key includes the modification time and size of the file when it was opened,
+a dataset that is rewritten (by an operation or by a CLI command) is never read from stale entries;
+opening a dataset for writing with raster_io.open also removes its entries immediately.
+
+Raw arrays are not cached (reading them is already zero-copy; see raster_io.RawDataset),
+and neither are reads into an existing array (with the `out` option).
+'''
+
+import os
+import threading
+import collections
+import numpy as np
+
+from rasterio.windows import Window
+
+from . import archives
+from . import windows
+
+
+# the default maximum size of the cache in MB
+DEFAULT_MAX_SIZE = 512
+
+
+def _nbytes(im):
+    '''
+    The size of an array, including the mask of a masked array
+    '''
+    if np.ma.isMaskedArray(im):
+        return im.data.nbytes + np.ma.getmaskarray(im).nbytes
+    return im.nbytes
+
+
+class BlockCache(object):
+
+    def __init__(self, max_size=None):
+        '''
+        max_size : the maximum total size of the cached arrays in MB
+        '''
+
+        if max_size is None:
+            max_size = DEFAULT_MAX_SIZE
+
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def get(self, key):
+        '''
+        The cached array for a key (which is then the most recently used), or None
+        '''
+        with self._lock:
+            im = self._entries.get(key)
+            if im is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return im
+
+
+    def put(self, key, im, copy=False):
+        '''
+        Cache an array (or, if copy is True, a copy of it),
+        evicting the least recently used arrays to make room for it
+        (arrays larger than the cache are not cached, or copied)
+        '''
+
+        max_bytes = self.max_size*2**20
+        if _nbytes(im) > max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = im.copy() if copy else im
+            self._size += _nbytes(im)
+            self._evict()
+
+
+    def _evict(self):
+        while self._size > self.max_size*2**20:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= _nbytes(evicted)
+            self.evictions += 1
+
+
+    def resize(self, max_size):
+        '''
+        Change the maximum size of the cache, in MB (zero disables the cache)
+        '''
+        with self._lock:
+            self.max_size = max_size
+            self._evict()
+
+
+    def invalidate(self, path):
+        '''
+        Remove the entries of a dataset
+        '''
+        with self._lock:
+            for key in [key for key in self._entries.keys() if key[0] == path]:
+                self._size -= _nbytes(self._entries.pop(key))
+
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+    def stats(self):
+        '''
+        The number of hits, misses and evictions (since the cache was created or reset),
+        and the number and total size (in MB) of the cached arrays
+        '''
+        with self._lock:
+            reads = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits/reads if reads else None,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'size': self._size/2**20,
+                'max_size': self.max_size,
+            }
+
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits, self.misses, self.evictions = 0, 0, 0
+
+
+class CachedReader(object):
+    '''
+    A rasterio dataset, opened for reading, whose reads are cached in a BlockCache
+
+    All attributes other than `read` are those of the dataset.
+    Cached arrays are shared, so a cache hit returns a copy of the cached array, which the caller may modify
+    (on a miss, the cache keeps its own copy of the array, if it has room for it; reads that are not cached are never copied).
+    '''
+
+    def __init__(self, dataset, cache=None):
+        self._dataset = dataset
+        self._cache = cache or block_cache
+
+        # the key of the file's contents when it was opened
+        # (members of archives are keyed by their archive's file, and other datasets that are not local files,
+        # e.g. other GDAL virtual file paths, are not cached)
+        try:
+            stat = os.stat(archives.real_path(dataset.name))
+            self._file_key = (dataset.name, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            self._file_key = None
+
+
+    def _key(self, indexes, window, kwargs):
+        '''
+        The cache key of a read, or None if the read is not cached
+        '''
+
+        if self._file_key is None or 'out' in kwargs or not (window is None or isinstance(window, Window)):
+            return None
+
+        # the (height, width) of the window that is read
+        if window is None:
+            shape = (self._dataset.height, self._dataset.width)
+        else:
+            shape = (int(round(window.height)), int(round(window.width)))
+
+        # resampled reads and reads of more than one block are not cached
+        out_shape = kwargs.get('out_shape')
+        if 'resampling' in kwargs or (out_shape is not None and tuple(out_shape[-2:]) != shape):
+            return None
+        if shape[0]*shape[1] > windows.BLOCK_SIZE**2:
+            return None
+
+        options = []
+        for name, value in sorted(kwargs.items()):
+            if isinstance(value, list):
+                value = tuple(value)
+            try:
+                hash(value)
+            except TypeError:
+                return None
+            options.append((name, value))
+
+        return self._file_key + (
+            tuple(indexes) if isinstance(indexes, (list, tuple)) else indexes,
+            tuple(window.flatten()) if window is not None else None,
+            tuple(options))
+
+
+    def read(self, indexes=None, window=None, **kwargs):
+
+        key = self._key(indexes, window, kwargs)
+        if key is None:
+            return self._dataset.read(indexes=indexes, window=window, **kwargs)
+
+        im = self._cache.get(key)
+        if im is not None:
+            return im.copy()
+
+        im = self._dataset.read(indexes=indexes, window=window, **kwargs)
+        self._cache.put(key, im, copy=True)
+        return im
+
+
+    def __getattr__(self, name):
+        return getattr(self._dataset, name)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self._dataset.close()
+
+
+# the cache shared by every reader in the process
+block_cache = BlockCache()
+
+
+def stats():
+    return block_cache.stats()
+
+
+def configure(max_size):
+    '''
+    Change the maximum size of the process-wide cache, in MB (zero disables it)
+    '''
+    block_cache.resize(max_size)
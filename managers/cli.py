@@ -0,0 +1,243 @@
+'''
+The command-line interface
+
+    python -m managers ls <project_root>
+    python -m managers profile <project_root>
+    python -m managers run <project_root> <method> [--source ...] [--kwargs JSON]
+    python -m managers replay <project_root> [--dry-run]
+
+`ls` and `profile` read only the project's props (and its journal), so they import nothing but the standard library;
+the project classes (and rasterio, GDAL, numpy, etc) are imported only by the commands that run operations
+(so that, e.g., cron jobs that check on a project start quickly).
+'''
+
+import os
+import sys
+import json
+import argparse
+
+from . import journal
+
+
+# the project class of each raw dataset type
+# (DEMProject handles both NED13 tiles and generic TIFFs)
+PROJECT_CLASSES = {
+    'goes': 'GOESProject',
+    'landsat': 'LandsatProject',
+    'ned13': 'DEMProject',
+    'tif': 'DEMProject',
+}
+
+
+# the operations whose source is a list of datasets (even if it is a list of one dataset)
+LIST_SOURCE_METHODS = ['merge', 'multiply_rgb', 'pipeline', 'composite']
+
+
+def _load_props(project_root):
+    props_path = os.path.join(project_root, 'props.json')
+    if not os.path.isfile(props_path):
+        raise FileNotFoundError('No cached props found at %s' % props_path)
+    with open(props_path, 'r') as file:
+        props = json.load(file)
+
+    # the operations logged since the props were saved
+    journal.Journal(os.path.join(project_root, 'operations.jsonl')).replay(props['operations'])
+    return props
+
+
+def _dataset_name(dataset):
+    return os.path.split(dataset['path'].rstrip(os.sep))[-1]
+
+
+def _format_duration(duration):
+    if duration is None:
+        return '-'
+    if duration < 60:
+        return '%0.1fs' % duration
+    return '%dm%02ds' % (duration//60, duration % 60)
+
+
+def _load_project(args):
+    '''
+    Load a project, importing the project classes only now
+    '''
+
+    from . import managers
+    from .resources import Resources
+
+    props = _load_props(args.project_root)
+    project_class = getattr(managers, PROJECT_CLASSES.get(props.get('raw_dataset_type'), 'RasterProject'))
+
+    kwargs = {}
+    if args.threads is not None or args.memory is not None:
+        kwargs['resources'] = Resources(threads=args.threads, memory=args.memory)
+    if args.disk_quota is not None:
+        kwargs['disk_quota'] = args.disk_quota
+
+    return project_class(args.project_root, **kwargs)
+
+
+def ls(args):
+    '''
+    List the logged operations and the state of their destinations
+    '''
+
+    props = _load_props(args.project_root)
+    print('%s (%s, created %s)' % (props['project_name'], props['raw_dataset_type'], props['project_created_on']))
+
+    for ind, operation in enumerate(props['operations']):
+        if operation.get('evicted'):
+            state = 'evicted'
+        elif not all(os.path.exists(dataset['path']) for dataset in operation['destination']):
+            state = 'missing'
+        else:
+            state = ''
+
+        print('%3d  %s  %-16s %-8s %s' % (
+            ind,
+            operation['timestamp'],
+            operation['method'],
+            state,
+            ', '.join(_dataset_name(dataset) for dataset in operation['destination'])))
+    return 0
+
+
+def profile(args):
+    '''
+    Show the duration and the resource budgets of each logged operation,
+    and the total duration of each method
+    '''
+
+    props = _load_props(args.project_root)
+
+    totals = {}
+    for ind, operation in enumerate(props['operations']):
+        duration = operation.get('duration')
+        resources = operation.get('resources') or {}
+        print('%3d  %-16s %10s  threads=%s memory=%s' % (
+            ind,
+            operation['method'],
+            _format_duration(duration),
+            resources.get('threads', '-'),
+            resources.get('memory', '-')))
+
+        if duration is not None:
+            count, total = totals.get(operation['method'], (0, 0))
+            totals[operation['method']] = (count + 1, total + duration)
+
+    if totals:
+        print('\nTotal by method')
+        for method, (count, total) in sorted(totals.items(), key=lambda item: -item[1][1]):
+            print('     %-16s %10s  (%d operations)' % (method, _format_duration(total), count))
+    return 0
+
+
+def run(args):
+    '''
+    Run an operation and log it
+    '''
+
+    project = _load_project(args)
+
+    from . import datasets
+
+    # each source is either the index of a logged operation, whose destination is the source,
+    # or the path to a dataset of type --source-type
+    sources = []
+    for source in args.source or ['-1']:
+        try:
+            index = int(source)
+        except ValueError:
+            sources.append(datasets.new_dataset(args.source_type, source, exists=True))
+        else:
+            sources.extend(project._existing(dataset) for dataset in project.operations[index]._destination)
+
+    source = sources if len(sources) > 1 or args.method in LIST_SOURCE_METHODS else sources[0]
+    kwargs = json.loads(args.kwargs) if args.kwargs else {}
+
+    method = getattr(project, args.method, None)
+    if method is None or args.method.startswith('_'):
+        raise ValueError('%s is not an operation of %s' % (args.method, type(project).__name__))
+
+    operation = method(source, **kwargs)
+    print('Created %s in %s' % (
+        ', '.join(dataset.name for dataset in operation._destination), _format_duration(operation.duration)))
+    return 0
+
+
+def replay(args):
+    '''
+    Re-run the stale operations (those whose destinations are missing or out of date)
+    and the operations that depend on them
+    '''
+
+    project = _load_project(args)
+
+    stale = project.stale_operations()
+    if not stale:
+        print('All operations are up to date')
+        return 0
+
+    for operation in stale:
+        print('Stale: %d %s' % (project.operations.index(operation), operation.method))
+    if args.dry_run:
+        return 0
+
+    # re-running an operation also re-runs (and replaces) every operation that depends on it,
+    # so the stale operations that have already been replaced are skipped
+    for operation in stale:
+        if operation in project.operations:
+            project.update(operation)
+    return 0
+
+
+def build_parser():
+
+    parser = argparse.ArgumentParser(prog='raster-project', description='Manage raster projects')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    def _add_command(name, func, help):
+        subparser = subparsers.add_parser(name, help=help)
+        subparser.add_argument('project_root', help='the project directory')
+        subparser.set_defaults(func=func)
+        return subparser
+
+    def _add_budgets(subparser):
+        subparser.add_argument('--threads', type=int, help='the number of threads of each operation')
+        subparser.add_argument('--memory', type=int, help='the memory budget of each operation, in MB')
+        subparser.add_argument('--disk-quota', type=float, help='the disk quota of the derived datasets, in MB')
+
+    _add_command('ls', ls, help='list the logged operations')
+    _add_command('profile', profile, help='show the duration of each logged operation')
+
+    subparser = _add_command('run', run, help='run an operation and log it')
+    subparser.add_argument('method', help='the name of the operation (e.g., warp)')
+    subparser.add_argument(
+        '--source', action='append',
+        help='the index of the operation whose destination is the source (defaults to -1, the last operation), '
+             'or the path to a dataset (may be repeated)')
+    subparser.add_argument('--source-type', default='tif', help='the type of sources given as paths')
+    subparser.add_argument('--kwargs', help='the kwargs of the operation, as a JSON object')
+    _add_budgets(subparser)
+
+    subparser = _add_command('replay', replay, help='re-run the stale operations')
+    subparser.add_argument('--dry-run', action='store_true', help='only list the stale operations')
+    _add_budgets(subparser)
+
+    return parser
+
+
+def main(argv=None):
+
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except (ValueError, FileNotFoundError, IndexError) as error:
+        print('Error: %s' % error, file=sys.stderr)
+        return 1
+
+    # any other failure of an operation (e.g., a failed assertion or a GDAL error)
+    except Exception as error:
+        print('Error: %s failed (%s: %s)' % (args.command, type(error).__name__, error), file=sys.stderr)
+        return 1
@@ -4,9 +4,12 @@ import re
 import sys
 import glob
 import json
+import datetime
 
 import numpy as np
 
+from . import archives
+
 
 def new_dataset(dataset_type, path, **kwargs):
 
@@ -14,7 +17,10 @@ def new_dataset(dataset_type, path, **kwargs):
         'landsat': 'LandsatScene',
         'ned13': 'NED13Tile',
         'tif': 'GeoTIFF',
-        'goes': 'GOESScene'
+        'goes': 'GOESScene',
+        'frames': 'FrameSequence',
+        'raw': 'RawArray',
+        'tiles': 'TileSet',
     }
 
     if dataset_type not in dataset_types:
@@ -31,6 +37,7 @@ class Dataset(object):
     Generic dataset
 
     Either a single TIF or a set of TIFs (bands) in a single directory
+    (or, for raw Landsat scenes, in a tar archive)
     '''
 
     def __init__(self, path, is_raw=False, exists=False):
@@ -59,6 +66,28 @@ class Dataset(object):
         self.rel_band_res = {}
 
 
+    def files(self):
+        '''
+        The paths to the extant files of the dataset, in sorted order
+        (the file itself, or all of the files in the dataset's directory)
+        '''
+
+        if os.path.isfile(self.path):
+            return [self.path]
+
+        filepaths = []
+        for dirpath, _, filenames in os.walk(self.path):
+            filepaths.extend(os.path.join(dirpath, filename) for filename in filenames)
+        return sorted(filepaths)
+
+
+    def prepare(self, bands):
+        '''
+        Make bands ready to be read before their filepaths are used (see LandsatScene.prepare)
+        '''
+        pass
+
+
 class GeoTIFF(Dataset):
     
     def __init__(self, path, **kwargs):
@@ -95,6 +124,50 @@ class GeoTIFF(Dataset):
 
 
 
+class RawArray(Dataset):
+    '''
+    A raw array stored in a .npy file, with a JSON sidecar for the georeferencing
+    (see raster_io.RawDataset)
+
+    Raw arrays are an optional intermediate format for datasets that are only read
+    by in-process operations; they must be exported to GeoTIFF to be used by GDAL
+    '''
+
+    def __init__(self, path, **kwargs):
+        super().__init__(path, **kwargs)
+
+        self.type = 'raw'
+
+        base, ext = os.path.splitext(self.path)
+
+        # the dataset name is the filename itself
+        self.name = base.split(os.sep)[-1]
+
+        # as for GeoTIFFs, the path doesn't need to include the extension
+        if not ext:
+            ext = '.npy'
+            self.path += ext
+
+        if ext.lower() != '.npy':
+            raise ValueError('%s is not a .npy file' % self.path)
+
+        self.sidecar_path = base + '.json'
+
+        if self.exists:
+            for path in [self.path, self.sidecar_path]:
+                if not os.path.isfile(path):
+                    raise FileNotFoundError('%s does not exist' % path)
+
+
+    def filepath(self, band=None):
+        return self.path
+
+
+    def files(self):
+        return [path for path in [self.path, self.sidecar_path] if os.path.isfile(path)]
+
+
+
 class NED13Tile(Dataset):
 
     def __init__(self, path, exists=False):
@@ -166,30 +239,45 @@ class LandsatScene(Dataset):
         if pan_band is not None:
             self.rel_band_res[pan_band] = .5
 
-        if self.exists and not os.path.isdir(self.path):
-            raise FileNotFoundError('%s is not a directory' % self.path)
-        os.makedirs(self.path, exist_ok=True)
+        # raw scenes may be tar archives, which are read without extracting them in full (see archives.py)
+        self.archive = archives.is_archive(self.path)
+
+        if self.archive:
+            if self.exists and not os.path.isfile(self.path):
+                raise FileNotFoundError('%s does not exist' % self.path)
+
+            # the dataset name is the archive name without its suffix
+            self.name = archives.archive_name(self.path)
+        else:
+            if self.exists and not os.path.isdir(self.path):
+                raise FileNotFoundError('%s is not a directory' % self.path)
+            os.makedirs(self.path, exist_ok=True)
+
+            # the dataset name is the directory name
+            self.name = os.path.split(self.path)[-1]
 
-        # the dataset name is the directory name
-        self.name = os.path.split(self.path)[-1]
-        
         # find the existing bands
         self.extant_bands = []
-        if self.exists:    
-            filepaths = glob.glob(os.path.join(self.path, '*.TIF'))
-            for filepath in filepaths:
-                result = re.search('%s_B([0-9]+).TIF$' % self.name, filepath)
+        if self.exists:
+            if self.archive:
+                filenames = [name for name in archives.index(self.path)['members'] if name.endswith('.TIF')]
+            else:
+                filenames = [os.path.basename(filepath) for filepath in glob.glob(os.path.join(self.path, '*.TIF'))]
+
+            for filename in filenames:
+                result = re.search('%s_B([0-9]+).TIF$' % self.name, filename)
                 if result:
                     band = int(result.groups()[0])
                     self.extant_bands.append(band)
+                elif filename == self._qa_filename():
+                    continue
                 else:
-                    print('Warning: ignoring unexpected filename %s' % \
-                        filepath.split(os.sep)[-1])
- 
+                    print('Warning: ignoring unexpected filename %s' % filename)
+
             self._validate()
             self.extant_bands = sorted(self.extant_bands)
 
-    
+
     def _validate(self):
         
         # check for expected and unexpected bands)
@@ -214,12 +302,78 @@ class LandsatScene(Dataset):
         if band is None:
             raise ValueError('A band must be provided')
 
-        filepath = os.path.join(self.path, '%s_B%s.TIF' % (self.name, band))    
+        filename = '%s_B%s.TIF' % (self.name, band)
+        if self.archive:
+            if filename not in archives.index(self.path)['members']:
+                raise FileNotFoundError('B%s does not exist for scene %s' % (band, self.name))
+            return archives.member_path(self.path, filename)
+
+        filepath = os.path.join(self.path, filename)
         if self.exists and not os.path.isfile(filepath):
             raise FileNotFoundError('B%s does not exist for scene %s' % (band, self.name))
         return filepath
 
 
+    def _archive_filepath(self, filename):
+        '''
+        The filepath to a member of an archive that is not a band (which is extracted, so that it is a local file),
+        or to where it would be extracted, if it is not in the archive
+        '''
+        if filename in archives.index(self.path)['members']:
+            return archives.member_path(self.path, filename, local=True)
+        return os.path.join(archives.extract_dir(self.path), filename)
+
+
+    def mtl_filepath(self):
+        '''
+        The filepath to the MTL metadata file (which exists only for raw scenes)
+        '''
+        filename = '%s_MTL.txt' % self.name
+        if self.archive:
+            return self._archive_filepath(filename)
+        return os.path.join(self.path, filename)
+
+
+    def _qa_filename(self):
+        return '%s_BQA.TIF' % self.name
+
+
+    def qa_filepath(self):
+        '''
+        The filepath to the quality assessment (QA) band
+        (note that, unlike the other bands, the QA band is optional)
+        '''
+        if self.archive:
+            return self._archive_filepath(self._qa_filename())
+        return os.path.join(self.path, self._qa_filename())
+
+
+    def prepare(self, bands):
+        '''
+        Make bands ready to be read: the bands of a gzipped archive are extracted in one pass over the archive
+        (rather than in one pass for each band, as `filepath` would); for other scenes, this does nothing
+        '''
+        if not (self.archive and archives.index(self.path)['compressed']):
+            return
+
+        members = archives.index(self.path)['members']
+        filenames = ['%s_B%s.TIF' % (self.name, band) for band in bands]
+        archives.extract(self.path, [filename for filename in filenames if filename in members])
+
+
+    @property
+    def acquisition_date(self):
+        '''
+        The acquisition date, from the scene name
+        (e.g., 2018-09-07 for scene 'LC08_L1TP_042034_20180907_20180912_01_T1'),
+        or None for derived scenes, whose names do not follow the Landsat convention
+        '''
+        result = re.search('^L[A-Z][0-9]{2}_[A-Z0-9]{4}_[0-9]{6}_([0-9]{8})_', self.name)
+        if result:
+            return datetime.datetime.strptime(result.groups()[0], '%Y%m%d').date()
+        return None
+
+
 
 class GOESScene(Dataset):
     '''
@@ -242,15 +396,25 @@ class GOESScene(Dataset):
     eYYYYJJJHHMMSSZ - Scan end
     cYYYYJJJHHMMSSZ - File creation
 
-    Band details (for visible and near-IR bands only)
-    -------------------------------------------------
+    Band details
+    ------------
     Band  Res (km)   Wavelength   Spectrum    Name
-    01	  1          0.47µm	      Visible	  Blue
-    02	  0.5        0.64µm	      Visible	  Red
-    03	  1	         0.86µm	      Near-IR	  Veggie
-    04	  2	         1.37µm	      Near-IR	  Cirrus
-    05	  1	         1.60µm	      Near-IR	  Snow/Ice
-    06	  2	         2.24µm	      Near-IR	  Cloud Particle Size
+    01    1          0.47µm       Visible     Blue
+    02    0.5        0.64µm       Visible     Red
+    03    1          0.86µm       Near-IR     Veggie
+    04    2          1.37µm       Near-IR     Cirrus
+    05    1          1.60µm       Near-IR     Snow/Ice
+    06    2          2.24µm       Near-IR     Cloud Particle Size
+    07    2          3.90µm       IR          Shortwave Window
+    08    2          6.19µm       IR          Upper-Level Water Vapor
+    09    2          6.93µm       IR          Mid-Level Water Vapor
+    10    2          7.34µm       IR          Lower-level Water Vapor
+    11    2          8.44µm       IR          Cloud-Top Phase
+    12    2          9.61µm       IR          Ozone
+    13    2          10.33µm      IR          "Clean" IR Longwave Window
+    14    2          11.21µm      IR          IR Longwave Window
+    15    2          12.29µm      IR          "Dirty" IR Longwave Window
+    16    2          13.28µm      IR          CO2 Longwave Infrared
 
     '''
 
@@ -259,6 +423,11 @@ class GOESScene(Dataset):
 
         self.type = 'goes'
 
+        # relative resolutions of the 0.5km and 2km bands
+        # (relative to the 1km bands 1, 3 and 5; see the table above)
+        self.rel_band_res = {2: .5, 4: 2}
+        self.rel_band_res.update({band: 2 for band in range(6, 17)})
+
         if self.exists and not os.path.isdir(self.path):
             raise FileNotFoundError('%s is not a directory' % self.path)
         os.makedirs(self.path, exist_ok=True)
@@ -271,10 +440,11 @@ class GOESScene(Dataset):
         self.filepaths = {}
         self.extant_bands = []
         if self.exists:    
-            filepaths = glob.glob(os.path.join(self.path, '*.nc.tif'))
+            # raw bands are '*.nc.tif' files, and the bands of derived datasets are '*.tif' files
+            filepaths = glob.glob(os.path.join(self.path, '*.tif'))
             for filepath in filepaths:
                 filename = filepath.split(os.sep)[-1]
-                result = re.search('OR_ABI-L1b-RadC-M6C0([0-9])', filename)
+                result = re.search('OR_ABI-L1b-Rad[CFM][12]?-M[346]C([0-9]{2})', filename)
                 if result:
                     band = int(result.groups()[0])
                     self.extant_bands.append(band)
@@ -301,3 +471,75 @@ class GOESScene(Dataset):
         else:
             filepath = os.path.join(self.path, 'OR_ABI-L1b-RadC-M6C%02d.tif' % band)
         return filepath
+
+
+
+class FrameSequence(Dataset):
+    '''
+    A directory of numbered PNG frames rendered from a sequence of datasets
+    (and, optionally, an animated image of the frames)
+    '''
+
+    def __init__(self, path, **kwargs):
+        super().__init__(path, **kwargs)
+
+        self.type = 'frames'
+
+        if self.exists and not os.path.isdir(self.path):
+            raise FileNotFoundError('%s is not a directory' % self.path)
+        os.makedirs(self.path, exist_ok=True)
+
+        # the dataset name is the directory name
+        self.name = os.path.split(self.path)[-1]
+
+        # the path to the JSON file that lists the frames and their sources
+        self.manifest_path = os.path.join(self.path, 'frames.json')
+
+
+    def filepath(self, band=None):
+        '''
+        The path to a frame given its index
+        (the frame index plays the role of the band for consistency with the other datasets)
+        '''
+
+        if band is None:
+            raise ValueError('A frame index must be provided')
+        return os.path.join(self.path, '%s_%05d.png' % (self.name, band))
+
+
+    def animation_path(self, ext='gif'):
+        return os.path.join(self.path, '%s.%s' % (self.name, ext))
+
+
+
+class TileSet(Dataset):
+    '''
+    A pyramid of web map tiles (see tiles.py), either in an XYZ directory of {z}/{x}/{y}.png files
+    or in a single MBTiles (SQLite) file; the format is determined by the extension of the path
+    '''
+
+    def __init__(self, path, format=None, **kwargs):
+        super().__init__(path, **kwargs)
+
+        self.type = 'tiles'
+
+        base, ext = os.path.splitext(self.path)
+        if format is None:
+            format = 'mbtiles' if ext.lower() == '.mbtiles' else 'xyz'
+
+        if format not in ['xyz', 'mbtiles']:
+            raise ValueError('%s is not a valid tile format' % format)
+        self.format = format
+
+        if self.format == 'mbtiles' and ext.lower() != '.mbtiles':
+            self.path += '.mbtiles'
+
+        # the dataset name is the directory or file name
+        self.name = os.path.splitext(os.path.split(self.path)[-1])[0]
+
+        if self.exists and not os.path.exists(self.path):
+            raise FileNotFoundError('%s does not exist' % self.path)
+
+
+    def filepath(self, band=None):
+        return self.path
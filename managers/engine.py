@@ -0,0 +1,521 @@
+'''
+Chunked, out-of-core execution of in-process operations
+
+The engine partitions the grid of its source datasets into chunks that are aligned to the tiles
+of the destination (see windows.tiled_profile), and processes the chunks in parallel,
+with the number of chunks in flight (and therefore the memory used) bounded by a memory budget.
+
+Work is expressed as functions of a list of float32 images (one per source, each of shape (bands, rows, cols)):
+`map` writes the result of the function for each chunk to a destination,
+and `reduce` returns the results (typically small, like min/max or histograms) for each chunk.
+Global operations (e.g., scaling by percentiles) are a reduce followed by a map.
+
+Functions are run either in worker threads (the default) or in worker processes. Numpy releases the GIL
+for large array operations, but not for the many small steps of most per-pixel functions,
+so kernels (module-level functions, see kernels.py) can instead be run in a pool of processes:
+the main thread reads each chunk into a shared-memory buffer, a worker process applies the kernel
+to the buffer in place and writes its result (for `map`) to a second shared-memory buffer,
+so that chunks are never pickled, and the main thread writes the results in chunk order.
+Functions that cannot be sent to another process (e.g., closures) are always run in worker threads.
+
+The worker processes are started by a fork server (or spawned, where there is none), never forked
+from the main process, which may have other threads (e.g., of `submit`, or of GDAL) holding locks.
+Workers started this way import the main module, which re-runs the top-level code of a script
+that is not guarded by `if __name__ == '__main__':`. So processes are used only if they are asked for
+(executor='processes', or settings.ENGINE_EXECUTOR), or, with executor='auto', if the main module
+can be imported safely (in interactive sessions and notebooks, and for a package's __main__,
+e.g. `python -m managers`). The pools are kept until `shutdown` is called or the process exits.
+
+Functions that use a neighborhood of each pixel can request a halo: the images passed to the function
+are then padded on all sides by `halo` pixels (from the neighboring chunks, or by repeating the edge pixels
+at the edges of the grid), and the halo is cropped from the function's result.
+'''
+
+import os
+import sys
+import copy
+import atexit
+import functools
+import pickle
+import threading
+import collections
+import numpy as np
+import multiprocessing
+import concurrent.futures
+
+from multiprocessing import shared_memory
+
+from rasterio.windows import Window
+
+from . import stats
+from . import utils
+from . import settings
+from . import kernels
+from . import windows
+from . import raster_io
+from . import pipelines
+
+
+def physical_memory():
+    '''
+    The physical memory of the machine in MB (or None if it cannot be determined)
+    '''
+    try:
+        return os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_PHYS_PAGES')/2**20
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+# the process pools of the engines, keyed by the number of workers
+# (starting a pool is slow, so pools are shared by every engine and kept until the process exits)
+_process_pools = {}
+_process_pools_lock = threading.Lock()
+
+
+def _process_pool(max_workers):
+    with _process_pools_lock:
+        if max_workers not in _process_pools:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+            # the fork server imports the kernels once, so that each worker need not import them itself
+            if 'forkserver' in methods:
+                context.set_forkserver_preload([kernels.__name__])
+
+            _process_pools[max_workers] = concurrent.futures.ProcessPoolExecutor(
+                max_workers=max_workers, mp_context=context)
+        return _process_pools[max_workers]
+
+
+def shutdown():
+    '''
+    Shut down the worker processes of every engine (new pools are started as they are needed)
+    '''
+    with _process_pools_lock:
+        pools = list(_process_pools.values())
+        _process_pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+atexit.register(shutdown)
+
+
+def main_is_importable():
+    '''
+    Whether worker processes can import the main module without re-running the caller's code:
+    true if there is no main file (interactive sessions and notebooks) or if the main module is a package's
+    __main__ (which multiprocessing does not import in its workers)
+    '''
+    main = sys.modules.get('__main__')
+    name = getattr(getattr(main, '__spec__', None), 'name', None)
+    if name is not None:
+        return name == '__main__' or name.endswith('.__main__')
+    return getattr(main, '__file__', None) is None
+
+
+def _is_kernel(func):
+    '''
+    Whether a function can be run in the worker processes: it must be picklable, and defined in a module
+    other than __main__ (functions pickle by reference, and the workers' __main__ is not the main module
+    of an interactive session)
+    '''
+    while isinstance(func, functools.partial):
+        func = func.func
+    if getattr(func, '__module__', None) in [None, '__main__']:
+        return False
+    try:
+        pickle.dumps(func)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return False
+    return True
+
+
+def _discard_pool(max_workers):
+    '''
+    Discard a pool whose workers died (a new pool is started for the next chunk)
+    '''
+    with _process_pools_lock:
+        pool = _process_pools.pop(max_workers, None)
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+
+def _share(images):
+    '''
+    Copy a list of images to a new shared-memory buffer
+    Returns the buffer and its layout, a list of the (offset, shape) of each image
+    '''
+
+    layout, offset = [], 0
+    for im in images:
+        layout.append((offset, im.shape))
+        offset += im.nbytes
+
+    buffer = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for im, (offset, shape) in zip(images, layout):
+        np.ndarray(shape, dtype='float32', buffer=buffer.buf, offset=offset)[:] = im
+    return buffer, layout
+
+
+def _release(*buffers):
+    for buffer in buffers:
+        if buffer is not None:
+            buffer.close()
+            buffer.unlink()
+
+
+def _run_kernel(func, window, name, layout, dst_name=None, dst_shape=None, dst_dtype=None):
+    '''
+    Apply a kernel to the images in a shared-memory buffer (in a worker process)
+
+    dst_name : the name of the shared-memory buffer to which to copy the result (for `map`);
+        if None, the result itself is returned (for `reduce`)
+    '''
+
+    buffer = shared_memory.SharedMemory(name=name)
+    dst_buffer = shared_memory.SharedMemory(name=dst_name) if dst_name else None
+    try:
+        images = [np.ndarray(shape, dtype='float32', buffer=buffer.buf, offset=offset) for offset, shape in layout]
+        result = func(images, window)
+
+        if dst_buffer is not None:
+            if result.shape != tuple(dst_shape):
+                raise ValueError('The result has shape %s but the destination chunk has shape %s' % \
+                    (result.shape, tuple(dst_shape)))
+            np.ndarray(dst_shape, dtype=dst_dtype, buffer=dst_buffer.buf)[:] = result
+            result = None
+        else:
+            # the result must not refer to the buffer, which is closed below
+            result = copy.deepcopy(result)
+
+        del images
+        return result
+    finally:
+        buffer.close()
+        if dst_buffer is not None:
+            dst_buffer.close()
+
+
+class ChunkedEngine(object):
+
+    # the approximate number of float32 copies of each chunk that a function creates
+    # (the images themselves, temporaries, and the result)
+    _copies_per_chunk = 4
+
+
+    def __init__(self, max_memory=None, max_workers=None, executor=None):
+        '''
+        max_memory : the memory budget, in MB, for the chunks in flight
+            (defaults to one quarter of the physical memory)
+        max_workers : the number of worker threads or processes (defaults to the number of CPUs)
+        executor : 'threads', 'processes' (for kernels; other functions are run in threads),
+            or 'auto', which runs kernels in worker processes if there is more than one worker
+            and the main module can be imported safely by the workers (see main_is_importable)
+            (defaults to settings.ENGINE_EXECUTOR)
+        '''
+
+        if executor is None:
+            executor = settings.ENGINE_EXECUTOR
+        if executor not in ['auto', 'threads', 'processes']:
+            raise ValueError('%s is not a valid executor' % executor)
+
+        if max_memory is None:
+            max_memory = (physical_memory() or 4096)/4
+
+        if max_workers is None:
+            max_workers = os.cpu_count()
+
+        self.max_memory = max_memory
+        self.max_workers = max_workers
+        self.executor = executor
+
+
+    def chunk_size(self, bands, halo=0):
+        '''
+        The edge length of square chunks such that `max_workers` chunks fit in the memory budget
+
+        bands : the total number of bands of the sources and the destination
+        The chunk size is a multiple of windows.BLOCK_SIZE, so that chunks are aligned to tiles
+        '''
+
+        bytes_per_pixel = 4*bands*self._copies_per_chunk
+        max_pixels = self.max_memory*2**20/(bytes_per_pixel*self.max_workers)
+        size = int(np.sqrt(max_pixels)) - 2*halo
+        return max(windows.BLOCK_SIZE, size//windows.BLOCK_SIZE*windows.BLOCK_SIZE)
+
+
+    def _chunks(self, srcs, halo, extra_bands=0):
+        width, height = srcs[0].width, srcs[0].height
+        bands = sum(src.count for src in srcs) + extra_bands
+        return list(windows.block_windows(width, height, block_size=self.chunk_size(bands, halo)))
+
+
+    def _read(self, readers, paths, window, halo):
+        '''
+        Read a chunk of each source as float32, padded by the halo
+        '''
+
+        images = []
+        for path in paths:
+            src = readers.get(path)
+
+            # the padded window, clipped to the grid
+            row_start = max(window.row_off - halo, 0)
+            col_start = max(window.col_off - halo, 0)
+            row_stop = min(window.row_off + window.height + halo, src.height)
+            col_stop = min(window.col_off + window.width + halo, src.width)
+
+            im = src.read(
+                window=Window(col_start, row_start, col_stop - col_start, row_stop - row_start))
+            im = im.astype('float32')
+
+            # pad the edges of the grid by repeating the edge pixels
+            if halo:
+                pad = (
+                    (0, 0),
+                    (halo - (window.row_off - row_start), window.row_off + window.height + halo - row_stop),
+                    (halo - (window.col_off - col_start), window.col_off + window.width + halo - col_stop),
+                )
+                im = np.pad(im, pad, mode='edge')
+
+            images.append(im)
+        return images
+
+
+    def _use_processes(self, func):
+        if self.executor == 'threads':
+            return False
+        if self.executor == 'auto' and (self.max_workers < 2 or not main_is_importable()):
+            return False
+        if _is_kernel(func):
+            return True
+        if self.executor == 'processes':
+            print('Warning: %s cannot be sent to a worker process and will run in worker threads' % func)
+        return False
+
+
+    def _run(self, paths, func, chunks, halo, callback, dst_profile=None):
+        '''
+        Apply func to the chunks of the sources, in worker processes or threads (see _use_processes),
+        and pass each result to callback(window, result)
+
+        dst_profile : the destination's profile, for `map` (the count and dtype of the results)
+        '''
+        if self._use_processes(func):
+            self._run_processes(paths, func, chunks, halo, callback, dst_profile)
+        else:
+            self._run_threads(paths, func, chunks, halo, callback)
+
+
+    def _run_processes(self, paths, func, chunks, halo, callback, dst_profile):
+        '''
+        Apply func to the chunks of the sources in worker processes, and pass each result
+        to callback(window, result) in chunk order (callback is called in this thread)
+
+        The next chunk is read in this thread while the workers process the preceding chunks,
+        so at most `max_workers` + 1 chunks are in flight
+        '''
+
+        executor = _process_pool(self.max_workers)
+        pending = collections.deque()
+
+        def _finish():
+            window, future, buffer, dst_buffer, dst_shape = pending.popleft()
+            try:
+                result = future.result()
+                if dst_buffer is not None:
+                    result = np.ndarray(dst_shape, dtype=dst_profile['dtype'], buffer=dst_buffer.buf)
+                callback(window, result)
+                del result
+            finally:
+                _release(buffer, dst_buffer)
+
+        try:
+            with windows.ThreadLocalReaders() as readers:
+                for window in chunks:
+                    if len(pending) > self.max_workers:
+                        _finish()
+
+                    images = self._read(readers, paths, window, halo)
+                    buffer, layout = _share(images)
+                    dst_buffer, dst_shape = None, None
+                    try:
+                        if dst_profile is not None:
+                            dst_shape = (dst_profile.get('count', 1),) + images[0].shape[1:]
+                            dst_buffer = shared_memory.SharedMemory(
+                                create=True, size=int(np.prod(dst_shape))*np.dtype(dst_profile['dtype']).itemsize)
+                        del images
+
+                        future = executor.submit(
+                            _run_kernel, func, window, buffer.name, layout,
+                            dst_buffer.name if dst_buffer else None, dst_shape, dst_profile and dst_profile['dtype'])
+                    except BaseException:
+                        _release(buffer, dst_buffer)
+                        raise
+                    pending.append((window, future, buffer, dst_buffer, dst_shape))
+
+                while pending:
+                    _finish()
+
+        except concurrent.futures.BrokenExecutor:
+            _discard_pool(self.max_workers)
+            raise
+        finally:
+            # an exception leaves chunks in flight; wait for them before releasing their buffers
+            for _, future, buffer, dst_buffer, _ in pending:
+                concurrent.futures.wait([future])
+                _release(buffer, dst_buffer)
+
+
+    def _run_threads(self, paths, func, chunks, halo, callback):
+        '''
+        Apply func to the chunks of the sources in the worker threads,
+        with at most `max_workers` chunks in flight, and pass each result to callback(window, result)
+        (callback is also called in the worker threads)
+        '''
+
+        in_flight = threading.BoundedSemaphore(self.max_workers)
+
+        def _process(readers, window):
+            try:
+                result = func(self._read(readers, paths, window, halo), window)
+                callback(window, result)
+            finally:
+                in_flight.release()
+
+        with windows.ThreadLocalReaders() as readers:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = []
+                for window in chunks:
+                    in_flight.acquire()
+                    futures.append(executor.submit(_process, readers, window))
+
+                # re-raise the first exception, if any
+                for future in futures:
+                    future.result()
+
+
+    def reduce(self, paths, func, halo=0, combine=None):
+        '''
+        Apply func(images, window) to every chunk of the sources and return the results in chunk order
+
+        combine : an optional function of two results that returns their combination
+            (e.g., the sum of two histograms); if given, the results are combined as they are ready
+            (in whatever order the chunks finish), and only the combined result is returned,
+            so that the results of every chunk are never in memory at once
+        '''
+
+        with windows.ThreadLocalReaders() as readers:
+            srcs = [readers.get(path) for path in paths]
+            chunks = self._chunks(srcs, halo)
+
+        results = {}
+        lock = threading.Lock()
+
+        def _collect(window, result):
+            with lock:
+                if combine is None:
+                    results[(window.row_off, window.col_off)] = result
+                elif 'combined' in results:
+                    results['combined'] = combine(results['combined'], result)
+                else:
+                    results['combined'] = result
+
+        self._run(paths, func, chunks, halo, _collect)
+
+        if combine is not None:
+            return results['combined']
+        return [results[(window.row_off, window.col_off)] for window in chunks]
+
+
+    def map(self, paths, func, dst_path, dst_profile, halo=0):
+        '''
+        Apply func(images, window) to every chunk of the sources and write the results to a destination
+
+        func must return an array of shape (count, rows, cols) with the destination's dtype,
+        where count is dst_profile['count'] and (rows, cols) is the shape of the (padded) images.
+
+        Results are written as soon as they are ready: in chunk order, when func runs in worker processes;
+        otherwise in parallel, for raw destinations, and one at a time (in whatever order the chunks finish),
+        for GeoTIFF destinations.
+        '''
+
+        with windows.ThreadLocalReaders() as readers:
+            srcs = [readers.get(path) for path in paths]
+            chunks = self._chunks(srcs, halo, extra_bands=dst_profile.get('count', 1))
+
+        lock = threading.Lock()
+        parallel_writes = raster_io.is_raw(dst_path)
+
+        with raster_io.open(dst_path, 'w', **dst_profile) as dst:
+
+            def _write(window, result):
+                if halo:
+                    result = result[:, halo:-halo, halo:-halo]
+                if parallel_writes:
+                    dst.write(result, window=window)
+                else:
+                    with lock:
+                        dst.write(result, window=window)
+
+            self._run(paths, func, chunks, halo, _write, dst_profile=dst_profile)
+
+
+def _add(first, second):
+    return [a + b for a, b in zip(first, second)]
+
+
+def percentile_limits(chunked, path, percentile=None, each_band=True):
+    '''
+    Calculate the min/max intensities of each band (or of all bands) of a dataset given a percentile
+    (as in utils.autoscale, percentile=None means the absolute min/max)
+
+    For 8- and 16-bit integer data, the limits are calculated from exact histograms in one pass,
+    and are identical to those calculated by np.percentile;
+    for other data, they are estimated from histograms between the min and max in two passes.
+    If the dataset's statistics are cached (see stats.py), the limits are calculated from them without a pass.
+
+    chunked : a ChunkedEngine
+    Returns a list of (minn, maxx) tuples, one for each band (or a list of one tuple if each_band is False)
+    '''
+
+    # as with utils.autoscale, nodata pixels are included
+    limits = stats.cached_limits(path, percentile, each_band=each_band, include_nodata=True)
+    if limits is not None:
+        return limits
+
+    if percentile is None:
+        percentile = 100
+    percentiles = [100 - percentile, percentile]
+
+    with raster_io.open(path) as src:
+        dtype = np.dtype(src.dtypes[0])
+
+    if np.issubdtype(dtype, np.integer) and dtype.itemsize <= 2:
+        offset = int(np.iinfo(dtype).min)
+        num_values = int(np.iinfo(dtype).max) - offset + 1
+
+        counts = chunked.reduce(
+            [path],
+            functools.partial(kernels.exact_histograms, offset=offset, num_values=num_values, each_band=each_band),
+            combine=_add)
+        values = np.arange(num_values) + offset
+        return [
+            tuple(utils.histogram_percentiles(values[count > 0], count[count > 0], percentiles))
+            for count in counts]
+
+    results = chunked.reduce([path], functools.partial(kernels.min_max, each_band=each_band))
+    ranges = [
+        (min(result[ind][0] for result in results), max(result[ind][1] for result in results))
+        for ind in range(len(results[0]))]
+
+    if percentile == 100:
+        return [(float(minn), float(maxx)) for minn, maxx in ranges]
+
+    counts = chunked.reduce(
+        [path], functools.partial(kernels.histograms, ranges=ranges, each_band=each_band), combine=_add)
+    return [
+        tuple(pipelines.histogram_percentiles(count, *range_, percentiles))
+        for count, range_ in zip(counts, ranges)]
+
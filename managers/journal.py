@@ -0,0 +1,86 @@
+'''
+An append-only journal of the changes to a project's operations
+
+Rewriting props.json serializes every operation, so its cost grows with the length of the project's history.
+Instead, each change to the list of operations (a new operation, an operation replaced by `update`,
+or an operation whose datasets were evicted or regenerated) is appended to the journal
+as soon as it is made, as one line of JSON, and flushed to disk; props.json is a snapshot
+that is rewritten only when the journal is compacted (see RasterProject.save_props).
+
+Each entry is {'index': <the index of the operation>, 'operation': <the serialized operation>},
+and means "the operation at this index is now this operation" (an index equal to the number
+of operations appends the operation). Replaying an entry twice has the same result as replaying it once,
+so a crash between writing a new snapshot and clearing the journal is harmless.
+'''
+
+import os
+import json
+
+
+class Journal(object):
+
+    def __init__(self, path):
+        self.path = path
+
+
+    def append(self, index, operation):
+        '''
+        Append an entry for the operation at an index, and wait until it is on disk
+
+        operation : the serialized operation
+        '''
+        line = json.dumps({'index': index, 'operation': operation})
+        with open(self.path, 'a') as file:
+            file.write(line + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+
+
+    def _read(self):
+        if not os.path.isfile(self.path):
+            return ''
+        with open(self.path, 'r') as file:
+            return file.read()
+
+
+    def entries(self):
+        '''
+        The entries in the journal, in order
+
+        Every complete entry ends with a newline, so a final line without one
+        (i.e., an entry that was being written during a crash) is ignored
+        '''
+        lines = self._read().split('\n')[:-1]
+        return [json.loads(line) for line in lines if line.strip()]
+
+
+    def repair(self):
+        '''
+        Remove an incomplete final entry, so that new entries are not appended to it
+        '''
+        text = self._read()
+        if text and not text.endswith('\n'):
+            print('Warning: removing an incomplete entry at the end of the journal %s' % self.path)
+            with open(self.path, 'w') as file:
+                file.write(text[:text.rfind('\n') + 1])
+
+
+    def replay(self, operations):
+        '''
+        Apply the entries in the journal to a list of serialized operations (in place)
+        '''
+        for entry in self.entries():
+            index = entry['index']
+            if index == len(operations):
+                operations.append(entry['operation'])
+            elif index < len(operations):
+                operations[index] = entry['operation']
+            else:
+                raise ValueError('The journal %s has an entry for operation %s, but there are only %s operations' % \
+                    (self.path, index, len(operations)))
+        return operations
+
+
+    def clear(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
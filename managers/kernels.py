@@ -0,0 +1,111 @@
+'''
+Per-chunk kernels of the in-process operations
+
+A kernel is a function of (images, window, **params), where images is a list of float32 images,
+one for each source, of shape (bands, rows, cols) (see ChunkedEngine). Kernels are module-level functions
+whose params are bound with functools.partial, so that they can be pickled and sent to worker processes;
+the chunked engine runs picklable kernels in a pool of processes (see ChunkedEngine), and any other function
+(e.g., a closure) in a pool of threads.
+
+Map kernels return the chunk of the destination; reduce kernels return a (small) result for each chunk.
+(The kernels of the passes that resolve the limits of a pipeline are in pipelines.py.)
+'''
+
+import numpy as np
+
+from . import pipelines
+
+
+def _groups(images, each_band):
+    im = images[0]
+    return list(im) if each_band else [im]
+
+
+def min_max(images, window, each_band=True):
+    '''
+    The min and max of each band of the first image (or of all of its bands)
+    '''
+    return [(im.min(), im.max()) for im in _groups(images, each_band)]
+
+
+def histograms(images, window, ranges, each_band=True):
+    '''
+    Histograms, with pipelines.HISTOGRAM_BINS bins, of each band of the first image (or of all of its bands)
+
+    ranges : the (min, max) of the histogram of each band (or of all bands)
+    '''
+    return [
+        np.histogram(im, bins=pipelines.HISTOGRAM_BINS, range=range_)[0]
+        for im, range_ in zip(_groups(images, each_band), ranges)]
+
+
+def exact_histograms(images, window, offset, num_values, each_band=True):
+    '''
+    The count of each integer value of each band of the first image (or of all of its bands),
+    where the counts are indexed by the value minus offset
+    '''
+    return [
+        np.bincount((im.ravel() - offset).astype('int64'), minlength=num_values)
+        for im in _groups(images, each_band)]
+
+
+def _valid(band, nodata):
+    band = band.ravel()
+    if nodata is not None:
+        band = band[band != nodata]
+    return band
+
+
+def partial_stats(images, window, nodata=None, offset=None, num_values=None):
+    '''
+    The count, nodata count, sum, min and max of the valid pixels of each band of the first image,
+    and, if num_values is given, the count of each integer value (indexed by the value minus offset)
+    (see stats.compute)
+    '''
+    results = []
+    for band in images[0]:
+        valid = _valid(band, nodata)
+        results.append({
+            'count': valid.size,
+            'nodata_count': band.size - valid.size,
+            'sum': float(valid.sum(dtype='float64')),
+            'min': float(valid.min()) if valid.size else np.inf,
+            'max': float(valid.max()) if valid.size else -np.inf,
+            'counts': np.bincount(
+                (valid - offset).astype('int64'), minlength=num_values) if num_values is not None else None,
+        })
+    return results
+
+
+def valid_histograms(images, window, band_stats, nodata=None):
+    '''
+    Histograms, with pipelines.HISTOGRAM_BINS bins between the min and max of each band,
+    of the valid pixels of each band of the first image
+
+    band_stats : the combined partial_stats of each band
+    '''
+    return [
+        np.histogram(_valid(band, nodata), bins=pipelines.HISTOGRAM_BINS, range=(stats['min'], stats['max']))[0]
+        if stats['count'] else np.zeros(pipelines.HISTOGRAM_BINS, dtype='int64')
+        for band, stats in zip(images[0], band_stats)]
+
+
+def scale(images, window, limits, dtype):
+    '''
+    Scale each band of the first image to the range of an integer dtype given its (minn, maxx) limits
+    '''
+    im = images[0]
+    for ind, (minn, maxx) in enumerate(limits):
+        im[ind] -= minn
+        im[ind] /= (maxx - minn)
+    np.clip(im, 0, 1, out=im)
+    im *= np.iinfo(dtype).max
+    return im.astype(dtype)
+
+
+def pipeline(images, window, pipeline, dtype=None):
+    '''
+    Apply a pipeline (with resolved limits) to the images and cast the result to a dtype
+    '''
+    return pipelines.cast(np.concatenate(pipeline.apply(images), axis=0), dtype)
+
@@ -0,0 +1,122 @@
+'''
+Conventions for Landsat Collection 1 Level-1 data products
+
+See https://www.usgs.gov/land-resources/nli/landsat/landsat-collection-1-level-1-quality-assessment-band
+
+QA band bits (Landsat 8)
+------------------------
+Bit     Flag
+0       Designated fill
+1       Terrain occlusion
+2-3     Radiometric saturation
+4       Cloud
+5-6     Cloud confidence
+7-8     Cloud shadow confidence
+9-10    Snow/ice confidence
+11-12   Cirrus confidence
+
+Each two-bit confidence is one of 0 (not determined), 1 (low), 2 (medium) or 3 (high)
+'''
+
+import numpy as np
+
+
+QA_FILL_BIT = 0
+QA_CLOUD_CONFIDENCE_BIT = 5
+QA_CLOUD_SHADOW_CONFIDENCE_BIT = 7
+QA_CIRRUS_CONFIDENCE_BIT = 11
+
+# the factor by which reflectance is scaled when it is stored as uint16
+REFLECTANCE_SCALE = 10000
+
+
+def qa_confidence(qa, bit):
+    '''
+    The two-bit confidence that starts at the given bit
+    '''
+    return (qa >> bit) & 0b11
+
+
+def qa_fill(qa):
+    return ((qa >> QA_FILL_BIT) & 1).astype(bool)
+
+
+def qa_cloud_score(qa):
+    '''
+    The sum of the cloud, cloud shadow, and cirrus confidences (between 0 and 9),
+    as a uint8 array in which lower is clearer
+    '''
+    score = (
+        qa_confidence(qa, QA_CLOUD_CONFIDENCE_BIT)
+        + qa_confidence(qa, QA_CLOUD_SHADOW_CONFIDENCE_BIT)
+        + qa_confidence(qa, QA_CIRRUS_CONFIDENCE_BIT))
+    return score.astype('uint8')
+
+
+def qa_clear(qa):
+    '''
+    Whether none of the cloud, cloud shadow, and cirrus confidences is medium or high
+    '''
+    clear = np.ones(qa.shape, dtype=bool)
+    for bit in [QA_CLOUD_CONFIDENCE_BIT, QA_CLOUD_SHADOW_CONFIDENCE_BIT, QA_CIRRUS_CONFIDENCE_BIT]:
+        clear &= qa_confidence(qa, bit) < 2
+    return clear
+
+
+def read_mtl(filepath):
+    '''
+    Read the MTL metadata file of a Landsat scene as a flat dict of the metadata fields
+
+    MTL files consist of nested 'GROUP = <name>' ... 'END_GROUP = <name>' blocks
+    of 'FIELD = value' lines. Field names are unique across groups, so we ignore the groups.
+    Quoted values are returned as strings and all other values as floats (where possible).
+    '''
+
+    metadata = {}
+    with open(filepath, 'r') as file:
+        for line in file:
+            if '=' not in line:
+                continue
+
+            field, value = [s.strip() for s in line.split('=', 1)]
+            if field in ['GROUP', 'END_GROUP']:
+                continue
+
+            if value.startswith('"'):
+                value = value.strip('"')
+            else:
+                try:
+                    value = float(value)
+                except ValueError:
+                    pass
+            metadata[field] = value
+
+    return metadata
+
+
+def reflectance_coefficients(metadata, band):
+    '''
+    The reflectance rescaling coefficients (mult, add) of a band from the MTL metadata,
+    or None if the band has none (as is the case for the thermal bands)
+    '''
+
+    mult = metadata.get('REFLECTANCE_MULT_BAND_%d' % band)
+    add = metadata.get('REFLECTANCE_ADD_BAND_%d' % band)
+    if mult is None or add is None:
+        return None
+    return mult, add
+
+
+def toa_reflectance(im, mult, add, sun_elevation):
+    '''
+    Convert DNs to top-of-atmosphere reflectance, corrected for the sun elevation (in degrees)
+
+    Returns a float32 array in which fill pixels (DN = 0) are zero
+    '''
+
+    reflectance = im.astype('float32')
+    reflectance *= mult
+    reflectance += add
+    reflectance /= np.sin(np.deg2rad(sun_elevation))
+    reflectance[im == 0] = 0
+    return reflectance
@@ -5,17 +5,42 @@ import sys
 import glob
 import json
 import shutil
-import deepdiff
 import datetime
+import tempfile
+import functools
 import rasterio
+import threading
+import time
 import subprocess
+import rasterio.windows
+import rasterio.transform
+import rasterio.warp
+import rasterio.features
+import concurrent.futures
 
 import numpy as np
+from rasterio.enums import Resampling
 
 from . import utils
+from . import engine
+from . import kernels
+from . import vectors
+from . import render
+from . import landsat
+from . import windows
+from . import stats
+from . import tiles
+from . import storage
+from . import journal
+from . import mosaic
 from . import settings
 from . import datasets
+from . import reproject
+from . import raster_io
+from . import pipelines
+from . import operations
 from .operations import Operation
+from .resources import default_resources
 
 
 
@@ -29,9 +54,24 @@ def log_operation(method):
         if isinstance(source, Operation):
             source = source.destination
 
-        destination, command = method(self, source, **kwargs)
-        if destination is None:
-            raise ValueError('method %s must return a dataset object' % method)
+        # regenerate any evicted sources
+        sources = source if isinstance(source, list) else [source]
+        self.storage.ensure(sources)
+
+        # run within the project's budgets, waiting for a slot if too many operations are running
+        with self.resources, self.resources.rasterio_env():
+            start = time.monotonic()
+            destination, command = method(self, source, **kwargs)
+            duration = time.monotonic() - start
+
+            if destination is None:
+                raise ValueError('method %s must return a dataset object' % method)
+
+            # cache the statistics of the new raster files, so that rescaling them requires no read pass
+            # (this reads every new file, so it runs in the operation's slot too)
+            if self.compute_stats:
+                destinations = destination if isinstance(destination, list) else [destination]
+                self._compute_stats(destinations, sources)
 
         operation = Operation(
             destination=destination,
@@ -39,22 +79,48 @@ def log_operation(method):
             kwargs=kwargs,
             method=method.__name__, 
             commit=utils.current_commit(),
-            command=command
+            command=command,
+            resources=self.resources.budgets()
         )
+        operation.fingerprint = self._fingerprint(operation)
+        operation.duration = round(duration, 3)
+
+        self.storage.touch(sources + operation._destination)
 
         if log:
-            self.operations.append(operation)
-        # self.save_props()
+            self.log(operation)
+            self.storage.enforce_quota(keep=sources + operation._destination)
+
+        return operation
 
     return wrapper
 
 
+def operations_fingerprint(operation, fingerprints, kwargs=None):
+    '''
+    The fingerprint of an operation given the fingerprints of the datasets created by other operations
+    (keyed by path); sources that no operation created are fingerprinted from their files
+    '''
+
+    if kwargs is None:
+        kwargs = operation.kwargs
+
+    source_fingerprints = [
+        fingerprints[dataset.path] if dataset.path in fingerprints else operations.dataset_fingerprint(dataset)
+        for dataset in operation._source]
+    return operations.fingerprint(operation.method, kwargs, source_fingerprints)
+
+
 
 class RasterProject(object):
     
     # temp dir
     _tmp_dir = os.path.join(os.getenv('HOME'), 'tmp')
 
+    # the number of journal entries after which the journal is compacted into the props snapshot
+    # (see save_props)
+    _journal_compaction_interval = 100
+
     _serializable_attrs = [
         'project_root', 
         'project_name', 
@@ -69,11 +135,25 @@ class RasterProject(object):
         dataset_paths=None,
         raw_dataset_type=None, 
         reset=False, 
-        refresh=False):
+        refresh=False,
+        intermediate_format=None,
+        resources=None,
+        disk_quota=None,
+        compute_stats=True):
         '''
         project_root:  path to the project directory
         dataset_paths: a list of paths to the raw/initial data files
                        (either TIFF files, NED13 tile directories, or Landsat scene directories)
+        intermediate_format: the format of the datasets created by in-process operations
+                       (autogain, multiply_rgb and stack); either 'tif' (the default) or 'raw',
+                       for memory-mapped raw arrays that must be exported to be used outside of the project
+        resources: a resources.Resources object with the CPU-thread and memory budgets of each operation
+                       (defaults to resources shared by every project in the process)
+        disk_quota:    the disk quota, in MB, for the derived datasets; when it is exceeded,
+                       the least-recently-used datasets that can be regenerated are evicted
+                       (and are regenerated when they are next used; see storage.StorageManager)
+        compute_stats: whether to compute and cache the per-band statistics of every new dataset
+                       (see stats.py), which costs one read of each dataset when it is created
 
         reset: when loading an existing project, whether to delete existing datasets and cached operations
         refresh: when loading an existing project, whether to re-run all of the existing operations
@@ -86,8 +166,37 @@ class RasterProject(object):
         # raw dataset type must be hard-coded in subclasses
         self.raw_dataset_type = raw_dataset_type
 
+        if intermediate_format is None:
+            intermediate_format = 'tif'
+        if intermediate_format not in ['tif', 'raw']:
+            raise ValueError('%s is not a valid intermediate format' % intermediate_format)
+        self.intermediate_format = intermediate_format
+
+        if resources is None:
+            resources = default_resources()
+        self.resources = resources
+        self.compute_stats = compute_stats
+
+        # the executor of submitted operations, and their per-thread timeout, progress and cancellation state
+        # (see `submit`)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._local = threading.local()
+
+        # the cached mosaic plans of merge operations
+        self.merge_planner = mosaic.MergePlanner()
+
+        # the paths of the datasets created in this session (see _new_dataset)
+        self._reserved_paths = set()
+        self._reserved_paths_lock = threading.Lock()
+
         self.props_path = os.path.join(project_root, 'props.json')
 
+        # the journal of the changes to the operations since the props were last saved
+        self.journal = journal.Journal(os.path.join(project_root, 'operations.jsonl'))
+        self._journal_lock = threading.RLock()
+        self._journal_length = 0
+
         if not reset:
             if not os.path.exists(self.props_path):
                 raise FileNotFoundError('No cached props found at %s' % self.props_path)
@@ -105,13 +214,24 @@ class RasterProject(object):
                 shutil.rmtree(project_root)
             os.makedirs(project_root)
             self._create_new_project(project_root, dataset_paths)
+            self.save_props()
+
+        self.storage = storage.StorageManager(self, quota=disk_quota)
 
 
     def _load_existing_project(self, project_root, refresh):
 
+        # (imported here because it is needed only to load a project)
+        import deepdiff
+
         with open(self.props_path, 'r') as file:
             cached_props = json.load(file)                        
 
+        # the operations logged since the props were saved
+        self.journal.repair()
+        self.journal.replay(cached_props['operations'])
+        self._journal_length = len(self.journal.entries())
+
         self._deserialize(cached_props, refresh)
         self._validate_operations()
 
@@ -158,17 +278,190 @@ class RasterProject(object):
         self.operations = [Operation.deserialize(op) for op in cached_props['operations']]
 
 
-    def _run_operation(self, operation):
+    def _run_operation(self, operation, source=None, kwargs=None):
+        '''
+        Re-run an operation, optionally with different sources and/or kwargs,
+        and return the new (unlogged) operation
+
+        source : a list of datasets that replace the operation's sources (in order);
+            the method is called with them in the form in which it was originally called (see Operation.call_source)
+        '''
+
+        if source is None:
+            source = operation._source
+        if kwargs is None:
+            kwargs = operation.kwargs
+
+        source = operation.call_source([self._existing(dataset) for dataset in source])
+        return getattr(self, operation.method)(source, log=False, **kwargs)
+
+
+    @staticmethod
+    def _existing(dataset):
+        '''
+        Recreate a deserialized dataset whose files exist
+        (deserialized datasets are created as if they did not exist, so they have no extant bands)
+        '''
+        if not dataset.exists and dataset.files():
+            return datasets.new_dataset(dataset.type, dataset.path, exists=True)
+        return dataset
+
+
+    def _current_fingerprints(self, ops=None):
+        '''
+        The current fingerprint of each operation's destination datasets, keyed by path
+
+        These are calculated from the current kwargs of the operations (in order)
+        and from the current files of the raw datasets
+        '''
+
+        if ops is None:
+            ops = self.operations
+
+        fingerprints = {}
+        for operation in ops:
+            fingerprint = operations_fingerprint(operation, fingerprints)
+            for dataset in operation._destination:
+                fingerprints[dataset.path] = fingerprint
+        return fingerprints
+
+
+    def _fingerprint(self, operation):
+        '''
+        The current fingerprint of an operation, given the current fingerprints of the logged operations
+        '''
+        return operations_fingerprint(operation, self._current_fingerprints())
+
+
+    def stale_operations(self):
+        '''
+        The logged operations whose destinations are out of date or missing
+
+        An operation is stale if its fingerprint (calculated from its method, its kwargs,
+        and the fingerprints of its sources) has changed since it was run
+        (e.g., because a raw dataset changed), if any of its destination files are missing,
+        or if any operation on which it depends is stale.
+
+        Operations logged before fingerprints were recorded are stale only if their destinations are missing
+        or if they depend on a stale operation. Evicted operations are not stale (see storage.StorageManager).
+        '''
+
+        fingerprints = {}
+        stale_paths = set()
+        stale = []
+        for operation in self.operations:
+            fingerprint = operations_fingerprint(operation, fingerprints)
+
+            is_stale = (
+                any(dataset.path in stale_paths for dataset in operation._source)
+                or (not operation.evicted and any(not dataset.files() for dataset in operation._destination))
+                or (operation.fingerprint is not None and operation.fingerprint != fingerprint))
+
+            for dataset in operation._destination:
+                fingerprints[dataset.path] = fingerprint
+                if is_stale:
+                    stale_paths.add(dataset.path)
+
+            if is_stale:
+                stale.append(operation)
+        return stale
+
+
+    def update(self, operation, **kwargs):
+        '''
+        Change the kwargs of a logged operation and re-run it and only the operations that depend on it
+
+        Every operation downstream of the updated operation is re-run with the new datasets
+        in place of the ones they replace; all other operations, and their datasets, are left as they are.
+        The replaced datasets are not deleted.
+
+        If the new kwargs do not change the operation's fingerprint (and its destinations exist),
+        nothing is re-run. Stale operations upstream of the updated operation are not re-run.
+
+        Parameters
+        ----------
+        operation : a logged operation, or its index in self.operations
+        kwargs : the kwargs to change (all other kwargs are unchanged)
+
+        Returns the updated operation
+
+        '''
 
-        # TODO: finish implementing this
-        getattr(self, operation.method)(operation.source, **operation.kwargs)
+        if isinstance(operation, int):
+            operation = self.operations[operation]
+        if operation not in self.operations:
+            raise ValueError('%s is not a logged operation' % operation)
+
+        index = self.operations.index(operation)
+        new_kwargs = dict(operation.kwargs)
+        new_kwargs.update(kwargs)
+
+        fingerprints = self._current_fingerprints(self.operations[:index])
+        new_fingerprint = operations_fingerprint(operation, fingerprints, kwargs=new_kwargs)
+        if new_fingerprint == operation.fingerprint and all(d.files() for d in operation._destination):
+            print('Operation %s is unchanged' % operation.method)
+            return operation
+
+        # a map from the path of each replaced dataset to the dataset that replaces it
+        replacements = {}
+        for ind in range(index, len(self.operations)):
+            old_operation = self.operations[ind]
+            if ind != index and not any(d.path in replacements for d in old_operation._source):
+                continue
+
+            source = [replacements.get(d.path, d) for d in old_operation._source]
+
+            print('Re-running operation %s' % old_operation.method)
+            new_operation = self._run_operation(
+                old_operation, source=source, kwargs=new_kwargs if ind == index else None)
+
+            for old_dataset, new_dataset in zip(old_operation._destination, new_operation._destination):
+                replacements[old_dataset.path] = new_dataset
+            self.operations[ind] = new_operation
+            self.log(new_operation, index=ind)
+
+        return self.operations[index]
+
+
+    def log(self, operation, index=None):
+        '''
+        Append an operation to self.operations (or replace the operation at an index)
+        and append it to the journal
+
+        To record a change to an operation that is already logged (e.g., its eviction),
+        pass the operation's own index.
+        '''
+
+        with self._journal_lock:
+            if index is None:
+                index = len(self.operations)
+                self.operations.append(operation)
+            else:
+                self.operations[index] = operation
+
+            self.journal.append(index, operation.serialize())
+            self._journal_length += 1
+            if self._journal_length >= self._journal_compaction_interval:
+                self.save_props()
 
 
     def save_props(self):
+        '''
+        Write a snapshot of the project to props.json and clear the journal
+        (the snapshot is written to a temporary file first, so that a crash cannot corrupt it)
+        '''
+
+        with self._journal_lock:
+            props = self._serialize()
+            tmp_path = self.props_path + '.tmp'
+            with open(tmp_path, 'w') as file:
+                json.dump(props, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.props_path)
 
-        props = self._serialize()
-        with open(self.props_path, 'w') as file:
-            json.dump(props, file)
+            self.journal.clear()
+            self._journal_length = 0
 
 
 
@@ -191,32 +484,238 @@ class RasterProject(object):
             raise ValueError('%s is not a valid index value' % index)
 
 
-    def _new_dataset(self, dataset_type=None, method=None):
+    def _new_dataset(self, dataset_type=None, method=None, **kwargs):
         '''
         Generate a new output dataset given a method name
+        (kwargs are passed to the dataset's constructor)
         
-        Note that we use the timestamp as a primitive kind of hash to guarantee a unique filename
+        Note that we use the timestamp as a primitive kind of hash to guarantee a unique filename;
+        if a dataset with the same timestamp already exists (or was created earlier in this session),
+        a numeric suffix is appended
         '''
 
+        # an evicted dataset is regenerated at its original path
+        path = self.storage.pending_path()
+        if path is not None:
+            return datasets.new_dataset(dataset_type, path, exists=False, **kwargs)
+
         timestamp = datetime.datetime.strftime(datetime.datetime.now(), '%Y%m%d-%H%M%S')
         filename = '%s_%s_%s' % (self.project_name, method, timestamp)
         path = os.path.join(self.project_root, filename)
-        return datasets.new_dataset(dataset_type, path, exists=False)
+
+        with self._reserved_paths_lock:
+            suffix = 0
+            while path in self._reserved_paths or glob.glob(path + '.*') or os.path.exists(path):
+                suffix += 1
+                path = os.path.join(self.project_root, '%s-%d' % (filename, suffix))
+            self._reserved_paths.add(path)
+
+        return datasets.new_dataset(dataset_type, path, exists=False, **kwargs)
+
+
+    def _intermediate_type(self):
+        '''
+        The dataset type of the destinations of in-process operations
+        '''
+        return 'raw' if self.intermediate_format == 'raw' else 'tif'
+
+
+    def _engine(self, max_memory=None, max_workers=None):
+        '''
+        The chunked engine with which in-process operations process datasets that may not fit in memory
+        (by default, within the project's thread and memory budgets)
+        '''
+
+        if max_memory is None:
+            max_memory = self.resources.engine_memory
+        if max_workers is None:
+            max_workers = self.resources.threads
+        return engine.ChunkedEngine(max_memory=max_memory, max_workers=max_workers)
+
+
+    def _compute_stats(self, destinations, sources):
+        '''
+        Compute and cache the statistics of the raster files (tifs and raw arrays) of new datasets
+        (files that are also files of the sources, e.g., when a tile pyramid is updated in place, are skipped)
+        '''
+
+        source_files = set(filepath for dataset in sources for filepath in dataset.files())
+        chunked = self._engine()
+        for dataset in destinations:
+            if dataset.type in ['frames', 'tiles']:
+                continue
+            for filepath in dataset.files():
+                if filepath in source_files or not filepath.lower().endswith(('.tif', '.tiff', '.npy')):
+                    continue
+                stats.write(filepath, chunked)
+
+
+    def _run_command(self, command, verbose=True, step=None):
+        '''
+        Run a CLI command within the project's thread and memory budgets,
+        and with the timeout, progress callback and cancellation event of the operation
+        that is running in this thread, if it was submitted (see `submit`)
+
+        step : an optional (index, count) tuple for operations that run one command per band,
+            so that the progress of the command is reported as a fraction of the operation's progress
+
+        Raises subprocess.CalledProcessError if the command fails
+        '''
+
+        state = self._local
+        progress = getattr(state, 'progress', None)
+
+        def _progress(percent):
+            if step is not None:
+                index, count = step
+                percent = (index + percent/100)/count*100
+            progress(percent)
+
+        result = utils.run_command(
+            command,
+            verbose=verbose,
+            env=self.resources.env(),
+            timeout=getattr(state, 'timeout', None),
+            progress=_progress if progress else None,
+            cancel_event=getattr(state, 'cancel_event', None))
+
+        if progress and step is not None:
+            _progress(100)
+        return result
+
+
+    def _report_progress(self, percent):
+        '''
+        Report the progress of an in-process operation to the progress callback of the operation
+        that is running in this thread, if it was submitted (see `submit`),
+        and raise utils.CommandCancelled if the operation was cancelled
+        '''
+
+        state = self._local
+        cancel_event = getattr(state, 'cancel_event', None)
+        if cancel_event is not None and cancel_event.is_set():
+            raise utils.CommandCancelled('The operation was cancelled')
+
+        progress = getattr(state, 'progress', None)
+        if progress:
+            progress(percent)
+
+
+    def submit(self, method, source, timeout=None, progress=None, **kwargs):
+        '''
+        Run an operation in a background thread and return a concurrent.futures.Future
+        whose result is the logged operation
+
+        At most resources.max_operations submitted operations run at once; the rest are queued.
+
+        Parameters
+        ----------
+        method : the name of the operation (e.g., 'merge')
+        source : the source dataset(s) or operation(s), as for the operation itself
+        timeout : the maximum run time, in seconds, of each CLI command that the operation runs
+        progress : an optional function called with the percent complete of the operation,
+            as reported by its CLI commands (most in-process operations do not report progress)
+        kwargs : the operation's kwargs
+
+        Use `cancel(future)` to cancel a submitted operation.
+
+        '''
+
+        operation_method = getattr(self, method)
+        cancel_event = threading.Event()
+
+        def _run():
+            state = self._local
+            state.timeout, state.progress, state.cancel_event = timeout, progress, cancel_event
+            try:
+                return operation_method(source, **kwargs)
+            finally:
+                state.timeout, state.progress, state.cancel_event = None, None, None
+
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.resources.max_operations)
+            future = self._executor.submit(_run)
+
+        future.cancel_event = cancel_event
+        return future
+
+
+    def cancel(self, future):
+        '''
+        Cancel a submitted operation
+
+        A queued operation never runs; a running operation is interrupted when it next runs
+        (or is running) a CLI command, or reports its progress (see `_report_progress`),
+        which raises utils.CommandCancelled.
+        In either case, the operation is not logged.
+        '''
+        future.cancel_event.set()
+        return future.cancel()
+
+
+    def _run_pipeline(self, sources, pipeline, dtype, method):
+        '''
+        Resolve the limits of a pipeline and apply it to every chunk of the sources,
+        writing the result to a new tiled dataset of the intermediate type
+
+        Returns the destination dataset
+        '''
+
+        chunked = self._engine()
+        paths = [source.path for source in sources]
+
+        srcs = [raster_io.open(path) for path in paths]
+        try:
+            if len(set(src.shape for src in srcs)) > 1:
+                raise ValueError('All sources must have the same shape')
+
+            # a one-pixel sample of the sources, to count the bands of the destination
+            sample_window = rasterio.windows.Window(0, 0, 1, 1)
+            sample = [src.read(window=sample_window).astype('float32') for src in srcs]
+            dst_profile = windows.tiled_profile(srcs[0].profile)
+        finally:
+            for src in srcs:
+                src.close()
+
+        def _cached(ind, percentile):
+            limits = stats.cached_limits(paths[ind], percentile, each_band=False, include_nodata=True)
+            return limits[0] if limits else None
+
+        pipeline.resolve_limits(functools.partial(chunked.reduce, paths), sample, cached=_cached)
+
+        count = np.concatenate(pipeline.apply(sample), axis=0).shape[0]
+        dst_profile.update({'count': count, 'dtype': dtype, 'nodata': None})
+
+        destination = self._new_dataset(self._intermediate_type(), method=method)
+        chunked.map(
+            paths, functools.partial(kernels.pipeline, pipeline=pipeline, dtype=dtype), destination.path, dst_profile)
+        return destination
 
 
     @log_operation
-    def merge(self, source, res=None, bounds=None):
+    def merge(self, source, res=None, bounds=None, max_workers=None, bands=None):
         '''
         Create the root dataset by merging and/or cropping the raw dataset(s).
 
         Note that this method and the `warp` method are intended to be the only ways
         to create the root derived dataset; that is, the first operation
         in self.operations should always correspond to either the `merge` or `warp` methods.
+
+        The bands are grouped by the grids of their source files and their resolution,
+        and the layout of the mosaic of each group is planned once (see mosaic.MergePlanner);
+        every band in the group is then pasted chunk-by-chunk using the plan, with the chunks of all of the bands
+        processed in parallel worker threads. Plans are cached, so merging the same raw datasets again
+        (e.g., at a different resolution) does not re-read the headers of the source files.
         
         Parameters
         ----------
         bounds : bounds of the merged dataset in lat/lon degrees
         res: resolution, in units of the source crs
+        max_workers : the number of worker threads (defaults to the project's thread budget)
+        bands : the bands to merge (defaults to all of the bands that the raw datasets are expected to have;
+            only these bands are read, or extracted from the archives of raw Landsat scenes)
 
         '''
 
@@ -228,17 +727,35 @@ class RasterProject(object):
         if self.raw_dataset_type=='ned13':
             output_dataset_type = 'tif'
 
+        if max_workers is None:
+            max_workers = self.resources.threads
+
         destination = self._new_dataset(output_dataset_type, method='merge')
 
+        if bands is None:
+            bands = destination.expected_bands
+        if not bands:
+            raise ValueError('A list of bands must be provided')
+        unexpected_bands = set(bands).difference(destination.expected_bands)
+        if unexpected_bands:
+            raise ValueError('The bands %s are not bands of the raw datasets' % sorted(unexpected_bands))
+
+        # extract the bands of gzipped archives, if any, in one pass over each archive
+        for dataset in source:
+            dataset.prepare(bands)
+
         # transform lat/lon bounds to the source CRS
         # (using the filepath to the first band of the first source)
         if bounds:
-            bounds = utils.transform(bounds, source[0].filepath(destination.expected_bands[0]))
+            bounds = utils.transform(bounds, source[0].filepath(bands[0]))
 
-        for band in destination.expected_bands:
+        # the chunks are square and aligned to the tiles of the destination
+        chunk_size = self._engine().chunk_size(bands=2)
 
+        # plan the mosaic of each group of bands that share source grids and a resolution
+        plans = {}
+        for band in bands:
             src_filepaths = [dataset.filepath(band) for dataset in source]
-            dst_filepath = destination.filepath(band)
 
             # if we are resampling, maintain the right relative resolution
             # (e.g., for a Landsat dataset and res = 100, 
@@ -248,13 +765,30 @@ class RasterProject(object):
             if res and rel_res:
                 final_res *= rel_res
 
-            command = utils.construct_rio_command(
-                'merge', src_filepaths, dst_filepath,
-                bounds=bounds,
-                res=final_res)
+            plans[band] = self.merge_planner.plan(src_filepaths, res=final_res, bounds=bounds, chunk_size=chunk_size)
 
-            utils.run_command(command, verbose=True)
+        tasks = [(band, ind) for band, plan in plans.items() for ind in range(len(plan.chunks))]
 
+        def _read_chunk(readers, task):
+            band, ind = task
+            return plans[band].read_chunk([readers.get(dataset.filepath(band)) for dataset in source], ind)
+
+        dsts = {
+            band: rasterio.open(destination.filepath(band), 'w', **plan.profile) for band, plan in plans.items()}
+        try:
+            with windows.ThreadLocalReaders() as readers:
+                results = windows.map_windows(
+                    lambda task: _read_chunk(readers, task), tasks, max_workers=max_workers)
+
+                for task_ind, ((band, ind), chunk) in enumerate(zip(tasks, results)):
+                    dsts[band].write(chunk, window=plans[band].chunks[ind][0])
+                    self._report_progress((task_ind + 1)/len(tasks)*100)
+        finally:
+            for dst in dsts.values():
+                dst.close()
+
+        # we never used a CLI
+        command = None
         return destination, command
 
 
@@ -267,22 +801,31 @@ class RasterProject(object):
 
 
     @log_operation
-    def warp(self, source, crs=None, res=None, bounds=None):
+    def warp(self, source, crs=None, res=None, bounds=None, max_workers=None):
         '''
-        Reproject and possibly resample a tif dataset
+        Reproject and possibly resample a multi-band dataset (e.g., a Landsat scene)
+
+        The bands are grouped by their source grid and destination resolution
+        (e.g., the panchromatic band, and all of the other bands), and each group is warped in one pass
+        over the blocks of the destination grid: each block of every band in a group is warped
+        by a single call to GDAL's warper, so the coordinate transformation of each block
+        is calculated once per group rather than once per band. Blocks are warped in parallel worker threads.
 
         Parameters
         ----------
         crs : the CRS to which to reproject the dataset (e.g., 'EPSG:3857')
         bounds : bounds of the reprojected dataset in lat/lon degrees
         res: resolution, in units of the *destination* crs
+            (for bands with a relative resolution, e.g. the panchromatic band, this is scaled accordingly)
+        max_workers : the number of worker threads (defaults to the project's thread budget)
 
         Note that resampling must be 'cubic' to avoid grid-like artifacts
         in hillshading of un-downsampled NED13-based datasets
 
+        Pixels that are zero in sources with no nodata value are treated as nodata
+
         '''
 
-        
         if isinstance(source, list):
             if len(source) > 1:
                 raise ValueError('Only one source dataset can be provided to warp')
@@ -291,15 +834,21 @@ class RasterProject(object):
         if crs is None:
             raise ValueError('a crs must be provided')
 
+        if max_workers is None:
+            max_workers = self.resources.threads
+
         destination = self._new_dataset(source.type, method='warp')
 
+        # extract the bands of a gzipped archive, if any, in one pass over the archive
+        source.prepare(source.extant_bands)
+
         # transform bounds from lat/lon to the destination CRS        
         if bounds:
             bounds = utils.transform(bounds, crs)
 
+        # group the bands that share a source grid and a destination resolution
+        groups = {}
         for band in source.extant_bands:
-            src_filepath = source.filepath(band)
-            dst_filepath = destination.filepath(band)
 
             # if we are resampling, maintain the right relative resolution
             final_res = res
@@ -307,15 +856,107 @@ class RasterProject(object):
             if res and rel_res:
                 final_res *= rel_res
 
-            command = utils.construct_rio_command(
-                'warp', src_filepath, dst_filepath,
-                dst_crs=crs,
-                dst_nodata=0,
-                dst_bounds=bounds,
-                resampling='lanczos',
-                res=res)
+            with raster_io.open(source.filepath(band)) as src:
+                key = (src.crs.to_wkt(), tuple(src.transform), src.shape, src.dtypes[0], src.nodata, final_res)
+            groups.setdefault(key, []).append(band)
+
+        # the warper's memory is shared by the worker threads
+        warp_mem_limit = max(self.resources.warp_memory//max_workers, 1)
+
+        num_groups = len(groups)
+        for group_ind, ((src_crs, src_transform, src_shape, dtype, src_nodata, final_res), bands) in enumerate(groups.items()):
+            src_crs = rasterio.crs.CRS.from_wkt(src_crs)
+            src_transform = rasterio.transform.Affine(*src_transform[:6])
+            src_height, src_width = src_shape
+            if src_nodata is None:
+                src_nodata = 0
+
+            # the destination grid is calculated once for the group
+            dst_transform, (dst_height, dst_width) = reproject.destination_grid(
+                src_crs, src_transform, src_shape, crs, res=final_res, bounds=bounds)
+
+            # the resampling scale (destination pixels per source pixel) of the whole destination grid
+            # (GDAL otherwise estimates the scale separately for each block, which changes the kernel's weights
+            # from block to block; this is the scale that it estimates when the grid is warped in one chunk)
+            footprint = rasterio.windows.from_bounds(
+                *rasterio.warp.transform_bounds(
+                    crs, src_crs, *rasterio.transform.array_bounds(dst_height, dst_width, dst_transform),
+                    densify_pts=21),
+                transform=src_transform)
+            try:
+                footprint = footprint.intersection(rasterio.windows.Window(0, 0, src_width, src_height))
+                x_scale, y_scale = dst_width/footprint.width, dst_height/footprint.height
+            except rasterio.errors.WindowError:
+                x_scale, y_scale = 1, 1
+
+            # the number of source pixels on each side of a block's footprint that the lanczos kernel requires
+            # (the kernel's radius is three pixels, scaled by the downsampling factor)
+            halo = int(np.ceil(3/min(x_scale, y_scale, 1))) + 2
+
+            def _warp_block(readers, window):
+
+                # the source window that covers the block's footprint
+                left, bottom, right, top = rasterio.warp.transform_bounds(
+                    crs, src_crs, *rasterio.windows.bounds(window, dst_transform), densify_pts=21)
+                src_window = rasterio.windows.from_bounds(left, bottom, right, top, transform=src_transform)
+                col_start = max(int(np.floor(src_window.col_off)) - halo, 0)
+                row_start = max(int(np.floor(src_window.row_off)) - halo, 0)
+                col_stop = min(int(np.ceil(src_window.col_off + src_window.width)) + halo, src_width)
+                row_stop = min(int(np.ceil(src_window.row_off + src_window.height)) + halo, src_height)
+                if col_start >= col_stop or row_start >= row_stop:
+                    return None
+
+                src_window = rasterio.windows.Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+                im = np.stack(
+                    [readers.get(source.filepath(band)).read(1, window=src_window) for band in bands])
+
+                # every band is warped by one call, which transforms the block's coordinates once
+                dst_im = np.zeros((len(bands), window.height, window.width), dtype=dtype)
+                rasterio.warp.reproject(
+                    im,
+                    dst_im,
+                    src_transform=rasterio.windows.transform(src_window, src_transform),
+                    src_crs=src_crs,
+                    src_nodata=src_nodata,
+                    dst_transform=rasterio.windows.transform(window, dst_transform),
+                    dst_crs=crs,
+                    dst_nodata=0,
+                    resampling=Resampling.lanczos,
+                    num_threads=1,
+                    warp_mem_limit=warp_mem_limit,
+                    XSCALE=x_scale,
+                    YSCALE=y_scale)
+                return dst_im
+
+            with raster_io.open(source.filepath(bands[0])) as src:
+                dst_profile = windows.tiled_profile(src.profile)
+            dst_profile.update({
+                'crs': crs,
+                'transform': dst_transform,
+                'width': dst_width,
+                'height': dst_height,
+                'nodata': 0,
+            })
+
+            dsts = [rasterio.open(destination.filepath(band), 'w', **dst_profile) for band in bands]
+            try:
+                block_windows = list(windows.block_windows(dst_width, dst_height))
+                with windows.ThreadLocalReaders() as readers:
+                    results = windows.map_windows(
+                        lambda window: _warp_block(readers, window), block_windows, max_workers=max_workers)
+
+                    # blocks outside of the source are never written (they are nodata)
+                    for ind, (window, dst_im) in enumerate(zip(block_windows, results)):
+                        if dst_im is not None:
+                            for dst, band_im in zip(dsts, dst_im):
+                                dst.write(band_im, 1, window=window)
+                        self._report_progress((group_ind + (ind + 1)/len(block_windows))/num_groups*100)
+            finally:
+                for dst in dsts:
+                    dst.close()
 
-            utils.run_command(command)
+        # we never used a CLI
+        command = None
         return destination, command
 
 
@@ -329,58 +970,516 @@ class RasterProject(object):
 
         '''
 
-        images = []
+        counts = []
         for source in sources:
-            with rasterio.open(source.path) as src:
-                images.append(src.read().astype('float'))
+            with raster_io.open(source.path) as src:
+                counts.append(src.count)
+
+        if counts not in [[1, 3], [3, 1]]:
+            raise ValueError('Unexpected numbers of bands: %s' % counts)
+
+        # multiply-blend the BW image with the RGB image;
+        # this is processed chunk-by-chunk in float32, so the images need not fit in memory
+        steps = [
+            {'method': 'autoscale', 'image': counts.index(1)},
+            {'method': 'multiply', 'weight': weight},
+            {'method': 'autoscale'},
+        ]
+        if gamma:
+            steps.append({'method': 'gamma', 'gamma': gamma})
 
-        if images[0].shape[0]==1 and images[1].shape[0]==3:
-            im_bw, im_rgb = images
-        elif images[1].shape[0]==1 and images[0].shape[0]==3:
-            im_rgb, im_bw = images
-        else:
-            raise ValueError('Unexpected image dimensions: %s, %s' % (images[0].shape, images[1].shape))
+        # hard-coded 'uint8' dtype for now
+        destination = self._run_pipeline(sources, pipelines.Pipeline(steps), 'uint8', 'multiply')
 
-        # rasterio loads the color channel into the first dimension
-        im_bw = im_bw[0, :, :]
-        im_rgb = np.swapaxes(im_rgb, 0, 1)
-        im_rgb = np.swapaxes(im_rgb, 1, 2)
+        # we never used a CLI
+        command = None
 
-        # multiply-blend the BW image with the RGB image
-        im_bw = utils.autoscale(im_bw, percentile=100)
-        if weight:
-            im_bw *= weight
+        return destination, command
 
-        im_rgb *= im_bw[:, :, None]
-        im_rgb = utils.autoscale(im_rgb, percentile=100)
 
-        if gamma:
-            im_rgb **= gamma
+    @log_operation
+    def pipeline(self, sources, steps=None, dtype=None):
+        '''
+        Apply a sequence of per-pixel steps to one or more datasets in a single windowed pass,
+        without writing the intermediate results to disk
 
-        # hard-coded 'uint8' dtype for now
-        dtype = 'uint8'
-        dtype_max = 255
-    
-        im_rgb = (im_rgb*dtype_max).astype(dtype)
+        For example, this is equivalent to `multiply_rgb(sources, gamma=.7, weight=.9)`
+        for sources=[hillshade, color_relief]:
 
-        # move the color channel into the first dimension
-        im_rgb = np.concatenate(
-            (im_rgb[None, :, :, 0], im_rgb[None, :, :, 1], im_rgb[None, :, :, 2]),
-            axis=0)
+            steps=[
+                {'method': 'autoscale', 'image': 0},
+                {'method': 'multiply', 'weight': .9},
+                {'method': 'autoscale'},
+                {'method': 'gamma', 'gamma': .7},
+            ]
 
-        # destination dataset
-        destination = self._new_dataset('tif', method='multiply')
+        Each step is recorded (in order) in the operation's kwargs, so that the pipeline is serialized
+        and can be re-run like any other operation. See `pipelines` for the available steps.
 
-        with rasterio.open(sources[0].path) as src:
-            dst_profile = src.profile
-            dst_profile['dtype'] = dtype
-            dst_profile['count'] = 3
-            with rasterio.open(destination.path, 'w', **dst_profile) as dst:
-                dst.write(im_rgb)
+        Parameters
+        ----------
+        sources : a list of datasets (tif or raw) with the same shape
+        steps : a list of steps, each a dict of the form {'method': <step name>, **kwargs}
+        dtype : the dtype of the destination (defaults to float32);
+            for integer dtypes, the result of the pipeline must be normalized to [0, 1]
+
+        Note that each autoscale step without explicit limits requires a read-only pass over the sources
+
+        '''
+
+        if not isinstance(sources, list):
+            sources = [sources]
+
+        if dtype is None:
+            dtype = 'float32'
+
+        destination = self._run_pipeline(sources, pipelines.Pipeline(steps), dtype, 'pipeline')
 
         # we never used a CLI
         command = None
+        return destination, command
+
+
+    @log_operation
+    def export(self, source, compress=None):
+        '''
+        Export a dataset (usually a raw intermediate dataset) to a tiled GeoTIFF
+
+        Parameters
+        ----------
+        source : a tif or raw dataset
+        compress : an optional GeoTIFF compression method (e.g., 'deflate')
+
+        '''
+
+        destination = self._new_dataset('tif', method='export')
+
+        with raster_io.open(source.path) as src:
+            dst_profile = windows.tiled_profile(src.profile)
+            if compress:
+                dst_profile['compress'] = compress
 
+            with raster_io.open(destination.path, 'w', **dst_profile) as dst:
+                for window in windows.block_windows(src.width, src.height):
+                    dst.write(src.read(window=window), window=window)
+
+        # we never used a CLI
+        command = None
+        return destination, command
+
+
+    def _grid_filepath(self, dataset):
+        '''
+        The filepath of a raster file that has the grid (CRS, transform and shape) of a dataset
+        (for multi-file datasets, the first extant band, which is assumed to have the grid of the dataset)
+        '''
+        if dataset.type in ['tif', 'raw']:
+            return dataset.path
+        return dataset.filepath(dataset.extant_bands[0])
+
+
+    @log_operation
+    def rasterize(
+        self,
+        source,
+        features=None,
+        where=None,
+        property=None,
+        values=None,
+        widths=None,
+        default_value=None,
+        all_touched=True,
+        max_workers=None):
+        '''
+        Rasterize vector features (e.g., roads or rivers) onto the grid of a dataset,
+        as a single-band uint8 overlay that can be composited into a rendered map (e.g., with `pipeline`)
+
+        Features are streamed from the vector file, and only those that match the attribute filter
+        and intersect the dataset's bounds are kept. They are then burned block-by-block
+        (in parallel worker threads), each block from only the features that intersect it.
+
+        For example, to burn major roads, with wider and brighter motorways,
+        from an OpenStreetMap roads shapefile:
+
+            proj.rasterize(
+                source,
+                features='gis_osm_roads_free_1.shp',
+                where={'fclass': ['motorway', 'trunk', 'primary']},
+                property='fclass',
+                values={'motorway': 255, 'trunk': 200},
+                widths={'motorway': 5, 'trunk': 3},
+                default_value=128)
+
+        Parameters
+        ----------
+        source : the dataset whose grid is the target (tif and raw datasets, or the bands of other datasets)
+        features : the path to a vector file, or GeoJSON features or geometries in EPSG:4326
+        where : an optional attribute filter, as a dict of {property name: value or list of values}
+        property : the name of the property that defines the class of each feature
+        values : an optional dict of {class: value} of the value to burn for each class
+        widths : an optional dict of {class: width} of the width in pixels of the features of each class
+            (the burned features are dilated by a square of this width)
+        default_value : the value to burn for features whose class is not in `values` (defaults to 255)
+        all_touched : whether to burn every pixel that a feature touches
+            (rather than only those whose centers are inside of polygons or on the path of lines)
+        max_workers : the number of worker threads (defaults to the project's thread budget)
+
+        Where features overlap, the largest value is burned.
+
+        '''
+
+        if isinstance(source, list):
+            if len(source) > 1:
+                raise ValueError('Only one source dataset can be provided to rasterize')
+            source = source[0]
+
+        if features is None:
+            raise ValueError('A vector file or GeoJSON features must be provided')
+
+        if default_value is None:
+            default_value = 255
+        if max_workers is None:
+            max_workers = self.resources.threads
+
+        values = values or {}
+        widths = widths or {}
+        if (values or widths) and property is None:
+            raise ValueError('A property must be provided to burn per-class values or widths')
+
+        with raster_io.open(self._grid_filepath(source)) as src:
+            crs, transform, shape = src.crs, src.transform, src.shape
+            dst_profile = windows.tiled_profile(src.profile)
+            dst_profile.update({'count': 1, 'dtype': 'uint8', 'nodata': None})
+            features = vectors.read_features(features, crs, bounds=tuple(src.bounds), where=where)
+
+        # the value and width of each feature
+        classes = [feature['properties'].get(property) if property else None for feature in features]
+        feature_values = [values.get(class_, default_value) for class_ in classes]
+        feature_widths = [int(widths.get(class_) or 1) for class_ in classes]
+
+        # burn the features in order of increasing value, so that the largest value wins
+        order = np.argsort(feature_values, kind='stable')
+        geometries = [features[ind]['geometry'] for ind in order]
+        feature_values = [feature_values[ind] for ind in order]
+        feature_widths = [feature_widths[ind] for ind in order]
+
+        index = vectors.BoundsIndex(geometries)
+
+        # blocks are padded by half of the largest width, so that dilation is continuous across blocks
+        halo = max(feature_widths, default=1)//2
+        height, width = shape
+
+        def burn(window):
+
+            # the padded window, clipped to the grid
+            row_start, col_start = max(window.row_off - halo, 0), max(window.col_off - halo, 0)
+            row_stop = min(window.row_off + window.height + halo, height)
+            col_stop = min(window.col_off + window.width + halo, width)
+            padded_window = rasterio.windows.Window(
+                col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+            hits = index.query(vectors.window_bounds(padded_window, transform))
+            if not len(hits):
+                return None
+
+            padded_transform = rasterio.windows.transform(padded_window, transform)
+            im = np.zeros((padded_window.height, padded_window.width), dtype='uint8')
+
+            # rasterize the features of each width together, and then dilate them
+            for feature_width in sorted(set(feature_widths[ind] for ind in hits)):
+                shapes = [(geometries[ind], feature_values[ind]) for ind in hits if feature_widths[ind] == feature_width]
+                burned = rasterio.features.rasterize(
+                    shapes,
+                    out_shape=im.shape,
+                    transform=padded_transform,
+                    all_touched=all_touched,
+                    fill=0,
+                    dtype='uint8')
+                np.maximum(im, vectors.dilate(burned, feature_width), out=im)
+
+            row_off, col_off = window.row_off - row_start, window.col_off - col_start
+            return im[row_off:row_off + window.height, col_off:col_off + window.width]
+
+        destination = self._new_dataset(self._intermediate_type(), method='rasterize')
+        block_windows = list(windows.block_windows(width, height))
+        with raster_io.open(destination.path, 'w', **dst_profile) as dst:
+            results = windows.map_windows(burn, block_windows, max_workers=max_workers)
+
+            # blocks without any features are never written (they remain zero)
+            for window, im in zip(block_windows, results):
+                if im is not None:
+                    dst.write(im, 1, window=window)
+
+        # we never used a CLI
+        command = None
+        return destination, command
+
+
+    @log_operation
+    def mask(
+        self,
+        source,
+        features=None,
+        where=None,
+        crop=True,
+        invert=False,
+        all_touched=False,
+        per_feature=False,
+        max_workers=None):
+        '''
+        Mask (and, optionally, crop) a dataset to polygon features (e.g., park or county boundaries)
+
+        Only the blocks of the dataset that intersect the features' bounding boxes are read and written
+        (the bounding boxes are indexed, so each block is tested against all of the features at once),
+        and the mask of each block is rasterized once from only the features that intersect it.
+        Blocks are processed in parallel worker threads.
+
+        Parameters
+        ----------
+        source : a tif or raw dataset
+        features : the path to a vector file, or GeoJSON features or geometries in EPSG:4326
+        where : an optional attribute filter, as a dict of {property name: value or list of values}
+        crop : whether to crop the destination to the bounds of the features
+        invert : if True, mask the pixels inside of the features rather than those outside of them
+            (the destination is then never cropped, and every block is read)
+        all_touched : whether to keep every pixel that a feature touches
+            (rather than only those whose centers are inside of the features)
+        per_feature : if True, create one destination for each feature, cropped to its bounds
+            (the features are processed in parallel)
+        max_workers : the number of worker threads (defaults to the project's thread budget)
+
+        Masked pixels are set to the dataset's nodata value (or to zero, which then becomes the nodata value).
+
+        '''
+
+        if isinstance(source, list):
+            if len(source) > 1:
+                raise ValueError('Only one source dataset can be provided to mask')
+            source = source[0]
+
+        if source.type not in ['tif', 'raw']:
+            raise ValueError('Only tif and raw datasets can be masked')
+
+        if features is None:
+            raise ValueError('A vector file or GeoJSON features must be provided')
+
+        if max_workers is None:
+            max_workers = self.resources.threads
+
+        with raster_io.open(source.path) as src:
+            profile = src.profile
+            src_transform = src.transform
+            height, width = src.shape
+            nodata = src.nodata if src.nodata is not None else 0
+            features = vectors.read_features(features, src.crs, bounds=tuple(src.bounds), where=where)
+
+        if not features:
+            raise ValueError('No features intersect the source dataset')
+
+        geometries = [feature['geometry'] for feature in features]
+        index = vectors.BoundsIndex(geometries)
+        full_window = rasterio.windows.Window(0, 0, width, height)
+
+        def _extent(indices):
+            '''
+            The window of the source grid that contains the features, aligned to the source pixels
+            '''
+
+            if invert or not crop:
+                return full_window
+
+            window = rasterio.windows.from_bounds(*index.total_bounds(indices), transform=src_transform)
+            col_start, row_start = max(int(np.floor(window.col_off)), 0), max(int(np.floor(window.row_off)), 0)
+            col_stop = min(int(np.ceil(window.col_off + window.width)), width)
+            row_stop = min(int(np.ceil(window.row_off + window.height)), height)
+            return rasterio.windows.Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+        def _mask(destination, indices, max_workers):
+            '''
+            Mask a source to a subset of the features and write the result to a destination
+            '''
+
+            extent = _extent(indices)
+            dst_profile = windows.tiled_profile(profile)
+            dst_profile.update({
+                'width': extent.width,
+                'height': extent.height,
+                'transform': rasterio.windows.transform(extent, src_transform),
+                'nodata': nodata,
+            })
+
+            indices = np.array(indices)
+            subset_index = vectors.BoundsIndex([geometries[ind] for ind in indices])
+
+            def process(readers, window):
+
+                # the window of the source grid
+                src_window = rasterio.windows.Window(
+                    window.col_off + extent.col_off, window.row_off + extent.row_off, window.width, window.height)
+                block_transform = rasterio.windows.transform(src_window, src_transform)
+
+                hits = indices[subset_index.query(vectors.window_bounds(src_window, src_transform))]
+                if not len(hits) and not invert:
+                    return None
+
+                im = readers.get(source.path).read(window=src_window)
+                inside = np.zeros(im.shape[1:], dtype=bool)
+                if len(hits):
+                    inside = rasterio.features.geometry_mask(
+                        [geometries[ind] for ind in hits],
+                        out_shape=inside.shape,
+                        transform=block_transform,
+                        all_touched=all_touched,
+                        invert=True)
+
+                keep = ~inside if invert else inside
+                return np.where(keep[None, :, :], im, nodata).astype(im.dtype)
+
+            # blocks that no feature intersects are never read or written; they are nodata
+            # (GDAL fills unwritten GeoTIFF blocks with the nodata value, but raw arrays are zero-filled)
+            fill_skipped = raster_io.is_raw(destination.path) and nodata != 0
+
+            block_windows = list(windows.block_windows(extent.width, extent.height))
+            with windows.ThreadLocalReaders() as readers:
+                with raster_io.open(destination.path, 'w', **dst_profile) as dst:
+                    results = windows.map_windows(
+                        lambda window: process(readers, window), block_windows, max_workers=max_workers)
+
+                    for window, im in zip(block_windows, results):
+                        if im is not None:
+                            dst.write(im, window=window)
+                        elif fill_skipped:
+                            dst.write(
+                                np.full((dst_profile['count'], window.height, window.width), nodata, dtype=dst_profile['dtype']),
+                                window=window)
+
+        if not per_feature:
+            destination = self._new_dataset(self._intermediate_type(), method='mask')
+            _mask(destination, list(range(len(features))), max_workers)
+
+        # one destination for each feature, masked in parallel
+        else:
+            destination = [
+                self._new_dataset(self._intermediate_type(), method='mask') for _ in features]
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(
+                    lambda ind: _mask(destination[ind], [ind], 1), range(len(features))))
+
+        # we never used a CLI
+        command = None
+        return destination, command
+
+
+    @log_operation
+    def export_tiles(self, source, format=None, min_zoom=None, max_zoom=None, bounds=None, tiles_path=None):
+        '''
+        Export an RGB dataset in EPSG:3857 to a pyramid of web map tiles (see tiles.py)
+
+        The tiles at max_zoom are rendered from the source in parallel worker threads,
+        and the tiles at each lower zoom are built from the tiles beneath them.
+        Empty tiles (those with no data) are not written.
+
+        For example, to re-export only the region of a DEM project's final product that changed,
+        after re-running its operations over that region:
+
+            proj.export_tiles(new_rgb, bounds=changed_bounds, tiles_path=previous_export.destination.path)
+
+        Parameters
+        ----------
+        source : a three-band (RGB) uint8 tif dataset in EPSG:3857
+            (e.g., the destination of multiply_rgb; raw datasets must be exported first)
+        format : either 'xyz' (the default), for a directory of {z}/{x}/{y}.png tiles,
+            or 'mbtiles', for an MBTiles (SQLite) file
+        min_zoom : the lowest zoom level (defaults to zero)
+        max_zoom : the highest zoom level (defaults to the zoom that matches the source's resolution)
+        bounds : optional bounds in lat/lon degrees to which to limit the export
+        tiles_path : the path to an existing tile pyramid to update in place
+            (only the tiles that intersect bounds, and the lower-zoom tiles that contain them, are re-rendered;
+            tiles that are now empty are removed)
+
+        '''
+
+        if isinstance(source, list):
+            if len(source) > 1:
+                raise ValueError('Only one source dataset can be provided to export_tiles')
+            source = source[0]
+
+        if source.type != 'tif':
+            raise ValueError('Tiles can only be exported from tif datasets')
+
+        with raster_io.open(source.path) as src:
+            if src.crs is None or src.crs.to_epsg() != 3857:
+                raise ValueError('The source dataset must be in EPSG:3857; warp it first')
+            if src.count < 3 or src.dtypes[0] != 'uint8':
+                raise ValueError('The source dataset must be a uint8 RGB dataset')
+
+            src_bounds = tuple(src.bounds)
+            if max_zoom is None:
+                max_zoom = tiles.native_zoom(max(src.res))
+
+        if min_zoom is None:
+            min_zoom = 0
+        if min_zoom > max_zoom:
+            raise ValueError('min_zoom must not be greater than max_zoom')
+
+        # the region to (re-)render
+        region = src_bounds
+        if bounds is not None:
+            region = tiles.intersection(
+                rasterio.warp.transform_bounds('EPSG:4326', 'EPSG:3857', *bounds), src_bounds)
+            if region is None:
+                raise ValueError('The bounds do not intersect the source dataset')
+
+        if tiles_path is not None:
+            destination = datasets.new_dataset('tiles', tiles_path, exists=True)
+        else:
+            destination = self._new_dataset('tiles', method='export_tiles', format=format)
+
+        max_workers = self.resources.threads
+        store = tiles.open_store(destination)
+        try:
+            # (the store is read and written only by this thread)
+            with windows.ThreadLocalReaders() as readers:
+
+                # render the tiles at the highest zoom from the source
+                tasks = [(max_zoom, x, y) for x, y in tiles.tile_range(region, max_zoom)]
+                results = windows.map_windows(
+                    lambda task: tiles.render_tile(readers.get(source.path), task), tasks, max_workers=max_workers)
+
+                changed = set()
+                for z, x, y, data in results:
+                    store.put(z, x, y, data)
+                    changed.add((x, y))
+
+                # build each lower zoom from the zoom beneath it
+                # (in batches, so that only one batch of child tiles is in memory at a time)
+                batch_size = 1024
+                for z in range(max_zoom - 1, min_zoom - 1, -1):
+                    parents = sorted(set((x//2, y//2) for x, y in changed))
+
+                    changed = set()
+                    for ind in range(0, len(parents), batch_size):
+                        tasks = [
+                            (z, x, y, [store.get(z + 1, 2*x + dx, 2*y + dy) for dy in (0, 1) for dx in (0, 1)])
+                            for x, y in parents[ind:ind + batch_size]]
+
+                        for z_, x, y, data in windows.map_windows(tiles.build_tile, tasks, max_workers=max_workers):
+                            store.put(z_, x, y, data)
+                            changed.add((x, y))
+
+            west, south, east, north = rasterio.warp.transform_bounds('EPSG:3857', 'EPSG:4326', *src_bounds)
+            store.set_metadata({
+                'name': destination.name,
+                'format': 'png',
+                'minzoom': min_zoom,
+                'maxzoom': max_zoom,
+                'bounds': '%f,%f,%f,%f' % (west, south, east, north),
+            })
+        finally:
+            store.close()
+
+        # we never used a CLI
+        command = None
         return destination, command
 
 
@@ -402,14 +1501,25 @@ class RasterProject(object):
 
         '''
 
+        # a new project has no operations yet
+        if not self.operations:
+            return
+
         # the first operation must be a merge or a warp
+        # (or, for GOES projects, a harmonize, which is a multi-band warp)
         operation = self.operations[0]
-        assert(operation.method in ['merge', 'warp'])
+        assert(operation.method in ['merge', 'warp', 'harmonize'])
 
         res = operation.kwargs.get('res')
         bounds = operation.kwargs.get('bounds')
 
-        with rasterio.open(operation.destination.filepath(1)) as src:
+        # the first band of the root dataset, which (e.g., for a merge of some of the bands) may not be band 1
+        # (bands with a relative resolution, like the pan band, are used only if there are no others)
+        destination = self._existing(operation.destination)
+        extant_bands = getattr(destination, 'extant_bands', None) or [1]
+        band = ([band for band in extant_bands if band not in destination.rel_band_res] or extant_bands)[0]
+
+        with rasterio.open(destination.filepath(band)) as src:
 
             # tolerance for comparing actual to expected bounds
             tolerance = max(src.res)*2
@@ -426,10 +1536,278 @@ class RasterProject(object):
 
 
 class GOESProject(RasterProject):
+
+    # directory, relative to the project root, in which reprojection maps are cached
+    _pixel_map_dir = os.path.join('cache', 'pixel-maps')
+
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, raw_dataset_type='goes', **kwargs)
 
 
+    def _pixel_maps(self, srcs, crs, dst_transform, dst_shape):
+        '''
+        Load the cached pixel maps from a destination grid to the grids of a list of open bands
+
+        The GOES fixed grid is the same for every scan of a sector,
+        so the maps for a given destination grid are calculated only once per project
+        and then reused for every timestep
+        '''
+
+        cache = reproject.PixelMapCache(os.path.join(self.project_root, self._pixel_map_dir))
+        return cache.get(
+            srcs[0].crs,
+            [(src.transform, src.shape) for src in srcs],
+            crs, dst_transform, dst_shape)
+
+
+    @log_operation
+    def warp(self, source, crs=None, res=None, bounds=None):
+        '''
+        Reproject and possibly resample a GOES dataset
+
+        This overrides RasterProject.warp (which warps each group of bands block-by-block with GDAL's warper)
+        with a gather-and-interpolate using cached pixel maps;
+        only the first warp of a scan sector to a given grid pays for the per-pixel transformation.
+
+        Parameters are the same as for RasterProject.warp, and `res` is the resolution of the 1km bands
+
+        Note that bands are bilinearly interpolated
+
+        '''
+
+        if isinstance(source, list):
+            if len(source) > 1:
+                raise ValueError('Only one source dataset can be provided to warp')
+            source = source[0]
+
+        if crs is None:
+            raise ValueError('a crs must be provided')
+
+        destination = self._new_dataset(source.type, method='warp')
+
+        # transform bounds from lat/lon to the destination CRS
+        if bounds:
+            bounds = utils.transform(bounds, crs)
+
+        for band in source.extant_bands:
+
+            # maintain the right relative resolution
+            final_res = res
+            rel_res = destination.rel_band_res.get(band)
+            if res and rel_res:
+                final_res *= rel_res
+
+            with raster_io.open(source.filepath(band)) as src:
+                dst_transform, (dst_height, dst_width) = reproject.destination_grid(
+                    src.crs, src.transform, src.shape, crs, res=final_res, bounds=bounds)
+
+                pixel_map, = self._pixel_maps([src], crs, dst_transform, (dst_height, dst_width))
+
+                dst_profile = windows.tiled_profile(src.profile)
+                dst_profile.update({
+                    'crs': crs,
+                    'transform': dst_transform,
+                    'width': dst_width,
+                    'height': dst_height,
+                    'nodata': 0,
+                })
+
+                with rasterio.open(destination.filepath(band), 'w', **dst_profile) as dst:
+                    for window in windows.block_windows(dst_width, dst_height):
+                        dst.write(reproject.gather(src, pixel_map.window(window)), 1, window=window)
+
+        # we never used a CLI
+        command = None
+        return destination, command
+
+
+    @log_operation
+    def harmonize(self, source, bands=None, crs=None, res=None, bounds=None):
+        '''
+        Resample bands of different native resolutions onto a common grid
+        and write them to a single multi-band, pixel-interleaved tif
+
+        This replaces warping each band separately and then stacking the warped bands.
+        The destination is written window-by-window, and the projection of each window's pixels
+        into the source CRS is calculated once and shared by all of the bands
+        (the bands differ only in their source transforms).
+        The resulting pixel maps are cached (see `_pixel_maps`).
+
+        Parameters
+        ----------
+        source : a GOES dataset
+        bands : the bands to include, in order (e.g., [2, 3, 1]); defaults to all extant bands
+        crs : the destination CRS (defaults to the CRS of the source)
+        res : resolution, in units of the destination crs (defaults to the res of the finest band)
+        bounds : bounds of the destination dataset in lat/lon degrees
+
+        Note that bands are bilinearly interpolated
+
+        '''
+
+        if isinstance(source, list):
+            if len(source) > 1:
+                raise ValueError('Only one source dataset can be provided to harmonize')
+            source = source[0]
+
+        if bands is None:
+            bands = source.extant_bands
+
+        srcs = [raster_io.open(source.filepath(band)) for band in bands]
+        try:
+            if len(set(src.crs.to_wkt() for src in srcs)) > 1:
+                raise ValueError('All bands must have the same CRS')
+
+            # the band with the finest resolution defines the default destination grid
+            finest = min(srcs, key=lambda src: src.res[0])
+            if crs is None:
+                crs = finest.crs
+
+            if bounds:
+                bounds = utils.transform(bounds, crs)
+
+            dst_transform, (dst_height, dst_width) = reproject.destination_grid(
+                finest.crs, finest.transform, finest.shape, crs, res=res, bounds=bounds)
+
+            pixel_maps = self._pixel_maps(srcs, crs, dst_transform, (dst_height, dst_width))
+
+            dtype = finest.profile['dtype']
+            dst_profile = windows.tiled_profile(finest.profile)
+            dst_profile.update({
+                'crs': crs,
+                'transform': dst_transform,
+                'width': dst_width,
+                'height': dst_height,
+                'count': len(bands),
+                'nodata': 0,
+            })
+
+            destination = self._new_dataset('tif', method='harmonize')
+            with rasterio.open(destination.path, 'w', **dst_profile) as dst:
+                for window in windows.block_windows(dst_width, dst_height):
+                    im_dst = np.zeros((len(bands), window.height, window.width), dtype=dtype)
+                    for ind, (src, pixel_map) in enumerate(zip(srcs, pixel_maps)):
+                        im_dst[ind, :, :] = reproject.gather(src, pixel_map.window(window), dtype)
+                    dst.write(im_dst, window=window)
+        finally:
+            for src in srcs:
+                src.close()
+
+        # we never used a CLI
+        command = None
+        return destination, command
+
+
+    @log_operation
+    def animate(
+        self,
+        sources,
+        bands=None,
+        minn=None,
+        maxx=None,
+        percentile=None,
+        gamma=None,
+        animation=None,
+        duration=None,
+        max_workers=None):
+        '''
+        Render an ordered sequence of datasets (e.g., a sunset) as numbered PNG frames
+        and, optionally, as an animated GIF
+
+        Every frame is rendered with the same recipe: the intensities of each band between minn and maxx
+        are mapped to gamma-corrected uint8 values by a lookup table that is calculated once
+        and shared by the worker threads. Frames are rendered in parallel worker threads
+        but are collected (and appended to the animation) in order.
+
+        Parameters
+        ----------
+        sources : an ordered list of GOES or tif datasets (e.g., the destinations of `harmonize`)
+        bands : one band (grayscale) or three bands (RGB), e.g., [2, 3, 1] for a tif from `harmonize`
+        minn, maxx : the autoscale limits, as either a single value or a list of one value per band;
+            if None, the limits are calculated from the first dataset using `percentile`
+        percentile : see utils.autoscale
+        gamma : the gamma, as either a single value or a list of one value per band
+        animation : if 'gif', also write an animated GIF of the frames (requires Pillow)
+        duration : the duration of each frame of the animation in milliseconds (defaults to 100)
+        max_workers : the number of worker threads (defaults to the project's thread budget)
+
+        '''
+
+        if not isinstance(sources, list):
+            sources = [sources]
+
+        if max_workers is None:
+            max_workers = self.resources.threads
+
+        if bands is None or len(bands) not in [1, 3]:
+            raise ValueError('Either one or three bands must be provided')
+
+        if animation not in [None, 'gif']:
+            raise ValueError('%s is not a supported animation format' % animation)
+
+        if duration is None:
+            duration = 100
+
+        if animation == 'gif':
+            # Pillow is an optional dependency (installed with matplotlib)
+            from PIL import Image
+
+        def _per_band(value):
+            if isinstance(value, (list, tuple)):
+                return list(value)
+            return [value]*len(bands)
+
+        # the limits and LUT for each band
+        limits = []
+        first_sources = render.band_sources(sources[0], bands)
+        for (filepath, band), minn_, maxx_ in zip(first_sources, _per_band(minn), _per_band(maxx)):
+            if minn_ is None or maxx_ is None:
+                pmin, pmax = render.autoscale_limits(filepath, band, percentile)
+                minn_ = pmin if minn_ is None else minn_
+                maxx_ = pmax if maxx_ is None else maxx_
+            limits.append((minn_, maxx_))
+
+        luts = [render.scaling_lut(gamma_) for gamma_ in _per_band(gamma)]
+
+        destination = self._new_dataset('frames', method='animate')
+        tasks = [
+            (render.band_sources(dataset, bands), destination.filepath(ind))
+            for ind, dataset in enumerate(sources)]
+
+        # the frame filepaths, in order, as each frame is completed
+        frame_filepaths = windows.map_windows(
+            functools.partial(render.render_frame, luts=luts, limits=limits), tasks, max_workers=max_workers)
+
+        if animation == 'gif':
+            frames = (Image.open(filepath) for filepath in frame_filepaths)
+            next(frames).save(
+                destination.animation_path('gif'),
+                save_all=True,
+                append_images=frames,
+                duration=duration,
+                loop=0)
+        else:
+            frame_filepaths = list(frame_filepaths)
+
+        # list the frames, their sources, and the resolved rendering parameters
+        manifest = {
+            'bands': bands,
+            'limits': limits,
+            'gamma': _per_band(gamma),
+            'frames': [
+                {'filename': os.path.split(frame_filepath)[-1], 'source': dataset.path}
+                for (_, frame_filepath), dataset in zip(tasks, sources)],
+        }
+        with open(destination.manifest_path, 'w') as file:
+            json.dump(manifest, file)
+
+        # we never used a CLI
+        command = None
+        return destination, command
+
+
+
 class LandsatProject(RasterProject):
 
     def __init__(self, *args, **kwargs):
@@ -437,26 +1815,81 @@ class LandsatProject(RasterProject):
 
 
     @log_operation
-    def stack(self, source, bands=None):
+    def stack(self, source, bands=None, dtype=None, scale=None, percentile=None, max_workers=None):
         '''
+        Stack bands of a Landsat dataset in a single tiled, pixel-interleaved tif
+
+        The bands are copied window-by-window (in parallel worker threads),
+        and can be cast, scaled, or autogained as they are copied,
+        so that 'stack and then autogain' requires neither an intermediate stack
+        nor a second read of the stacked bands.
+
+        Parameters
+        ----------
         source : a Landsat dataset
-        bands : a list of three Landsat bands
+        bands : a list of Landsat bands (e.g., [4, 3, 2])
+        dtype : the dtype of the stack (defaults to the dtype of the bands, or to 'uint8' if autogaining)
+        scale : an optional factor by which to multiply the bands before casting them to dtype
+        percentile : if not None, autogain each band, as `autogain(..., percentile, each_band=True)` would;
+            the min/max intensities are calculated as `autogain` calculates them
+            (from the cached statistics of the source bands, or else from one additional read of each band)
+        max_workers : the number of worker threads (defaults to the project's thread budget)
+
         '''
 
-        bands = list(map(str, bands))
-        destination = self._new_dataset('tif', method='stack')
+        if max_workers is None:
+            max_workers = self.resources.threads
+
+        if bands is None:
+            raise ValueError('A list of bands must be provided')
+
+        source.prepare(bands)
         src_filepaths = [source.filepath(band) for band in bands]
+        with raster_io.open(src_filepaths[0]) as src:
+            src_dtype = src.profile['dtype']
+            dst_profile = windows.tiled_profile(src.profile)
 
-        command = utils.construct_rio_command(
-            'stack',
-            src_filepaths,
-            destination.path,
-            overwrite=True,
-            rgb=True)
+        if dtype is None:
+            dtype = src_dtype if percentile is None else 'uint8'
 
-        utils.run_command(command)
-        return destination, command
+        dst_profile.update({'count': len(bands), 'dtype': dtype})
+        if len(bands) == 3:
+            dst_profile['photometric'] = 'RGB'
+
+        # the min/max intensity of each band for autogaining
+        limits = []
+        if percentile is not None:
+            chunked = self._engine()
+            for filepath in src_filepaths:
+                limits.extend(engine.percentile_limits(chunked, filepath, percentile))
+
+        def copy(readers, window):
+            im_dst = np.array([readers.get(filepath).read(1, window=window) for filepath in src_filepaths])
 
+            if limits:
+                im_dst = np.array([
+                    utils.autoscale(im, minn=minn, maxx=maxx) for im, (minn, maxx) in zip(im_dst, limits)])
+                if np.issubdtype(np.dtype(dtype), np.integer):
+                    im_dst *= np.iinfo(dtype).max
+
+            if scale is not None:
+                im_dst = im_dst*scale
+
+            return im_dst.astype(dtype)
+
+        destination = self._new_dataset(self._intermediate_type(), method='stack')
+        with windows.ThreadLocalReaders() as readers:
+            block_windows = list(windows.block_windows(dst_profile['width'], dst_profile['height']))
+            results = windows.map_windows(
+                lambda window: copy(readers, window), block_windows, max_workers=max_workers)
+
+            with raster_io.open(destination.path, 'w', **dst_profile) as dst:
+                for window, im_dst in zip(block_windows, results):
+                    dst.write(im_dst, window=window)
+
+        # we never used a CLI
+        command = None
+        return destination, command
 
 
     @log_operation
@@ -476,29 +1909,448 @@ class LandsatProject(RasterProject):
 
         # hard-coded 'uint8' dtype for now
         dtype = 'uint8'
-        dtype_max = 255
 
-        # destination dataset
-        destination = self._new_dataset('tif', method='autogain')
+        # the limits are calculated from histograms accumulated chunk-by-chunk,
+        # so the image need not fit in memory
+        chunked = self._engine()
+        limits = engine.percentile_limits(chunked, source.path, percentile, each_band=each_band)
 
-        with rasterio.open(source.path) as src:
-            dst_profile = src.profile
+        with raster_io.open(source.path) as src:
+            dst_profile = windows.tiled_profile(src.profile)
             dst_profile['dtype'] = dtype
+            if not each_band:
+                limits = limits*src.count
+
+        # destination dataset
+        destination = self._new_dataset(self._intermediate_type(), method='autogain')
+        chunked.map(
+            [source.path], functools.partial(kernels.scale, limits=limits, dtype=dtype), destination.path, dst_profile)
+
+        command = None
+        return destination, command
+
+
+
+    @log_operation
+    def pansharpen(self, source, bands=None, method=None, weights=None, max_workers=None):
+        '''
+        Pan-sharpen three multispectral bands of a Landsat scene using its panchromatic band
+
+        The destination is an RGB tif on the grid of the pan band.
+        It is processed block-by-block: for each block of the pan band, the corresponding window
+        of each multispectral band is read and upsampled to the block's shape,
+        and the blocks are fused in parallel worker threads,
+        so that the full-resolution scene is never loaded into memory.
+
+        Parameters
+        ----------
+        source : a Landsat dataset (raw or derived, e.g., from merge or warp)
+        bands : a list of three multispectral bands (e.g., [4, 3, 2])
+        method : either 'brovey' (the default) or 'ihs'
+            'brovey': each band is multiplied by the ratio of the pan band to the intensity
+            'ihs': the difference between the pan band and the intensity is added to each band
+            (the fast additive form of the intensity-hue-saturation transform)
+        weights : optional weights of the multispectral bands in the intensity
+            (by default, the intensity is the mean of the bands)
+        max_workers : the number of worker threads (defaults to the project's thread budget)
+
+        '''
+
+        if isinstance(source, list):
+            if len(source) > 1:
+                raise ValueError('Only one source dataset can be provided to pansharpen')
+            source = source[0]
+
+        if max_workers is None:
+            max_workers = self.resources.threads
+
+        if bands is None or len(bands) != 3:
+            raise ValueError('Three multispectral bands must be provided')
+
+        if method is None:
+            method = 'brovey'
+        if method not in ['brovey', 'ihs']:
+            raise ValueError('%s is not a supported pan-sharpening method' % method)
+
+        if weights is None:
+            weights = [1, 1, 1]
+        weights = np.array(weights, dtype='float32')[:, None, None]
+        weights /= weights.sum()
+
+        # the pan band is the band with a relative resolution of one half
+        pan_bands = [band for band, rel_res in source.rel_band_res.items() if rel_res == .5]
+        if not pan_bands:
+            raise ValueError('Scene %s has no panchromatic band' % source.name)
+
+        source.prepare(pan_bands[:1] + list(bands))
+        pan_filepath = source.filepath(pan_bands[0])
+        ms_filepaths = [source.filepath(band) for band in bands]
+
+        with raster_io.open(pan_filepath) as pan:
+            dtype = pan.profile['dtype']
+            dst_profile = windows.tiled_profile(pan.profile)
+            dst_profile.update({'count': 3, 'nodata': 0})
+
+        dtype_max = np.iinfo(dtype).max if np.issubdtype(np.dtype(dtype), np.integer) else None
+
+        def fuse(readers, window):
+
+            pan = readers.get(pan_filepath)
+            im_pan = pan.read(1, window=window).astype('float32')
+
+            # the window of the multispectral bands, upsampled to the shape of the pan window
+            ms_window = rasterio.windows.from_bounds(
+                *rasterio.windows.bounds(window, pan.transform),
+                transform=readers.get(ms_filepaths[0]).transform)
+
+            im_ms = np.array([
+                readers.get(filepath).read(
+                    1,
+                    window=ms_window,
+                    out_shape=im_pan.shape,
+                    boundless=True,
+                    fill_value=0,
+                    resampling=Resampling.bilinear)
+                for filepath in ms_filepaths]).astype('float32')
+
+            intensity = (im_ms*weights).sum(axis=0)
+            if method == 'brovey':
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    im_dst = im_ms*(im_pan/intensity)[None, :, :]
+            elif method == 'ihs':
+                im_dst = im_ms + (im_pan - intensity)[None, :, :]
+
+            # pixels at which any band is nodata
+            mask = (im_pan == 0) | (im_ms == 0).any(axis=0)
+            im_dst[:, mask] = 0
+
+            if dtype_max is not None:
+                im_dst = np.clip(np.round(im_dst), 0, dtype_max)
+            return im_dst.astype(dtype)
+
+        destination = self._new_dataset('tif', method='pansharpen')
+        with windows.ThreadLocalReaders() as readers:
+            block_windows = list(windows.block_windows(dst_profile['width'], dst_profile['height']))
+            results = windows.map_windows(
+                lambda window: fuse(readers, window), block_windows, max_workers=max_workers)
 
             with rasterio.open(destination.path, 'w', **dst_profile) as dst:
-                if each_band:
-                    im_dst = np.zeros((len(src.indexes),) + src.shape)
-                    for ind, band in enumerate(src.indexes):
-                        im = src.read(band).astype('float64')
-                        im_dst[ind, :, :] = utils.autoscale(im, percentile)
-                else:
-                    im = src.read().astype('float64')
-                    im_dst = utils.autoscale(im, percentile)
-
-                im_dst *= dtype_max
-                im_dst = im_dst.astype(dtype)
-                dst.write(im_dst)
+                for window, im_dst in zip(block_windows, results):
+                    dst.write(im_dst, window=window)
+
+        # we never used a CLI
+        command = None
+        return destination, command
+
+
+
+    @log_operation
+    def composite(self, sources, bands=None, method=None, res=None, max_memory=None, max_workers=None):
+        '''
+        Composite overlapping Landsat scenes by choosing the best pixel at each location
+
+        The scenes are resampled (by nearest neighbor) onto the grid that covers all of them
+        and composited block-by-block in parallel worker threads.
+        The 'least_cloud' and 'most_recent' methods reduce the scenes one at a time,
+        so their memory use does not depend on the number of scenes;
+        for 'median', the block size shrinks as the number of scenes grows
+        to keep the memory used by the blocks in flight below max_memory.
 
+        Parameters
+        ----------
+        sources : a list of Landsat datasets in the same CRS
+        bands : the bands to composite (defaults to the extant bands of the first scene, except the pan band)
+        method : how to choose each pixel from the valid pixels of the scenes
+            'least_cloud' (the default): the pixel with the lowest QA cloud score,
+                with ties broken by recency
+            'most_recent': the pixel from the most recent scene in which it is clear
+                (or the least cloudy pixel, if it is clear in no scene)
+            'median': the per-band median of the clear pixels
+                (or of all valid pixels, if it is clear in no scene)
+        res : the resolution of the composite (defaults to the resolution of the first scene)
+        max_memory : the approximate memory budget, in MB, for the blocks in flight
+            (defaults to the project's memory budget for in-process work)
+        max_workers : the number of worker threads (defaults to the project's thread budget)
+
+        Scenes without a QA band are treated as entirely clear. Pixels that are zero in any band
+        or that are flagged as fill in the QA band are invalid. See `landsat` for the QA scores.
+
+        '''
+
+        if not isinstance(sources, list):
+            sources = [sources]
+
+        if method is None:
+            method = 'least_cloud'
+        if method not in ['least_cloud', 'most_recent', 'median']:
+            raise ValueError('%s is not a supported compositing method' % method)
+
+        if bands is None:
+            bands = [band for band in sources[0].extant_bands if band not in sources[0].rel_band_res]
+        if not bands:
+            raise ValueError('A list of bands must be provided')
+
+        if max_memory is None:
+            max_memory = self.resources.engine_memory
+
+        if max_workers is None:
+            max_workers = self.resources.threads
+
+        # extract the bands of gzipped archives, if any, in one pass over each archive
+        for dataset in sources:
+            dataset.prepare(bands)
+
+        # order the scenes from least to most recent
+        # (scenes without an acquisition date keep their relative order)
+        scenes = sorted(sources, key=lambda dataset: dataset.acquisition_date or datetime.date.min)
+
+        scene_bounds = []
+        for dataset in scenes:
+            with raster_io.open(dataset.filepath(bands[0])) as src:
+                if dataset is scenes[0]:
+                    profile, crs = src.profile, src.crs
+                if src.crs != crs:
+                    raise ValueError('All scenes must have the same CRS (warp them first)')
+                scene_bounds.append(src.bounds)
+
+        if res is None:
+            res = profile['transform'].a
+
+        # the grid that covers all of the scenes
+        left = min(bounds.left for bounds in scene_bounds)
+        bottom = min(bounds.bottom for bounds in scene_bounds)
+        right = max(bounds.right for bounds in scene_bounds)
+        top = max(bounds.top for bounds in scene_bounds)
+        dst_width = int(np.ceil((right - left)/res))
+        dst_height = int(np.ceil((top - bottom)/res))
+        dst_transform = rasterio.transform.from_origin(left, top, res, res)
+
+        # the block size that keeps the blocks in flight within the memory budget
+        dtype = profile['dtype']
+        if method == 'median':
+            # the float32 stack of the scenes, the temporaries of the median, and the QA masks
+            bytes_per_pixel = len(bands)*(8*len(scenes) + 24) + 2*len(scenes)
+        else:
+            bytes_per_pixel = 2*np.dtype(dtype).itemsize*len(bands) + 8
+        # (map_windows keeps IN_FLIGHT_PER_WORKER blocks per worker in flight)
+        blocks_in_flight = windows.IN_FLIGHT_PER_WORKER*max_workers
+        block_size = int(np.sqrt(max_memory*2**20/(bytes_per_pixel*blocks_in_flight)))
+        block_size = max(16, min(windows.BLOCK_SIZE, block_size//16*16))
+
+        dst_profile = windows.tiled_profile(profile, block_size=block_size)
+        dst_profile.update({
+            'transform': dst_transform,
+            'width': dst_width,
+            'height': dst_height,
+            'count': 1,
+        })
+
+        def read_scene(readers, dataset, bounds, window):
+            '''
+            Read the bands and the QA band of a scene for a window of the composite's grid
+            '''
+            block_bounds = rasterio.windows.bounds(window, dst_transform)
+            if (block_bounds[0] >= bounds.right or block_bounds[2] <= bounds.left
+                    or block_bounds[1] >= bounds.top or block_bounds[3] <= bounds.bottom):
+                return None
+
+            def _read(filepath):
+                src = readers.get(filepath)
+                return src.read(
+                    1,
+                    window=rasterio.windows.from_bounds(*block_bounds, transform=src.transform),
+                    out_shape=(window.height, window.width),
+                    boundless=True,
+                    fill_value=0,
+                    resampling=Resampling.nearest)
+
+            im = np.array([_read(dataset.filepath(band)) for band in bands])
+            valid = (im != 0).all(axis=0)
+
+            if os.path.isfile(dataset.qa_filepath()):
+                qa = _read(dataset.qa_filepath())
+                valid &= ~landsat.qa_fill(qa)
+                score, clear = landsat.qa_cloud_score(qa), landsat.qa_clear(qa)
+            else:
+                score = np.zeros(valid.shape, dtype='uint8')
+                clear = np.ones(valid.shape, dtype=bool)
+
+            return im, valid, score, clear
+
+        def composite_block(readers, window):
+
+            shape = (len(bands), window.height, window.width)
+            num_scenes = len(scenes)
+
+            if method == 'median':
+                stack = np.full((num_scenes,) + shape, np.nan, dtype='float32')
+                clears = np.zeros((num_scenes,) + shape[1:], dtype=bool)
+                for ind, (dataset, bounds) in enumerate(zip(scenes, scene_bounds)):
+                    result = read_scene(readers, dataset, bounds, window)
+                    if result is None:
+                        continue
+                    im, valid, _, clear = result
+                    stack[ind][:, valid] = im[:, valid]
+                    clears[ind] = clear & valid
+
+                # exclude cloudy pixels wherever at least one scene is clear
+                exclude = ~clears & clears.any(axis=0)[None, :, :]
+                np.copyto(stack, np.nan, where=exclude[:, None, :, :])
+
+                # the median of the valid pixels (zero where there are none), as np.nanmedian calculates it,
+                # from the stack sorted in place (with NaNs last), since np.nanmedian makes many copies of the stack
+                stack.sort(axis=0)
+                counts = np.count_nonzero(~np.isnan(stack), axis=0)
+                low = np.take_along_axis(stack, np.maximum((counts - 1)//2, 0)[None], axis=0)[0]
+                high = np.take_along_axis(stack, np.minimum(counts//2, num_scenes - 1)[None], axis=0)[0]
+                im_dst = (low + high)/2
+                im_dst[counts == 0] = 0
+
+                if np.issubdtype(np.dtype(dtype), np.integer):
+                    im_dst = np.round(im_dst)
+                return im_dst.astype(dtype)
+
+            # for the other methods, we keep the pixels with the lowest key seen so far
+            im_dst = np.zeros(shape, dtype=dtype)
+            best_keys = np.full(shape[1:], np.inf, dtype='float32')
+            for ind, (dataset, bounds) in enumerate(zip(scenes, scene_bounds)):
+                result = read_scene(readers, dataset, bounds, window)
+                if result is None:
+                    continue
+                im, valid, score, clear = result
+
+                # zero for the most recent scene
+                recency = num_scenes - 1 - ind
+
+                if method == 'least_cloud':
+                    keys = score.astype('float32')*num_scenes + recency
+                elif method == 'most_recent':
+                    # clear pixels always have lower keys than cloudy pixels
+                    keys = np.where(clear, recency, (score.astype('float32') + 1)*num_scenes + recency)
+
+                keys = keys.astype('float32')
+                keys[~valid] = np.inf
+
+                better = keys < best_keys
+                im_dst[:, better] = im[:, better]
+                best_keys[better] = keys[better]
+
+            return im_dst
+
+        destination = self._new_dataset('landsat', method='composite')
+        block_windows = list(windows.block_windows(dst_width, dst_height, block_size=block_size))
+
+        dsts = [rasterio.open(destination.filepath(band), 'w', **dst_profile) for band in bands]
+        try:
+            with windows.ThreadLocalReaders() as readers:
+                results = windows.map_windows(
+                    lambda window: composite_block(readers, window), block_windows, max_workers=max_workers)
+
+                for window, im_dst in zip(block_windows, results):
+                    for ind, dst in enumerate(dsts):
+                        dst.write(im_dst[ind], 1, window=window)
+        finally:
+            for dst in dsts:
+                dst.close()
+
+        # we never used a CLI
+        command = None
+        return destination, command
+
+
+
+    @log_operation
+    def calibrate(self, source, bands=None, dtype=None, max_workers=None):
+        '''
+        Convert the DNs of a raw Landsat scene to top-of-atmosphere (TOA) reflectance
+
+        The per-band rescaling coefficients and the sun elevation are read once from the scene's MTL file;
+        the reflectance is then calculated window-by-window, for all of the bands in parallel,
+        as (mult*DN + add)/sin(sun_elevation)
+
+        Parameters
+        ----------
+        source : a raw Landsat dataset (with an MTL file)
+        bands : the bands to calibrate (defaults to all extant bands with reflectance coefficients;
+            the thermal bands have none and are skipped)
+        dtype : either 'float32' (the default) or 'uint16',
+            in which case the reflectance is scaled by REFLECTANCE_SCALE
+        max_workers : the number of worker threads (defaults to the project's thread budget)
+
+        The destination is a Landsat dataset, so that it can be stacked, composited, etc.
+        Fill pixels (DN = 0) remain zero.
+
+        '''
+
+        if isinstance(source, list):
+            if len(source) > 1:
+                raise ValueError('Only one source dataset can be provided to calibrate')
+            source = source[0]
+
+        if max_workers is None:
+            max_workers = self.resources.threads
+
+        if dtype is None:
+            dtype = 'float32'
+        if dtype not in ['float32', 'uint16']:
+            raise ValueError('dtype must be either float32 or uint16')
+
+        if not os.path.isfile(source.mtl_filepath()):
+            raise FileNotFoundError('No MTL file found for scene %s' % source.name)
+
+        metadata = landsat.read_mtl(source.mtl_filepath())
+        sun_elevation = metadata['SUN_ELEVATION']
+
+        if bands is None:
+            bands = source.extant_bands
+
+        coefficients = {}
+        for band in bands:
+            if landsat.reflectance_coefficients(metadata, band) is None:
+                print('Warning: skipping band %s, which has no reflectance coefficients' % band)
+                continue
+            coefficients[band] = landsat.reflectance_coefficients(metadata, band)
+
+        destination = self._new_dataset('landsat', method='calibrate')
+
+        # extract the bands of a gzipped archive, if any, in one pass over the archive
+        source.prepare(list(coefficients.keys()))
+
+        # one task for each window of each band
+        tasks, dst_profiles = [], {}
+        for band in coefficients.keys():
+            with raster_io.open(source.filepath(band)) as src:
+                dst_profiles[band] = windows.tiled_profile(src.profile)
+                dst_profiles[band].update({'dtype': dtype, 'nodata': 0})
+            tasks.extend([
+                (band, window) for window in windows.block_windows(src.width, src.height)])
+
+        def calibrate_window(readers, task):
+            band, window = task
+            im = readers.get(source.filepath(band)).read(1, window=window)
+            reflectance = landsat.toa_reflectance(im, *coefficients[band], sun_elevation)
+
+            if dtype == 'uint16':
+                valid = im != 0
+                reflectance = np.clip(np.round(reflectance*landsat.REFLECTANCE_SCALE), 1, 65535)
+                reflectance[~valid] = 0
+            return reflectance.astype(dtype)
+
+        dsts = {
+            band: rasterio.open(destination.filepath(band), 'w', **dst_profiles[band])
+            for band in coefficients.keys()}
+        try:
+            with windows.ThreadLocalReaders() as readers:
+                results = windows.map_windows(
+                    lambda task: calibrate_window(readers, task), tasks, max_workers=max_workers)
+
+                for (band, window), im_dst in zip(tasks, results):
+                    dsts[band].write(im_dst, 1, window=window)
+        finally:
+            for dst in dsts.values():
+                dst.close()
+
+        # we never used a CLI
         command = None
         return destination, command
 
@@ -527,12 +2379,21 @@ class DEMProject(RasterProject):
         super().__init__(*args, raw_dataset_type=raw_dataset_type, **kwargs)
 
 
+    def _scratch_dir(self):
+        '''
+        Create a new directory in the temp dir for the intermediate files of one operation
+        (the caller removes it)
+        '''
+        os.makedirs(self._tmp_dir, exist_ok=True)
+        return tempfile.mkdtemp(dir=self._tmp_dir)
+
+
     @log_operation
     def hill_shade(self, source):
 
         destination = self._new_dataset('tif', method='hill_shade')
         command = ['gdaldem', 'hillshade', source.path, destination.path]
-        utils.run_command(command)
+        self._run_command(command)
 
         return destination, command
 
@@ -545,20 +2406,24 @@ class DEMProject(RasterProject):
         '''
 
         destination = self._new_dataset('tif', method='slope_shade')
-        slope_filepath = os.path.join(self._tmp_dir, 'temp.tif')
-        colormap_filename = os.path.join(self._tmp_dir, 'colormap.txt')
 
-        # calculate the slope angles
-        utils.run_command(['gdaldem', 'slope', source.path, slope_filepath])
+        # the intermediates go in a directory of their own, so that concurrent operations cannot overwrite them
+        scratch_dir = self._scratch_dir()
+        slope_filepath = os.path.join(scratch_dir, 'slope.tif')
+        colormap_filename = os.path.join(scratch_dir, 'colormap.txt')
 
-        with open(colormap_filename, 'w') as file:
-            for row in [(0, 255, 255, 255), (90, 0, 0, 0)]:
-                file.write('%d %d %d %d\n' % row)
+        try:
+            # calculate the slope angles
+            self._run_command(['gdaldem', 'slope', source.path, slope_filepath])
 
-        # map the angles to uint8 values
-        utils.run_command(['gdaldem', 'color-relief', slope_filepath, colormap_filename, destination.path])
+            with open(colormap_filename, 'w') as file:
+                for row in [(0, 255, 255, 255), (90, 0, 0, 0)]:
+                    file.write('%d %d %d %d\n' % row)
 
-        os.remove(slope_filepath)
+            # map the angles to uint8 values
+            self._run_command(['gdaldem', 'color-relief', slope_filepath, colormap_filename, destination.path])
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
 
         # we used two GDAL CLI commands, so let's not worry about how to capture them
         command = None
@@ -577,26 +2442,29 @@ class DEMProject(RasterProject):
         if enhancement is None:
             enhancement = 2
 
-        flt_filepath = os.path.join(self._tmp_dir, 'temp.flt')
-        texture_filepath = os.path.join(self._tmp_dir, 'temp_texture.flt')
+        scratch_dir = self._scratch_dir()
+        flt_filepath = os.path.join(scratch_dir, 'dem.flt')
+        texture_filepath = os.path.join(scratch_dir, 'texture.flt')
         destination = self._new_dataset('tif', method='texture_shade')
-        
-        # texture shader requires the input DEM as an FLT file
-        utils.run_command(['gdal_translate', '-of', 'EHdr', '-ot', 'Float32', source.path, flt_filepath])
-        
-        # create the texture intermediate
-        utils.run_command([texture_bin, str(detail), flt_filepath, texture_filepath])
 
-        # create the texture-shaded TIFF
-        utils.run_command([texture_image_bin, str(enhancement), texture_filepath, destination.path])
-        
-        # remove intermediate files
-        for path in [flt_filepath, texture_filepath, destination.path]:
-            for ext in ['flt', 'hdr', 'prj', 'tfw', 'flt.aux.xml']:
-                try:
-                    os.remove(re.sub(r'(\w+)$', ext, path))
-                except FileNotFoundError:
-                    continue
+        try:
+            # texture shader requires the input DEM as an FLT file
+            self._run_command(['gdal_translate', '-of', 'EHdr', '-ot', 'Float32', source.path, flt_filepath])
+
+            # create the texture intermediate
+            self._run_command([texture_bin, str(detail), flt_filepath, texture_filepath])
+
+            # create the texture-shaded TIFF
+            self._run_command([texture_image_bin, str(enhancement), texture_filepath, destination.path])
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+        # remove the sidecars that texture_image writes next to the TIFF
+        for ext in ['flt', 'hdr', 'prj', 'tfw', 'flt.aux.xml']:
+            try:
+                os.remove(re.sub(r'(\w+)$', ext, destination.path))
+            except FileNotFoundError:
+                continue
 
         command = None
         return destination, command
@@ -630,14 +2498,18 @@ class DEMProject(RasterProject):
 
         # gdaldem requires the colormap be a file in which each line is of the form
         # '<elevation> <uint8> <uint8> <uint8>\n'
-        colormap_filename = os.path.join(self._tmp_dir, 'colormap.txt')
+        scratch_dir = self._scratch_dir()
+        colormap_filename = os.path.join(scratch_dir, 'colormap.txt')
         with open(colormap_filename, 'w') as file:
             for row in colormap:
                 file.write('%d %d %d %d\n' % ((row['elevation']/feet_per_meter,) + row['color']))
 
         destination = self._new_dataset('tif', method='color_relief')
         command = ['gdaldem', 'color-relief', source.path, colormap_filename, destination.path]
-        utils.run_command(command)
+        try:
+            self._run_command(command)
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
 
         return destination, command
 
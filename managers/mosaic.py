@@ -0,0 +1,227 @@
+'''
+Planning and streaming mosaics of raster files (an in-process equivalent of `rio merge`)
+
+A mosaic's layout (its bounds, transform and shape, and, for each chunk of the mosaic,
+the window of each source to read and the window of the chunk to which to write it)
+depends only on the grids of the sources, and not on their pixels, so it is calculated once
+for all of the bands that share those grids (e.g., every band of a set of Landsat scenes but the pan band)
+and is then used to paste every band. The MergePlanner caches the headers of the source files
+and the plans themselves, so repeated merges of the same raw datasets (e.g., at different resolutions)
+open each file only to read its pixels.
+
+The result is the same as that of `rio merge` (with its default 'first' method and nearest resampling):
+each pixel is taken from the first source that has data there.
+'''
+
+import os
+import math
+import threading
+import numpy as np
+import rasterio
+import rasterio.windows
+
+from rasterio.crs import CRS
+from rasterio.errors import WindowError
+from rasterio.transform import Affine
+
+from . import windows
+from . import archives
+from . import raster_io
+
+
+def _align(window):
+    '''
+    Round the offsets and lengths of a window for pasting (as gdal_merge.py and `rio merge` do)
+    '''
+    return rasterio.windows.Window(
+        math.floor(window.col_off + 0.1),
+        math.floor(window.row_off + 0.1),
+        math.floor(window.width + 0.5),
+        math.floor(window.height + 0.5))
+
+
+def _intersection(bounds, other):
+    left, bottom = max(bounds[0], other[0]), max(bounds[1], other[1])
+    right, top = min(bounds[2], other[2]), min(bounds[3], other[3])
+    if left >= right or bottom >= top:
+        return None
+    return left, bottom, right, top
+
+
+class MosaicPlan(object):
+    '''
+    The layout of a mosaic of sources that share a grid signature
+
+    chunks : a list of (chunk window, pastes) tuples, where the chunk window is a window of the mosaic
+        and pastes is a list of (source index, source window, window of the chunk) tuples, in source order
+    '''
+
+    def __init__(self, transform, width, height, chunks, profile):
+        self.transform = transform
+        self.width = width
+        self.height = height
+        self.chunks = chunks
+
+        # the profile of the mosaic (that of the first source, with the mosaic's grid)
+        self.profile = profile
+
+
+    def read_chunk(self, srcs, ind):
+        '''
+        Paste the sources into one chunk of the mosaic
+
+        srcs : the open sources, in the order in which they were planned
+        ind : the index of the chunk
+        Returns the chunk as an array of shape (count, rows, cols)
+        '''
+
+        window, pastes = self.chunks[ind]
+        nodata = self.profile['nodata'] if self.profile['nodata'] is not None else 0
+
+        chunk = np.full((self.profile['count'], window.height, window.width), nodata, dtype=self.profile['dtype'])
+        for source_ind, src_window, chunk_window in pastes:
+            rows, cols = chunk_window.toslices()
+            region = chunk[:, rows, cols]
+
+            data = srcs[source_ind].read(
+                window=src_window, out_shape=(self.profile['count'], chunk_window.height, chunk_window.width),
+                masked=True)
+
+            # the first source with data at each pixel wins
+            mask = ~np.ma.getmaskarray(data) & (region == nodata)
+            np.copyto(region, data.data, where=mask, casting='unsafe')
+        return chunk
+
+
+class MergePlanner(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        # the header of each source file, keyed by (path, size, mtime)
+        self._headers = {}
+
+        # the plans, keyed by the grid signature of their sources and the plan's parameters
+        self._plans = {}
+
+
+    def header(self, filepath):
+        '''
+        The grid, dtype and nodata value of a source file (cached until the file changes),
+        as a tuple of (crs, transform, width, height, dtype, nodata, count)
+        '''
+
+        stat = os.stat(archives.real_path(filepath))
+        key = (filepath, stat.st_size, stat.st_mtime)
+        with self._lock:
+            if key in self._headers:
+                return self._headers[key]
+
+        with raster_io.open(filepath) as src:
+            header = (
+                src.crs.to_wkt() if src.crs else None,
+                tuple(src.transform)[:6],
+                src.width,
+                src.height,
+                src.dtypes[0],
+                src.nodata,
+                src.count,
+            )
+
+        with self._lock:
+            self._headers[key] = header
+        return header
+
+
+    def signature(self, filepaths):
+        '''
+        The grid signature of a list of sources; sources with the same signature share a plan
+        '''
+        return tuple(self.header(filepath) for filepath in filepaths)
+
+
+    def plan(self, filepaths, res=None, bounds=None, chunk_size=None):
+        '''
+        The plan of the mosaic of a list of sources
+
+        res : the resolution of the mosaic (defaults to that of the first source)
+        bounds : the bounds of the mosaic in the CRS of the sources (defaults to the union of their bounds)
+        chunk_size : the edge length of the chunks of the mosaic (defaults to windows.BLOCK_SIZE)
+        '''
+
+        if chunk_size is None:
+            chunk_size = windows.BLOCK_SIZE
+
+        signature = self.signature(filepaths)
+        key = (signature, res, tuple(bounds) if bounds else None, chunk_size)
+        with self._lock:
+            if key in self._plans:
+                return self._plans[key]
+
+        plan = self._plan(signature, res, bounds, chunk_size)
+        with self._lock:
+            self._plans[key] = plan
+        return plan
+
+
+    def _plan(self, signature, res, bounds, chunk_size):
+
+        crss = set(crs for crs, *_ in signature)
+        if len(crss) > 1:
+            raise ValueError('All sources must have the same CRS to be merged')
+
+        grids = []
+        for crs, transform, width, height, *_ in signature:
+            transform = Affine(*transform)
+            if not transform.is_rectilinear or transform.a < 0 or transform.e > 0:
+                raise ValueError('Only north-up, non-rotated sources can be merged')
+            grids.append((transform, rasterio.windows.bounds(
+                rasterio.windows.Window(0, 0, width, height), transform)))
+
+        if bounds is None:
+            bounds = (
+                min(b[0] for _, b in grids), min(b[1] for _, b in grids),
+                max(b[2] for _, b in grids), max(b[3] for _, b in grids))
+        left, bottom, right, top = bounds
+
+        if res is None:
+            res = (grids[0][0].a, -grids[0][0].e)
+        elif not isinstance(res, (list, tuple)):
+            res = (res, res)
+
+        width = int(round((right - left)/res[0]))
+        height = int(round((top - bottom)/res[1]))
+        transform = Affine.translation(left, top)*Affine.scale(res[0], -res[1])
+
+        chunks = []
+        for window in windows.block_windows(width, height, block_size=chunk_size):
+            chunk_bounds = rasterio.windows.bounds(window, transform)
+            chunk_transform = rasterio.windows.transform(window, transform)
+
+            pastes = []
+            for source_ind, (src_transform, src_bounds) in enumerate(grids):
+                intersection = _intersection(src_bounds, chunk_bounds)
+                if intersection is None:
+                    continue
+                try:
+                    src_window = rasterio.windows.from_bounds(*intersection, transform=src_transform)
+                    chunk_window = _align(rasterio.windows.from_bounds(*intersection, transform=chunk_transform))
+                except WindowError:
+                    continue
+                if chunk_window.width < 1 or chunk_window.height < 1:
+                    continue
+                pastes.append((source_ind, src_window, chunk_window))
+            chunks.append((window, pastes))
+
+        crs, _, _, _, dtype, nodata, count = signature[0]
+        profile = windows.tiled_profile(dict(
+            driver='GTiff',
+            crs=CRS.from_wkt(crs) if crs else None,
+            transform=transform,
+            width=width,
+            height=height,
+            count=count,
+            dtype=dtype,
+            nodata=nodata))
+
+        return MosaicPlan(transform, width, height, chunks, profile)
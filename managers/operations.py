@@ -1,14 +1,40 @@
 
 import os
 import json
+import hashlib
 import datetime
 from . import datasets
 
 
+def fingerprint(method, kwargs, source_fingerprints):
+    '''
+    The fingerprint of an operation: a hash of its method, its kwargs, and the fingerprints of its sources
+    (so an operation's fingerprint changes whenever the fingerprint of any of its ancestors changes)
+    '''
+    props = [method, kwargs, list(source_fingerprints)]
+    return hashlib.sha1(json.dumps(props, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def dataset_fingerprint(dataset):
+    '''
+    The fingerprint of a dataset that no operation created (i.e., a raw dataset):
+    a hash of its path and of the relative path, size and modification time of each of its files
+    '''
+    props = [dataset.path]
+    for filepath in dataset.files():
+        stat = os.stat(filepath)
+        props.append([os.path.relpath(filepath, dataset.path), stat.st_size, stat.st_mtime])
+    return hashlib.sha1(json.dumps(props).encode()).hexdigest()
+
+
 class Operation(object):
 
     _serializable_attrs = ['method', 'command', 'kwargs', 'commit', 'timestamp']
 
+    # attributes that are serialized only if they are not None
+    # (so that the props of operations that predate them are unchanged)
+    _optional_attrs = ['resources', 'fingerprint', 'evicted', 'duration', 'source_is_list']
+
 
     def __repr__(self):
 
@@ -19,11 +45,13 @@ class Operation(object):
             (self.method, self.kwargs, [_clean(d.path) for d in self._source], [_clean(d.path) for d in self._destination])
 
 
-    def __init__(self, source, destination, method=None, command=None, kwargs=None, commit=None):
+    def __init__(self, source, destination, method=None, command=None, kwargs=None, commit=None, resources=None):
 
         # note: source is sometimes a single dataset and sometimes a list of datasets
         # for consistency, we force the internal _source and _destination attributes to lists
         # but allow the public attributes to be either single datasets or a list of datasets
+        # (whether the method was called with a list is recorded, so that it can be re-run as it was called)
+        self.source_is_list = isinstance(source, list)
         if not isinstance(source, list):
             source = [source]
 
@@ -40,6 +68,18 @@ class Operation(object):
         self.kwargs = kwargs
         self.commit = commit
         self.command = command
+
+        # the thread and memory budgets in effect when the operation was run
+        self.resources = resources
+
+        # the fingerprint of the operation when it was run (see `fingerprint`)
+        self.fingerprint = None
+
+        # True if the operation's destinations were evicted to free disk space (see storage.StorageManager)
+        self.evicted = None
+
+        # the time, in seconds, that the operation took to run
+        self.duration = None
         self.timestamp = datetime.datetime.now().strftime('%Y-%m-%d-%H-%M')
 
 
@@ -50,6 +90,26 @@ class Operation(object):
         return self._source
 
 
+    def call_source(self, source=None):
+        '''
+        The source (or a list of datasets that replace the sources) in the form with which the method was called:
+        a list, if the method was called with a list (even of one dataset), and a single dataset otherwise
+
+        (operations logged before this was recorded were called with a list only if they had several sources)
+        '''
+
+        if source is None:
+            source = self._source
+
+        is_list = self.source_is_list
+        if is_list is None:
+            is_list = len(source) > 1
+
+        if is_list:
+            return list(source)
+        return source[0]
+
+
     @property
     def destination(self):
         if len(self._destination)==1:
@@ -64,7 +124,7 @@ class Operation(object):
         destination = [datasets.new_dataset(d['type'], d['path']) for d in props['destination']]
 
         instance = cls(source, destination)
-        for attr in instance._serializable_attrs:
+        for attr in instance._serializable_attrs + instance._optional_attrs:
             setattr(instance, attr, props.get(attr))
 
         return instance
@@ -76,6 +136,10 @@ class Operation(object):
         for attr in self._serializable_attrs:
             props[attr] = getattr(self, attr)
 
+        for attr in self._optional_attrs:
+            if getattr(self, attr) is not None:
+                props[attr] = getattr(self, attr)
+
         props['source'] = [{'type': d.type, 'path': d.path} for d in self._source]
         props['destination'] = [{'type': d.type, 'path': d.path} for d in self._destination]
         
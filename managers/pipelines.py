@@ -0,0 +1,362 @@
+'''
+Fused pipelines of per-pixel steps (see RasterProject.pipeline)
+
+A pipeline is a list of steps, each of which is a dict of the form {'method': <step name>, **kwargs}.
+The steps operate on a list of float32 images, one for each source dataset, of shape (bands, rows, cols);
+most steps act on all of the images unless the index of a single image is given as the `image` kwarg.
+
+Available steps
+---------------
+autoscale   : scale an image to [0, 1] given minn/maxx or a percentile (as in utils.autoscale)
+multiply    : multiply-blend a one-band (BW) image with a three-band (RGB) image (as in multiply_rgb)
+gamma       : raise an image to a power
+lut         : map intensities through a piecewise-linear lookup table given by the lists `x` and `y`
+band_math   : evaluate an expression of the bands of all images (named b1, b2, ...)
+              and replace the images with the result (e.g., '(b2 - b1)/(b2 + b1)');
+              expressions may use numeric constants, arithmetic, comparison and boolean operators,
+              and the numpy functions in EXPRESSION_FUNCTIONS (e.g., 'np.where(b1 > 0, b2/b1, 0)')
+'''
+
+import re
+import ast
+import operator
+import functools
+import numpy as np
+
+
+# the number of bins in the histograms from which percentiles are estimated
+HISTOGRAM_BINS = 4096
+
+
+def _indices(images, image=None):
+    if image is None:
+        return list(range(len(images)))
+    return [image]
+
+
+def autoscale(images, limits=None, image=None, **kwargs):
+    '''
+    limits : the (minn, maxx) of each image, as resolved by Pipeline.resolve_limits
+    '''
+    for ind, (minn, maxx) in zip(_indices(images, image), limits):
+        im = images[ind]
+        im -= minn
+        im /= (maxx - minn)
+        np.clip(im, 0, 1, out=im)
+    return images
+
+
+def multiply(images, weight=None):
+
+    shapes = [im.shape[0] for im in images]
+    if shapes == [1, 3]:
+        im_bw, im_rgb = images
+    elif shapes == [3, 1]:
+        im_rgb, im_bw = images
+    else:
+        raise ValueError('Unexpected numbers of bands for multiply: %s' % shapes)
+
+    if weight:
+        im_bw = im_bw*weight
+    return [im_rgb*im_bw]
+
+
+def gamma(images, gamma=None, image=None):
+    for ind in _indices(images, image):
+        images[ind] **= gamma
+    return images
+
+
+def lut(images, x=None, y=None, image=None):
+    for ind in _indices(images, image):
+        images[ind] = np.interp(images[ind], x, y).astype('float32')
+    return images
+
+
+# the numpy functions that band_math expressions may call (as np.<name> or <name>)
+EXPRESSION_FUNCTIONS = [
+    'abs', 'sqrt', 'exp', 'log', 'log10', 'log1p', 'power', 'minimum', 'maximum', 'clip', 'where',
+    'sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan', 'arctan2', 'hypot', 'floor', 'ceil', 'round', 'isnan',
+]
+
+_BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+
+    # the bitwise operators are boolean operators of (masks of) the bands, as in numpy
+    ast.BitAnd: np.logical_and,
+    ast.BitOr: np.logical_or,
+    ast.BitXor: np.logical_xor,
+}
+
+_UNARY_OPERATORS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+    ast.Not: np.logical_not,
+    ast.Invert: np.logical_not,
+}
+
+_COMPARISON_OPERATORS = {
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+}
+
+
+def _function_name(node):
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == 'np':
+        return node.attr
+    return None
+
+
+def parse_expression(expression):
+    '''
+    Parse a band_math expression, checking that it uses only band names, numeric constants,
+    arithmetic, comparison and boolean operators, and calls of the functions in EXPRESSION_FUNCTIONS
+
+    (expressions are saved in the props and re-run, so they are never passed to eval,
+    which cannot be sandboxed)
+    Returns the expression's syntax tree
+    '''
+
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError as error:
+        raise ValueError('Invalid band_math expression %r: %s' % (expression, error))
+
+    def _check(node):
+        if isinstance(node, ast.Expression):
+            _check(node.body)
+        elif isinstance(node, ast.Constant):
+            if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+                raise ValueError('Only numeric constants are allowed in band_math expressions')
+        elif isinstance(node, ast.Name):
+            if not re.match(r'^b[0-9]+$', node.id):
+                raise ValueError('Unknown name %s in band_math expression (bands are named b1, b2, ...)' % node.id)
+        elif isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+            _check(node.left)
+            _check(node.right)
+        elif isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPERATORS:
+            _check(node.operand)
+        elif isinstance(node, ast.Compare) and all(type(op) in _COMPARISON_OPERATORS for op in node.ops):
+            for child in [node.left] + node.comparators:
+                _check(child)
+        elif isinstance(node, ast.BoolOp):
+            for child in node.values:
+                _check(child)
+        elif isinstance(node, ast.Call):
+            if _function_name(node.func) not in EXPRESSION_FUNCTIONS or node.keywords:
+                raise ValueError('Only calls of %s (without keyword arguments) are allowed in band_math expressions' % \
+                    ', '.join(EXPRESSION_FUNCTIONS))
+            for child in node.args:
+                _check(child)
+        else:
+            raise ValueError('%s is not allowed in band_math expressions' % type(node).__name__)
+
+    _check(tree)
+    return tree
+
+
+def _evaluate(node, names):
+
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body, names)
+    if isinstance(node, ast.Constant):
+        # as floats, so that integer powers of constants cannot grow without bound
+        return float(node.value)
+    if isinstance(node, ast.Name):
+        if node.id not in names:
+            raise ValueError('band_math expression uses %s, but there are only %s bands' % (node.id, len(names)))
+        return names[node.id]
+    if isinstance(node, ast.BinOp):
+        return _BINARY_OPERATORS[type(node.op)](_evaluate(node.left, names), _evaluate(node.right, names))
+    if isinstance(node, ast.UnaryOp):
+        return _UNARY_OPERATORS[type(node.op)](_evaluate(node.operand, names))
+    if isinstance(node, ast.Compare):
+        # chained comparisons (e.g., 0 < b1 < 1) are combined elementwise
+        result, left = True, _evaluate(node.left, names)
+        for op, comparator in zip(node.ops, node.comparators):
+            right = _evaluate(comparator, names)
+            result = np.logical_and(result, _COMPARISON_OPERATORS[type(op)](left, right))
+            left = right
+        return result
+    if isinstance(node, ast.BoolOp):
+        combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        return functools.reduce(combine, [_evaluate(value, names) for value in node.values])
+    if isinstance(node, ast.Call):
+        func = getattr(np, _function_name(node.func))
+        return func(*[_evaluate(arg, names) for arg in node.args])
+    raise ValueError('%s is not allowed in band_math expressions' % type(node).__name__)
+
+
+def band_math(images, expression=None):
+
+    bands = np.concatenate(images, axis=0)
+    names = {'b%d' % (ind + 1): band for ind, band in enumerate(bands)}
+    result = _evaluate(parse_expression(expression), names)
+    result = np.broadcast_to(np.asarray(result, dtype='float32'), bands.shape[1:])
+    return [np.array(result)[None, :, :]]
+
+
+def _step_images(images, pipeline, step_ind):
+    '''
+    The images on which an autoscale step acts, as they are at that step
+    '''
+    images = pipeline.apply(images, num_steps=step_ind)
+    return [images[ind] for ind in _indices(images, pipeline.steps[step_ind].get('image'))]
+
+
+# the kernels of the passes of Pipeline.resolve_limits (module-level, so that they can run in worker processes)
+def _step_min_max(images, window, pipeline, step_ind):
+    return [(im.min(), im.max()) for im in _step_images(images, pipeline, step_ind)]
+
+
+def _step_histograms(images, window, pipeline, step_ind, ranges):
+    return [
+        np.histogram(im, bins=HISTOGRAM_BINS, range=range_)[0]
+        for im, range_ in zip(_step_images(images, pipeline, step_ind), ranges)]
+
+
+STEPS = {
+    'autoscale': autoscale,
+    'multiply': multiply,
+    'gamma': gamma,
+    'lut': lut,
+    'band_math': band_math,
+}
+
+
+class Pipeline(object):
+
+    def __init__(self, steps):
+
+        if not steps:
+            raise ValueError('A pipeline requires at least one step')
+
+        for step in steps:
+            if step.get('method') not in STEPS:
+                raise ValueError('%s is not a valid pipeline step' % step.get('method'))
+
+            # reject unsafe or invalid expressions before anything is run
+            if step['method'] == 'band_math':
+                parse_expression(step.get('expression') or '')
+
+        self.steps = [dict(step) for step in steps]
+
+        # the resolved (minn, maxx) limits of the images for each autoscale step, by step index
+        self.limits = {}
+
+
+    def apply(self, images, num_steps=None):
+        '''
+        Apply the first num_steps steps (or all of the steps) to a list of images
+        '''
+
+        for ind, step in enumerate(self.steps[:num_steps]):
+            kwargs = {key: value for key, value in step.items() if key != 'method'}
+            if step['method'] == 'autoscale':
+                kwargs['limits'] = self.limits[ind]
+            images = STEPS[step['method']](images, **kwargs)
+        return images
+
+
+    def resolve_limits(self, reduce, sample, cached=None):
+        '''
+        Resolve the (minn, maxx) limits of each image for each autoscale step
+
+        Limits that are not given explicitly depend on all of the pixels of the images
+        as they are at that point in the pipeline, so they require one pass over the sources
+        (or two, for percentiles other than 100). Percentiles are estimated from histograms
+        with HISTOGRAM_BINS bins between the min and max.
+
+        reduce : a function that applies a function of (images, window) to every chunk
+            of the sources and returns the list of results (e.g., ChunkedEngine.reduce with the sources' paths)
+        sample : a list of source images for a small window (used to count the images at each step)
+        cached : an optional function of (source index, percentile) that returns the cached (minn, maxx)
+            of a source (or None); this is used for autoscale steps that are the first step of the pipeline,
+            since only they act on the sources themselves
+        '''
+
+        for step_ind, step in enumerate(self.steps):
+            if step['method'] != 'autoscale':
+                continue
+
+            num_images = len(_step_images([im.copy() for im in sample], self, step_ind))
+
+            minn, maxx = step.get('minn'), step.get('maxx')
+            if minn is not None and maxx is not None:
+                self.limits[step_ind] = [(minn, maxx)]*num_images
+                continue
+
+            percentile = step.get('percentile')
+            if percentile is None:
+                percentile = 100
+
+            limits = None
+            if step_ind == 0 and cached is not None:
+                limits = [cached(ind, percentile) for ind in _indices(sample, step.get('image'))]
+                if any(limits_ is None for limits_ in limits):
+                    limits = None
+
+            # the min/max of each image
+            if limits is None:
+                results = reduce(functools.partial(_step_min_max, pipeline=self, step_ind=step_ind))
+                limits = [
+                    (
+                        float(min(result[ind][0] for result in results)),
+                        float(max(result[ind][1] for result in results)),
+                    )
+                    for ind in range(num_images)]
+
+                # estimate the percentiles from histograms between the min and max
+                if percentile != 100:
+                    results = reduce(
+                        functools.partial(_step_histograms, pipeline=self, step_ind=step_ind, ranges=limits))
+
+                    counts = np.sum(results, axis=0)
+                    limits = [
+                        histogram_percentiles(count, *range_, [100 - percentile, percentile])
+                        for count, range_ in zip(counts, limits)]
+
+            # an explicit minn or maxx takes precedence
+            self.limits[step_ind] = [
+                (
+                    limits_[0] if minn is None else minn,
+                    limits_[1] if maxx is None else maxx,
+                )
+                for limits_ in limits]
+
+
+def histogram_percentiles(counts, minn, maxx, percentiles):
+    '''
+    Estimate percentiles from a histogram with evenly spaced bins between minn and maxx,
+    by interpolating linearly within the bins
+    '''
+
+    edges = np.linspace(minn, maxx, len(counts) + 1)
+    cumulative = np.concatenate(([0], np.cumsum(counts)))/counts.sum()
+    return [float(np.interp(percentile/100, cumulative, edges)) for percentile in percentiles]
+
+
+def cast(im, dtype=None):
+    '''
+    Cast the result of a pipeline to a dtype;
+    for integer dtypes, the result is assumed to be normalized to [0, 1] and is scaled to the dtype's max
+    '''
+
+    if dtype is None:
+        return im
+
+    if np.issubdtype(np.dtype(dtype), np.integer):
+        im = np.clip(im, 0, 1)*np.iinfo(dtype).max
+    return im.astype(dtype)
@@ -0,0 +1,201 @@
+'''
+Reading and writing of raster datasets in either of two formats:
+GeoTIFFs (or any other format that GDAL can read), via rasterio,
+and raw arrays, which are stored as .npy files with a JSON sidecar for the georeferencing.
+
+Raw arrays are intended for intermediate datasets that are written and read only by in-process operations;
+they are read by memory-mapping the .npy file, so reading a window of a raw array is zero-copy,
+and no GeoTIFF encoding or decoding is ever required.
+
+`open` returns either a rasterio dataset or a RawDataset, which implements the subset of the rasterio
+dataset API that the in-process operations use. GeoTIFFs opened for reading are wrapped in a cache.CachedReader,
+so that the blocks read by in-process operations are cached for the session.
+'''
+
+import os
+import json
+import builtins
+import numpy as np
+import rasterio
+
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.coords import BoundingBox
+from rasterio.transform import array_bounds
+
+from . import cache
+
+
+RAW_EXTENSION = '.npy'
+
+
+def is_raw(path):
+    return os.path.splitext(path)[1].lower() == RAW_EXTENSION
+
+
+def sidecar_path(path):
+    '''
+    The path to the JSON sidecar of a raw array
+    '''
+    return os.path.splitext(path)[0] + '.json'
+
+
+def open(path, mode='r', **profile):
+    '''
+    Open a dataset for reading or writing, as either a rasterio dataset or a RawDataset,
+    depending on the extension of the path
+    '''
+    # the cached blocks of a dataset that is being rewritten are stale
+    if mode != 'r':
+        cache.block_cache.invalidate(path)
+
+    if is_raw(path):
+        return RawDataset(path, mode=mode, **profile)
+
+    # writing a GeoTIFF with the profile of a raw array
+    if profile.get('driver') == 'raw':
+        profile['driver'] = 'GTiff'
+
+    if mode == 'r':
+        return cache.CachedReader(rasterio.open(path, mode))
+    return rasterio.open(path, mode, **profile)
+
+
+class RawDataset(object):
+    '''
+    A raw array of shape (count, height, width) stored in a .npy file,
+    with its CRS, transform and nodata value stored in a JSON sidecar
+
+    The .npy file is memory-mapped, so reads return views of the file
+    (reading a band or a window is zero-copy).
+    '''
+
+    def __init__(self, path, mode='r', **profile):
+
+        self.name = path
+        self.mode = mode
+
+        if mode == 'r':
+            with builtins.open(sidecar_path(path), 'r') as file:
+                props = json.load(file)
+            self._array = np.load(path, mmap_mode='r')
+
+        elif mode == 'w':
+            props = {
+                'crs': CRS.from_user_input(profile['crs']).to_wkt() if profile.get('crs') else None,
+                'transform': list(profile['transform'])[:6],
+                'nodata': profile.get('nodata'),
+            }
+            self._array = np.lib.format.open_memmap(
+                path,
+                mode='w+',
+                dtype=profile['dtype'],
+                shape=(profile.get('count', 1), profile['height'], profile['width']))
+
+            with builtins.open(sidecar_path(path), 'w') as file:
+                json.dump(props, file)
+        else:
+            raise ValueError('%s is not a supported mode for raw arrays' % mode)
+
+        self.crs = CRS.from_wkt(props['crs']) if props['crs'] else None
+        self.transform = Affine(*props['transform'])
+        self.nodata = props['nodata']
+
+
+    @property
+    def count(self):
+        return self._array.shape[0]
+
+    @property
+    def height(self):
+        return self._array.shape[1]
+
+    @property
+    def width(self):
+        return self._array.shape[2]
+
+    @property
+    def shape(self):
+        return self._array.shape[1:]
+
+    @property
+    def indexes(self):
+        return tuple(range(1, self.count + 1))
+
+    @property
+    def dtypes(self):
+        return tuple([self._array.dtype.name]*self.count)
+
+    @property
+    def res(self):
+        return (abs(self.transform.a), abs(self.transform.e))
+
+    @property
+    def bounds(self):
+        return BoundingBox(*array_bounds(self.height, self.width, self.transform))
+
+    @property
+    def profile(self):
+        return {
+            'driver': 'raw',
+            'dtype': self._array.dtype.name,
+            'nodata': self.nodata,
+            'width': self.width,
+            'height': self.height,
+            'count': self.count,
+            'crs': self.crs,
+            'transform': self.transform,
+        }
+
+
+    def _slices(self, window):
+        if window is None:
+            return slice(None), slice(None)
+        return window.toslices()
+
+
+    def read(self, indexes=None, window=None, **kwargs):
+        '''
+        Read one band (if indexes is an integer), a list of bands, or all bands (if indexes is None)
+        (as with rasterio, bands are indexed from one)
+
+        Reads of all bands or of a single band are views of the memory-mapped file
+        '''
+
+        if kwargs:
+            raise ValueError('Raw arrays do not support the read options %s' % sorted(kwargs.keys()))
+
+        rows, cols = self._slices(window)
+        if indexes is None:
+            return self._array[:, rows, cols]
+        if isinstance(indexes, int):
+            return self._array[indexes - 1, rows, cols]
+        return self._array[[index - 1 for index in indexes], rows, cols]
+
+
+    def write(self, arr, indexes=None, window=None):
+
+        if self.mode != 'w':
+            raise ValueError('%s is not open for writing' % self.name)
+
+        rows, cols = self._slices(window)
+        if indexes is None:
+            self._array[:, rows, cols] = arr
+        elif isinstance(indexes, int):
+            self._array[indexes - 1, rows, cols] = arr
+        else:
+            self._array[[index - 1 for index in indexes], rows, cols] = arr
+
+
+    def close(self):
+        if self.mode == 'w':
+            self._array.flush()
+        self._array = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
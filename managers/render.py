@@ -0,0 +1,129 @@
+'''
+Rendering of datasets as 8-bit frames using precomputed scaling lookup tables
+
+Frames are rendered in worker threads (see GOESProject.animate): reading the bands and encoding the PNGs
+happen in GDAL, which releases the GIL, and the lookup tables are shared by the threads without copying them.
+'''
+
+import warnings
+import numpy as np
+import rasterio
+
+from . import stats
+from . import raster_io
+
+
+# the number of intensity levels in a scaling LUT
+LUT_LEVELS = 4096
+
+def band_sources(dataset, bands):
+    '''
+    The (filepath, band index) of each band of a dataset
+
+    GOES and Landsat datasets store each band in its own file;
+    tif and raw datasets store the bands in a single file
+    '''
+
+    if dataset.type in ['tif', 'raw']:
+        return [(dataset.path, band) for band in bands]
+    return [(dataset.filepath(band), 1) for band in bands]
+
+
+def scaling_lut(gamma=None, levels=None):
+    '''
+    A uint8 lookup table mapping `levels` evenly-spaced intensities in [0, 1]
+    to gamma-corrected uint8 values
+    '''
+
+    if levels is None:
+        levels = LUT_LEVELS
+
+    lut = np.linspace(0, 1, levels)
+    if gamma:
+        lut **= gamma
+    return np.round(lut*255).astype('uint8')
+
+
+def apply_lut(im, lut, minn, maxx, nodata=None):
+    '''
+    Scale an image to uint8 by quantizing it between minn and maxx
+    and looking up the quantized values in a LUT (as returned by `scaling_lut`)
+
+    This is equivalent to `utils.autoscale(im, minn=minn, maxx=maxx, gamma=gamma, dtype='uint8')`
+    to within the quantization, but it requires no per-pixel power
+    '''
+
+    levels = len(lut)
+    inds = im.astype('float32')
+    inds -= minn
+    inds *= (levels - 1)/(maxx - minn)
+    np.clip(inds, 0, levels - 1, out=inds)
+
+    im_dst = lut[np.round(inds).astype('intp')]
+    if nodata is not None:
+        im_dst[im == nodata] = 0
+    return im_dst
+
+
+def autoscale_limits(filepath, band, percentile=None):
+    '''
+    The min/max intensities of a band, ignoring nodata pixels, given a percentile
+    (as in `utils.autoscale`, percentile=None means the absolute min/max)
+
+    The limits are calculated from the band's cached statistics, if they exist (see stats.py)
+    '''
+
+    limits = stats.cached_limits(filepath, percentile, indexes=[band])
+    if limits is not None:
+        return limits[0]
+
+    if percentile is None:
+        percentile = 100
+
+    with raster_io.open(filepath) as src:
+        im = src.read(band)
+        if src.nodata is not None:
+            im = im[im != src.nodata]
+
+    minn, maxx = np.percentile(im, [100 - percentile, percentile])
+    return float(minn), float(maxx)
+
+
+def render_frame(task, luts, limits):
+    '''
+    Render one frame and write it to a PNG file
+
+    task : a tuple of (band sources, frame filepath)
+        where band sources is a list of (filepath, band index) tuples, as returned by `band_sources`
+    luts, limits : the LUT and the (minn, maxx) limits of each band
+
+    Returns the frame filepath
+    '''
+
+    sources, frame_filepath = task
+
+    channels = []
+    for (filepath, band), lut, (minn, maxx) in zip(sources, luts, limits):
+        with raster_io.open(filepath) as src:
+            channels.append(apply_lut(src.read(band), lut, minn, maxx, nodata=src.nodata))
+
+    shapes = set(channel.shape for channel in channels)
+    if len(shapes) > 1:
+        raise ValueError('The bands of %s have different shapes %s; harmonize them first' % \
+            (sources[0][0], sorted(shapes)))
+
+    frame = np.array(channels)
+
+    # the PNG frames are not georeferenced
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', rasterio.errors.NotGeoreferencedWarning)
+        with rasterio.open(
+            frame_filepath, 'w',
+            driver='PNG',
+            dtype='uint8',
+            count=frame.shape[0],
+            height=frame.shape[1],
+            width=frame.shape[2]) as dst:
+            dst.write(frame)
+
+    return frame_filepath
@@ -0,0 +1,359 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+from affine import Affine
+from rasterio import warp
+from rasterio.crs import CRS
+from rasterio.windows import Window
+
+from . import windows
+
+
+def destination_grid(src_crs, src_transform, src_shape, dst_crs, res=None, bounds=None):
+    '''
+    Calculate the transform and shape of a reprojected grid
+
+    src_shape : the (height, width) of the source grid
+    res : resolution in units of the destination CRS
+        (if None, the resolution is chosen by GDAL to preserve the source resolution)
+    bounds : bounds in the destination CRS (*not* in lat/lon degrees)
+
+    Returns dst_transform, (dst_height, dst_width)
+    '''
+
+    height, width = src_shape
+    left, top = src_transform * (0, 0)
+    right, bottom = src_transform * (width, height)
+
+    if bounds is None:
+        dst_transform, dst_width, dst_height = warp.calculate_default_transform(
+            src_crs, dst_crs, width, height,
+            left=left, bottom=bottom, right=right, top=top,
+            resolution=res)
+        return dst_transform, (dst_height, dst_width)
+
+    if res is None:
+        default_transform, _, _ = warp.calculate_default_transform(
+            src_crs, dst_crs, width, height,
+            left=left, bottom=bottom, right=right, top=top)
+        res = default_transform.a
+
+    dst_left, dst_bottom, dst_right, dst_top = bounds
+    dst_width = max(int(np.ceil((dst_right - dst_left)/res)), 1)
+    dst_height = max(int(np.ceil((dst_top - dst_bottom)/res)), 1)
+    dst_transform = Affine(res, 0, dst_left, 0, -res, dst_top)
+
+    return dst_transform, (dst_height, dst_width)
+
+
+def project_pixels(dst_crs, dst_transform, window, src_crs):
+    '''
+    Calculate the coordinates, in the source CRS, of the centers of the destination pixels in a window
+
+    This is the expensive part of reprojection (one PROJ transformation per pixel),
+    and it is independent of the source grid's resolution;
+    the result can therefore be shared by all of the bands in a multi-resolution dataset
+
+    Returns two float64 arrays (xs, ys) with the shape of the window;
+    pixels that cannot be projected (e.g., off the edge of the disk for a geostationary CRS) are NaN
+    '''
+
+    rows, cols = np.mgrid[
+        window.row_off:window.row_off + window.height,
+        window.col_off:window.col_off + window.width]
+
+    xs, ys = dst_transform * (cols.ravel() + .5, rows.ravel() + .5)
+    xs, ys = warp.transform(dst_crs, src_crs, xs, ys)
+
+    shape = (int(window.height), int(window.width))
+    xs = np.asarray(xs, dtype='float64').reshape(shape)
+    ys = np.asarray(ys, dtype='float64').reshape(shape)
+
+    invalid = ~(np.isfinite(xs) & np.isfinite(ys))
+    xs[invalid] = np.nan
+    ys[invalid] = np.nan
+    return xs, ys
+
+
+class PixelMap(object):
+    '''
+    A map from each destination pixel to the source pixels from which it is bilinearly interpolated
+
+    For each destination pixel, we store the (row, col) index of the upper-left source pixel
+    of the 2x2 neighborhood and the fractional offsets (the interpolation weights) within it.
+    Destination pixels that fall outside of the source grid have a row index of -1.
+
+    Reprojecting a band given a PixelMap is a cheap gather-and-interpolate.
+    '''
+
+    _array_names = ['rows', 'cols', 'row_weights', 'col_weights']
+
+
+    def __init__(self, rows, cols, row_weights, col_weights):
+
+        # int32 indices of the upper-left source pixel
+        self.rows = rows
+        self.cols = cols
+
+        # float32 fractional offsets within the 2x2 neighborhood
+        self.row_weights = row_weights
+        self.col_weights = col_weights
+
+
+    @classmethod
+    def from_coords(cls, xs, ys, src_transform, src_shape):
+        '''
+        Construct a map from projected pixel coordinates (as returned by `project_pixels`)
+        and the transform and (height, width) shape of the source grid
+        '''
+
+        height, width = src_shape
+
+        # continuous pixel coordinates relative to the centers of the source pixels
+        cols, rows = ~src_transform * (xs, ys)
+        cols = np.asarray(cols) - .5
+        rows = np.asarray(rows) - .5
+
+        with np.errstate(invalid='ignore'):
+            valid = (rows >= 0) & (rows <= height - 1) & (cols >= 0) & (cols <= width - 1)
+
+        rows = np.where(valid, rows, 0)
+        cols = np.where(valid, cols, 0)
+
+        # clip the upper-left index so that the 2x2 neighborhood is always inside the grid
+        row_inds = np.clip(np.floor(rows), 0, max(height - 2, 0))
+        col_inds = np.clip(np.floor(cols), 0, max(width - 2, 0))
+
+        row_weights = (rows - row_inds).astype('float32')
+        col_weights = (cols - col_inds).astype('float32')
+
+        row_inds = row_inds.astype('int32')
+        col_inds = col_inds.astype('int32')
+        row_inds[~valid] = -1
+
+        return cls(row_inds, col_inds, row_weights, col_weights)
+
+
+    @classmethod
+    def load(cls, dirpath):
+        '''
+        Load a saved map as read-only memory-mapped arrays
+        '''
+        arrays = [
+            np.load(os.path.join(dirpath, '%s.npy' % name), mmap_mode='r')
+            for name in cls._array_names]
+        return cls(*arrays)
+
+
+    def save(self, dirpath):
+        os.makedirs(dirpath, exist_ok=True)
+        for name in self._array_names:
+            np.save(os.path.join(dirpath, '%s.npy' % name), getattr(self, name))
+
+
+    @property
+    def shape(self):
+        return self.rows.shape
+
+
+    def window(self, window):
+        '''
+        The map for a window of the destination grid
+        '''
+        rows, cols = window.toslices()
+        return PixelMap(
+            self.rows[rows, cols],
+            self.cols[rows, cols],
+            self.row_weights[rows, cols],
+            self.col_weights[rows, cols])
+
+
+    def source_window(self):
+        '''
+        The smallest window of the source grid that contains every source pixel used by the map
+        (or None if no destination pixel falls inside of the source grid)
+        '''
+
+        valid = self.rows >= 0
+        if not valid.any():
+            return None
+
+        rows = self.rows[valid]
+        cols = self.cols[valid]
+        row_min, col_min = rows.min(), cols.min()
+        return Window(
+            int(col_min),
+            int(row_min),
+            int(cols.max() - col_min) + 2,
+            int(rows.max() - row_min) + 2)
+
+
+    def apply(self, im, src_window=None, nodata=None, dst_nodata=0):
+        '''
+        Bilinearly interpolate a source image onto the destination pixels
+
+        im : a 2D array containing (at least) the source pixels in `src_window`
+        src_window : the window of the source grid that `im` represents
+            (if None, `im` is assumed to be the entire source grid)
+        nodata : the source nodata value; destination pixels that depend on a nodata pixel
+            are set to dst_nodata
+
+        Returns a float32 array with the shape of the map
+        '''
+
+        row_off, col_off = 0, 0
+        if src_window is not None:
+            row_off, col_off = int(src_window.row_off), int(src_window.col_off)
+
+        valid = self.rows >= 0
+        rows = np.where(valid, self.rows - row_off, 0)
+        cols = np.where(valid, self.cols - col_off, 0)
+
+        # the rows and cols of the 2x2 neighborhood
+        # (clipped, because the source window may be only one pixel wide at the edge of the source grid)
+        rows_ = np.minimum(rows + 1, im.shape[0] - 1)
+        cols_ = np.minimum(cols + 1, im.shape[1] - 1)
+
+        ul, ur = im[rows, cols], im[rows, cols_]
+        ll, lr = im[rows_, cols], im[rows_, cols_]
+
+        if nodata is not None:
+            valid &= (ul != nodata) & (ur != nodata) & (ll != nodata) & (lr != nodata)
+
+        wr, wc = self.row_weights, self.col_weights
+        top = ul*(1 - wc) + ur*wc
+        bottom = ll*(1 - wc) + lr*wc
+        result = (top*(1 - wr) + bottom*wr).astype('float32')
+
+        result[~valid] = dst_nodata
+        return result
+
+
+def gather(src, pixel_map, dtype=None, dst_nodata=0):
+    '''
+    Reproject a window of the first band of an open rasterio dataset given the window's pixel map
+
+    Only the window of the source grid that the map refers to is read.
+    If dtype is an integer type, the interpolated values are rounded before they are cast.
+    '''
+
+    if dtype is None:
+        dtype = src.profile['dtype']
+
+    src_window = pixel_map.source_window()
+    if src_window is None:
+        return np.full(pixel_map.shape, dst_nodata, dtype=dtype)
+
+    im = pixel_map.apply(
+        src.read(1, window=src_window), src_window, nodata=src.nodata, dst_nodata=dst_nodata)
+
+    if np.issubdtype(np.dtype(dtype), np.integer):
+        im = np.round(im)
+    return im.astype(dtype)
+
+
+class PixelMapCache(object):
+    '''
+    An on-disk cache of pixel maps for entire destination grids
+
+    Maps are keyed on the source grid (CRS, transform and shape), the destination CRS,
+    and the destination grid (whose transform and shape encode the destination resolution and bounds).
+    They are stored as .npy files and memory-mapped when loaded, so that reprojecting a window
+    reads only the part of each map that the window covers.
+
+    This is useful when many datasets share the same source grid
+    (e.g., the GOES CONUS fixed grid of a time series of scans)
+    '''
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+
+    @staticmethod
+    def key(src_crs, src_transform, src_shape, dst_crs, dst_transform, dst_shape):
+        props = [
+            CRS.from_user_input(src_crs).to_wkt(),
+            list(src_transform)[:6],
+            list(map(int, src_shape)),
+            CRS.from_user_input(dst_crs).to_wkt(),
+            list(dst_transform)[:6],
+            list(map(int, dst_shape)),
+        ]
+        return hashlib.sha1(json.dumps(props).encode()).hexdigest()
+
+
+    def get(self, src_crs, src_grids, dst_crs, dst_transform, dst_shape):
+        '''
+        Load (or calculate and cache) the pixel maps from a destination grid to a set of source grids
+
+        src_grids : a list of (transform, shape) tuples for source grids in the same CRS
+            (e.g., the grids of the bands of a multi-resolution dataset)
+
+        Returns a list of memory-mapped PixelMaps, one for each source grid
+        '''
+
+        keys = [
+            self.key(src_crs, transform, shape, dst_crs, dst_transform, dst_shape)
+            for transform, shape in src_grids]
+
+        missing = {}
+        for key, grid in zip(keys, src_grids):
+            if not os.path.isdir(os.path.join(self.cache_dir, key)):
+                missing[key] = grid
+
+        if missing:
+            self._build(missing, src_crs, dst_crs, dst_transform, dst_shape)
+
+        return [PixelMap.load(os.path.join(self.cache_dir, key)) for key in keys]
+
+
+    def _build(self, src_grids, src_crs, dst_crs, dst_transform, dst_shape):
+        '''
+        Calculate the maps for a dict of source grids (keyed by cache key) in a single windowed pass
+        over the destination grid, projecting the pixels of each window only once
+
+        The maps are written to temporary directories and then renamed,
+        so that an interrupted build never leaves a partial map in the cache
+        '''
+
+        dst_height, dst_width = dst_shape
+        dtypes = {'rows': 'int32', 'cols': 'int32', 'row_weights': 'float32', 'col_weights': 'float32'}
+
+        tmp_dirs, arrays = {}, {}
+        for key in src_grids.keys():
+            tmp_dirs[key] = tempfile.mkdtemp(dir=self.cache_dir)
+            arrays[key] = {
+                name: np.lib.format.open_memmap(
+                    os.path.join(tmp_dirs[key], '%s.npy' % name),
+                    mode='w+', dtype=dtype, shape=(dst_height, dst_width))
+                for name, dtype in dtypes.items()}
+
+        try:
+            for window in windows.block_windows(dst_width, dst_height):
+                xs, ys = project_pixels(dst_crs, dst_transform, window, src_crs)
+                rows, cols = window.toslices()
+                for key, (transform, shape) in src_grids.items():
+                    pixel_map = PixelMap.from_coords(xs, ys, transform, shape)
+                    for name in dtypes.keys():
+                        arrays[key][name][rows, cols] = getattr(pixel_map, name)
+
+            for key in src_grids.keys():
+                for array in arrays[key].values():
+                    array.flush()
+                del arrays[key]
+
+                # if the rename fails, the temporary directory is removed below
+                try:
+                    os.rename(tmp_dirs[key], os.path.join(self.cache_dir, key))
+                    del tmp_dirs[key]
+                except OSError:
+                    # another process cached the same map first
+                    pass
+        finally:
+            for tmp_dir in tmp_dirs.values():
+                shutil.rmtree(tmp_dir, ignore_errors=True)
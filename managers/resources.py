@@ -0,0 +1,146 @@
+'''
+CPU-thread and memory budgets for operations
+
+A Resources object divides the machine's CPUs and (a fraction of) its memory between
+at most `max_operations` concurrently running operations, and passes each operation's budget
+to both backends: to CLI commands (e.g., gdaldem) via the GDAL_NUM_THREADS and GDAL_CACHEMAX environment variables,
+and to in-process operations via a rasterio.Env, the number of worker threads (e.g., of the block-by-block warp)
+and the memory budgets of GDAL's warper and of the chunked engine.
+
+Each operation's memory budget is split between the GDAL block cache, the warper
+and the chunks processed in-process (see `gdal_cache` and `warp_memory`).
+Operations that would exceed `max_operations` block until a running operation finishes,
+so that several projects (or threads) that share a Resources object cannot oversubscribe the machine.
+'''
+
+import os
+import threading
+import rasterio
+
+from . import engine
+from . import settings
+
+
+# the fraction of the physical memory that all operations together may use by default
+DEFAULT_MEMORY_FRACTION = .5
+
+
+class Resources(object):
+
+    def __init__(self, threads=None, memory=None, max_operations=None):
+        '''
+        threads : the number of CPU threads per operation
+            (defaults to the number of CPUs divided by max_operations)
+        memory : the memory budget per operation, in MB
+            (defaults to half of the physical memory divided by max_operations)
+        max_operations : the maximum number of operations that can run at once (defaults to one)
+        '''
+
+        if max_operations is None:
+            max_operations = 1
+        if max_operations < 1:
+            raise ValueError('max_operations must be at least one')
+
+        if threads is None:
+            threads = max((os.cpu_count() or 1)//max_operations, 1)
+
+        if memory is None:
+            memory = (engine.physical_memory() or 4096)*DEFAULT_MEMORY_FRACTION/max_operations
+
+        self.threads = int(threads)
+        self.memory = int(memory)
+        self.max_operations = max_operations
+        self._semaphore = threading.BoundedSemaphore(max_operations)
+
+        # the depth of nested operations in each thread
+        # (an operation that runs another operation must not wait for a second slot)
+        self._local = threading.local()
+
+
+    @property
+    def gdal_cache(self):
+        '''
+        The size of GDAL's block cache, in MB (one quarter of the memory budget)
+        '''
+        return max(self.memory//4, 1)
+
+
+    @property
+    def warp_memory(self):
+        '''
+        The working memory of GDAL's warper, in MB (one quarter of the memory budget)
+        '''
+        return max(self.memory//4, 1)
+
+
+    @property
+    def engine_memory(self):
+        '''
+        The memory budget of the chunked engine, in MB (what remains of the memory budget)
+        '''
+        return max(self.memory - self.gdal_cache - self.warp_memory, 1)
+
+
+    def budgets(self):
+        '''
+        The budgets of an operation, as they are recorded in its props
+        '''
+        return {
+            'threads': self.threads,
+            'memory': self.memory,
+            'gdal_cache': self.gdal_cache,
+            'warp_memory': self.warp_memory,
+        }
+
+
+    def gdal_options(self):
+        '''
+        The GDAL config options (GDAL_CACHEMAX is in MB)
+        '''
+        return {
+            'GDAL_NUM_THREADS': self.threads,
+            'GDAL_CACHEMAX': self.gdal_cache,
+        }
+
+
+    def env(self):
+        '''
+        The environment of CLI commands
+        '''
+        env = dict(settings.RIO_ENV)
+        env.update({key: str(value) for key, value in self.gdal_options().items()})
+        return env
+
+
+    def rasterio_env(self):
+        '''
+        The rasterio environment of in-process operations
+        '''
+        return rasterio.Env(**self.gdal_options())
+
+
+    def __enter__(self):
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 0:
+            self._semaphore.acquire()
+        self._local.depth = depth + 1
+        return self
+
+
+    def __exit__(self, *args):
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            self._semaphore.release()
+
+
+# the resources shared by every project that is not given its own
+_default_resources = None
+_default_lock = threading.Lock()
+
+
+def default_resources():
+    global _default_resources
+    with _default_lock:
+        if _default_resources is None:
+            _default_resources = Resources()
+    return _default_resources
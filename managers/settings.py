@@ -11,3 +11,12 @@ RIO_ENV = {
 
 # local path to texture shading binaries
 TEXTURE_SHADER_PATH = '/home/keith/Dropbox/texture-shading/bin/'
+
+# where the bands of gzipped raw Landsat archives are extracted
+# (if None, next to each archive; see archives.py)
+ARCHIVE_EXTRACT_ROOT = None
+
+# how the chunked engine runs its kernels: 'threads', 'processes' or 'auto' (see engine.py)
+# (worker processes import the main module, so use 'processes' only in scripts whose top-level code
+# is guarded by `if __name__ == '__main__':`)
+ENGINE_EXECUTOR = 'threads'
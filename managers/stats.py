@@ -0,0 +1,243 @@
+'''
+Per-band statistics of raster files, cached in JSON sidecars
+
+The statistics of each band are its min, max and mean (of the pixels that are not nodata),
+the number of nodata pixels, and a histogram: an exact histogram of the distinct values,
+for 8- and 16-bit integer data, or a histogram with pipelines.HISTOGRAM_BINS bins between the min and max,
+for other data.
+
+Statistics are computed once, when a dataset is written by an operation (see RasterProject._compute_stats),
+and stored in a sidecar next to each file ('<filepath>.stats.json'); percentile queries
+(e.g., the limits used by autogain) are then answered from the sidecar without reading the file.
+A sidecar records the size and modification time of its file, and is ignored if the file has changed.
+'''
+
+import os
+import json
+import functools
+import numpy as np
+
+from . import utils
+from . import kernels
+from . import raster_io
+from . import pipelines
+
+
+SIDECAR_SUFFIX = '.stats.json'
+
+
+def sidecar_path(filepath):
+    return filepath + SIDECAR_SUFFIX
+
+
+def _file_key(filepath):
+    stat = os.stat(filepath)
+    return [stat.st_size, stat.st_mtime]
+
+
+def _add(first, second):
+    '''
+    Combine the partial statistics of each band from two chunks
+    '''
+    combined = []
+    for a, b in zip(first, second):
+        combined.append({
+            'count': a['count'] + b['count'],
+            'nodata_count': a['nodata_count'] + b['nodata_count'],
+            'sum': a['sum'] + b['sum'],
+            'min': min(a['min'], b['min']),
+            'max': max(a['max'], b['max']),
+            'counts': a['counts'] + b['counts'] if a.get('counts') is not None else None,
+        })
+    return combined
+
+
+def compute(filepath, chunked):
+    '''
+    Compute the statistics of each band of a file, chunk-by-chunk
+
+    chunked : an engine.ChunkedEngine
+    Returns a list of dicts, one for each band
+    (exact histograms require one pass over the file, binned histograms two)
+    '''
+
+    with raster_io.open(filepath) as src:
+        dtype = np.dtype(src.dtypes[0])
+        nodata = src.nodata
+
+    exact = np.issubdtype(dtype, np.integer) and dtype.itemsize <= 2
+    if exact:
+        offset = int(np.iinfo(dtype).min)
+        num_values = int(np.iinfo(dtype).max) - offset + 1
+    else:
+        offset, num_values = None, None
+
+    partial_stats = chunked.reduce(
+        [filepath],
+        functools.partial(kernels.partial_stats, nodata=nodata, offset=offset, num_values=num_values),
+        combine=_add)
+
+    # binned histograms between the min and max of each band
+    if not exact:
+        histograms = chunked.reduce(
+            [filepath],
+            functools.partial(kernels.valid_histograms, band_stats=partial_stats, nodata=nodata),
+            combine=lambda a, b: [a_ + b_ for a_, b_ in zip(a, b)])
+
+    band_stats = []
+    for ind, stats in enumerate(partial_stats):
+        if exact:
+            nonzero = np.flatnonzero(stats['counts'])
+            histogram = {
+                'values': (nonzero + offset).tolist(),
+                'counts': stats['counts'][nonzero].tolist(),
+            }
+        else:
+            histogram = {
+                'range': [stats['min'], stats['max']],
+                'counts': histograms[ind].tolist(),
+            }
+
+        has_data = stats['count'] > 0
+        band_stats.append({
+            'min': stats['min'] if has_data else None,
+            'max': stats['max'] if has_data else None,
+            'mean': stats['sum']/stats['count'] if has_data else None,
+            'count': int(stats['count']),
+            'nodata': nodata,
+            'nodata_count': int(stats['nodata_count']),
+            'histogram': histogram,
+        })
+    return band_stats
+
+
+def write(filepath, chunked):
+    '''
+    Compute the statistics of a file and write them to its sidecar
+    '''
+    props = {'file': _file_key(filepath), 'bands': compute(filepath, chunked)}
+    with open(sidecar_path(filepath), 'w') as file:
+        json.dump(props, file)
+    return props['bands']
+
+
+def load(filepath):
+    '''
+    Load the cached statistics of each band of a file,
+    or None if there is no sidecar or if the file has changed since the sidecar was written
+    '''
+
+    path = sidecar_path(filepath)
+    if not os.path.isfile(path) or not os.path.isfile(filepath):
+        return None
+
+    with open(path, 'r') as file:
+        props = json.load(file)
+
+    if props.get('file') != _file_key(filepath):
+        return None
+    return props['bands']
+
+
+def merge(band_stats):
+    '''
+    Merge the statistics of several bands (e.g., to autoscale all of the bands of an image together)
+    Returns None if the bands have binned histograms, which cannot be merged exactly
+    '''
+
+    if len(band_stats) == 1:
+        return band_stats[0]
+
+    if any('values' not in stats['histogram'] for stats in band_stats):
+        return None
+
+    counts = {}
+    for stats in band_stats:
+        for value, count in zip(stats['histogram']['values'], stats['histogram']['counts']):
+            counts[value] = counts.get(value, 0) + count
+    values = sorted(counts.keys())
+
+    valid = [stats for stats in band_stats if stats['count']]
+    count = sum(stats['count'] for stats in band_stats)
+    return {
+        'min': min(stats['min'] for stats in valid) if valid else None,
+        'max': max(stats['max'] for stats in valid) if valid else None,
+        'mean': sum(stats['mean']*stats['count'] for stats in valid)/count if count else None,
+        'count': count,
+        'nodata': band_stats[0]['nodata'],
+        'nodata_count': sum(stats['nodata_count'] for stats in band_stats),
+        'histogram': {'values': values, 'counts': [counts[value] for value in values]},
+    }
+
+
+def limits(stats, percentile=None, include_nodata=False):
+    '''
+    The min/max intensities of a band given its statistics and a percentile
+    (as in utils.autoscale, percentile=None means the absolute min/max)
+
+    include_nodata : whether to include the nodata pixels, as utils.autoscale does
+        (this is exact for exact histograms; for binned histograms, the nodata pixels are ignored)
+
+    For exact histograms, the limits are identical to those calculated by np.percentile
+    Returns (minn, maxx), or None if the band has no data
+    '''
+
+    if percentile is None:
+        percentile = 100
+    percentiles = [100 - percentile, percentile]
+
+    histogram = stats['histogram']
+    nodata, nodata_count = stats['nodata'], stats['nodata_count']
+    include_nodata = include_nodata and nodata is not None and nodata_count > 0
+
+    if 'values' in histogram:
+        values, counts = list(histogram['values']), list(histogram['counts'])
+        if include_nodata:
+            values.append(nodata)
+            counts.append(nodata_count)
+            order = np.argsort(values)
+            values, counts = np.array(values)[order], np.array(counts)[order]
+        if not len(values):
+            return None
+        minn, maxx = utils.histogram_percentiles(np.array(values), np.array(counts), percentiles)
+        return float(minn), float(maxx)
+
+    if not stats['count']:
+        return None
+
+    if percentile == 100:
+        minn, maxx = stats['min'], stats['max']
+        if include_nodata:
+            minn, maxx = min(minn, nodata), max(maxx, nodata)
+        return float(minn), float(maxx)
+
+    minn, maxx = histogram['range']
+    return tuple(pipelines.histogram_percentiles(np.array(histogram['counts']), minn, maxx, percentiles))
+
+
+def cached_limits(filepath, percentile=None, each_band=True, include_nodata=False, indexes=None):
+    '''
+    The min/max intensities of each band of a file (or of all of its bands together),
+    from its cached statistics
+
+    indexes : the bands (indexed from one) to include (defaults to all bands)
+    Returns a list of (minn, maxx) tuples (of one tuple, if each_band is False),
+    or None if the statistics are not cached (or cannot answer the query)
+    '''
+
+    band_stats = load(filepath)
+    if band_stats is None:
+        return None
+
+    if indexes is not None:
+        band_stats = [band_stats[index - 1] for index in indexes]
+
+    if not each_band:
+        band_stats = [merge(band_stats)]
+        if band_stats[0] is None:
+            return None
+
+    results = [limits(stats, percentile, include_nodata=include_nodata) for stats in band_stats]
+    if any(result is None for result in results):
+        return None
+    return results
@@ -0,0 +1,339 @@
+'''
+Disk-quota management for the datasets of a project
+
+Every operation creates a new dataset in the project root, so projects grow without limit.
+The StorageManager tracks when each derived dataset was last accessed (created, or used as a source),
+and, when the derived datasets exceed the disk quota, evicts the least-recently-used datasets
+that can be regenerated from the operation log. The operation that created an evicted dataset
+remains in the log, marked as evicted, and the dataset is regenerated, at its original path,
+the next time it is used as a source (or when `ensure` is called).
+
+Access times are recorded on every operation, so, like the operations themselves (see journal.py),
+they are appended to a journal ('storage.jsonl') and only written in full to 'storage.json'
+when the journal is compacted.
+
+It also reports (and removes) orphaned files in the project root that no operation references.
+'''
+
+import os
+import json
+import time
+import shutil
+import threading
+
+from . import stats
+
+
+class StorageManager(object):
+
+    # the files, relative to the project root, in which access times are stored
+    # (a snapshot, and a journal of the changes since the snapshot)
+    _access_times_filename = 'storage.json'
+    _access_journal_filename = 'storage.jsonl'
+
+    # the number of journal entries after which the journal is compacted into the snapshot
+    _journal_compaction_interval = 100
+
+    # files and directories in the project root that are never orphans
+    # (the props, the operations journal, the access times and their journal, and the cache directory)
+    _reserved_names = [
+        'props.json', 'operations.jsonl', _access_times_filename, _access_journal_filename, 'cache']
+
+
+    def __init__(self, project, quota=None):
+        '''
+        project : the RasterProject whose datasets are managed
+        quota : the disk quota, in MB, for the derived datasets (if None, datasets are never evicted)
+        '''
+
+        self.project = project
+        self.quota = quota
+
+        self._lock = threading.RLock()
+        self._access_times_path = os.path.join(project.project_root, self._access_times_filename)
+        self._access_journal_path = os.path.join(project.project_root, self._access_journal_filename)
+
+        self.access_times = {}
+        if os.path.isfile(self._access_times_path):
+            with open(self._access_times_path, 'r') as file:
+                self.access_times = json.load(file)
+
+        # replay and compact the journal
+        # (ignoring an incomplete final entry, as journal.Journal does, so that new entries are not appended to it)
+        self._journal_length = 0
+        if os.path.isfile(self._access_journal_path):
+            with open(self._access_journal_path, 'r') as file:
+                lines = file.read().split('\n')[:-1]
+            for line in lines:
+                if line.strip():
+                    self._apply(json.loads(line))
+            self.save()
+
+        # the paths at which the datasets being regenerated in each thread must be created
+        self._local = threading.local()
+
+
+    def _apply(self, access_times):
+        '''
+        Apply a journal entry of {path: access time} (a time of None means the dataset was deleted)
+        '''
+        for path, access_time in access_times.items():
+            if access_time is None:
+                self.access_times.pop(path, None)
+            else:
+                self.access_times[path] = access_time
+
+
+    def _save_access_times(self, access_times):
+        '''
+        Append a change to the access times to the journal, and compact the journal if it is long enough
+
+        Access times are only used to choose which datasets to evict, so the journal is not fsynced
+        '''
+
+        with open(self._access_journal_path, 'a') as file:
+            file.write(json.dumps(access_times) + '\n')
+
+        self._journal_length += 1
+        if self._journal_length >= self._journal_compaction_interval:
+            self.save()
+
+
+    def save(self):
+        '''
+        Write a snapshot of the access times to storage.json and clear the journal
+        '''
+
+        with self._lock:
+            tmp_path = self._access_times_path + '.tmp'
+            with open(tmp_path, 'w') as file:
+                json.dump(self.access_times, file)
+            os.replace(tmp_path, self._access_times_path)
+
+            if os.path.isfile(self._access_journal_path):
+                os.remove(self._access_journal_path)
+            self._journal_length = 0
+
+
+    def _log(self, operation):
+        '''
+        Journal a change to a logged operation (see RasterProject.log)
+        '''
+        if operation in self.project.operations:
+            self.project.log(operation, index=self.project.operations.index(operation))
+
+
+    def touch(self, datasets_):
+        '''
+        Record that a list of datasets was accessed now
+        '''
+        with self._lock:
+            now = time.time()
+            access_times = {dataset.path: now for dataset in datasets_}
+            self._apply(access_times)
+            self._save_access_times(access_times)
+
+
+    def _producers(self):
+        '''
+        The logged operation that created each dataset, keyed by the dataset's path
+        '''
+        return {
+            dataset.path: operation
+            for operation in self.project.operations for dataset in operation._destination}
+
+
+    @staticmethod
+    def size(dataset):
+        '''
+        The size, in MB, of the extant files of a dataset
+        '''
+        return sum(os.path.getsize(filepath) for filepath in dataset.files())/2**20
+
+
+    def usage(self):
+        '''
+        The total size, in MB, of the extant derived datasets
+        '''
+        return sum(
+            self.size(dataset) for operation in self.project.operations for dataset in operation._destination)
+
+
+    def is_regenerable(self, operation, producers=None):
+        '''
+        Whether the destinations of an operation can be regenerated from the operation log;
+        that is, whether each of its sources either exists or can itself be regenerated
+        '''
+
+        if producers is None:
+            producers = self._producers()
+
+        for dataset in operation._source:
+            producer = producers.get(dataset.path)
+            if producer is None:
+                if not dataset.files():
+                    return False
+            elif producer.evicted:
+                if not self.is_regenerable(producer, producers):
+                    return False
+        return True
+
+
+    def evict(self, operation):
+        '''
+        Delete the destinations of an operation and mark the operation as evicted
+        '''
+
+        with self._lock:
+            for dataset in operation._destination:
+                if os.path.isdir(dataset.path):
+                    shutil.rmtree(dataset.path)
+                else:
+                    for filepath in dataset.files():
+                        os.remove(filepath)
+
+            access_times = {dataset.path: None for dataset in operation._destination}
+            self._apply(access_times)
+            operation.evicted = True
+            self._save_access_times(access_times)
+            self._log(operation)
+
+
+    def enforce_quota(self, keep=None):
+        '''
+        Evict the least-recently-used regenerable datasets until the derived datasets fit in the quota
+
+        keep : a list of datasets that must not be evicted (e.g., the sources and destination
+            of the operation that just ran)
+        Returns the list of evicted operations
+        '''
+
+        if self.quota is None:
+            return []
+
+        keep_paths = set(dataset.path for dataset in (keep or []))
+
+        with self._lock:
+            producers = self._producers()
+
+            sizes = {
+                operation: sum(self.size(dataset) for dataset in operation._destination)
+                for operation in self.project.operations if not operation.evicted}
+            usage = sum(sizes.values())
+
+            candidates = [
+                operation for operation in sizes.keys()
+                if not any(dataset.path in keep_paths for dataset in operation._destination)]
+
+            # least recently accessed first (datasets with no recorded access are the oldest)
+            candidates = sorted(
+                candidates,
+                key=lambda operation: max(
+                    self.access_times.get(dataset.path, 0) for dataset in operation._destination))
+
+            evicted = []
+            for operation in candidates:
+                if usage <= self.quota:
+                    break
+                if not self.is_regenerable(operation, producers):
+                    continue
+                print('Evicting %s' % ', '.join(dataset.name for dataset in operation._destination))
+                self.evict(operation)
+                usage -= sizes[operation]
+                evicted.append(operation)
+
+            if usage > self.quota:
+                print('Warning: the datasets of project %s use %0.1f MB, which exceeds the quota of %0.1f MB' % \
+                    (self.project.project_name, usage, self.quota))
+
+        return evicted
+
+
+    def ensure(self, datasets_):
+        '''
+        Regenerate any evicted datasets in a list of datasets
+        '''
+
+        producers = self._producers()
+        for dataset in datasets_:
+            operation = producers.get(dataset.path)
+            if operation is not None and operation.evicted:
+                self.regenerate(operation)
+
+
+    def regenerate(self, operation):
+        '''
+        Re-run an evicted operation, recreating its destinations at their original paths
+        '''
+
+        # regenerate the sources first, so that they are not regenerated
+        # while the operation's destination path is pending
+        self.ensure(operation._source)
+
+        print('Regenerating %s' % ', '.join(dataset.name for dataset in operation._destination))
+
+        pending = getattr(self._local, 'pending', [])
+        self._local.pending = pending + [dataset.path for dataset in operation._destination]
+        try:
+            self.project._run_operation(operation)
+        finally:
+            self._local.pending = pending
+
+        operation.evicted = None
+        self.touch(operation._destination)
+        self._log(operation)
+
+
+    def pending_path(self):
+        '''
+        The path at which the next new dataset must be created, if a dataset is being regenerated
+        in this thread (see RasterProject._new_dataset), or None
+        '''
+        pending = getattr(self._local, 'pending', [])
+        if pending:
+            return pending.pop(0)
+        return None
+
+
+    def orphans(self):
+        '''
+        The files and directories in the project root that are not referenced by any operation
+        '''
+
+        referenced = set()
+        for operation in self.project.operations:
+            for dataset in operation._source + operation._destination:
+                referenced.add(dataset.path)
+                if dataset.type == 'raw':
+                    referenced.add(dataset.sidecar_path)
+
+                # the statistics sidecars of the dataset's files
+                for filepath in [dataset.path] + dataset.files():
+                    referenced.add(stats.sidecar_path(filepath))
+
+        orphans = []
+        for name in sorted(os.listdir(self.project.project_root)):
+            path = os.path.join(self.project.project_root, name)
+            if name in self._reserved_names or path in referenced:
+                continue
+            orphans.append(path)
+        return orphans
+
+
+    def remove_orphans(self, dry_run=False):
+        '''
+        Report (and, unless dry_run is True, remove) the orphaned files and directories in the project root
+
+        Returns the list of orphans
+        '''
+
+        orphans = self.orphans()
+        for path in orphans:
+            print('%s orphan %s' % ('Found' if dry_run else 'Removing', path))
+            if dry_run:
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        return orphans
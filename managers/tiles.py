@@ -0,0 +1,255 @@
+'''
+Web map tile pyramids (XYZ directories and MBTiles) of RGB datasets in Web Mercator (EPSG:3857)
+
+Tiles at the maximum zoom are rendered from the source dataset;
+the tiles at each lower zoom are built from the four tiles beneath them,
+so the source is read only once. Tiles are 256x256 RGBA PNGs, in which pixels with no data
+(outside of the source, or equal to the nodata value, or zero, in every band) are transparent;
+tiles with no data at all are not written.
+
+Tiles are rendered and built in worker threads (see RasterProject.export_tiles):
+reading the source and encoding and decoding the PNGs happen in GDAL, which releases the GIL.
+'''
+
+import os
+import math
+import sqlite3
+import warnings
+import numpy as np
+import rasterio
+
+from rasterio.io import MemoryFile
+from rasterio.enums import Resampling
+from rasterio.windows import from_bounds
+
+
+TILE_SIZE = 256
+
+# half of the width of the Web Mercator world, in meters
+ORIGIN_SHIFT = 20037508.342789244
+
+def tile_bounds(z, x, y):
+    '''
+    The (left, bottom, right, top) bounds of an XYZ tile in EPSG:3857
+    '''
+    size = 2*ORIGIN_SHIFT/2**z
+    left = -ORIGIN_SHIFT + x*size
+    top = ORIGIN_SHIFT - y*size
+    return left, top - size, left + size, top
+
+
+def tile_range(bounds, z):
+    '''
+    The XYZ tiles at a zoom level that intersect bounds in EPSG:3857
+
+    Returns a list of (x, y) tuples
+    '''
+
+    left, bottom, right, top = bounds
+    size = 2*ORIGIN_SHIFT/2**z
+    num_tiles = 2**z
+
+    def _index(value):
+        return min(max(int(math.floor(value/size)), 0), num_tiles - 1)
+
+    # (subtract a small fraction of a tile so that bounds on a tile edge don't include the next tile)
+    eps = size*1e-9
+    x_min, x_max = _index(left + ORIGIN_SHIFT), _index(right + ORIGIN_SHIFT - eps)
+    y_min, y_max = _index(ORIGIN_SHIFT - top), _index(ORIGIN_SHIFT - bottom - eps)
+    return [(x, y) for x in range(x_min, x_max + 1) for y in range(y_min, y_max + 1)]
+
+
+def native_zoom(res):
+    '''
+    The lowest zoom at which the tiles' resolution is at least as fine as a resolution in meters
+    '''
+    return max(int(math.ceil(math.log2(2*ORIGIN_SHIFT/(TILE_SIZE*res)))), 0)
+
+
+def intersection(bounds, other):
+    left, bottom = max(bounds[0], other[0]), max(bounds[1], other[1])
+    right, top = min(bounds[2], other[2]), min(bounds[3], other[3])
+    if left >= right or bottom >= top:
+        return None
+    return left, bottom, right, top
+
+
+def encode_png(tile):
+    '''
+    Encode an RGBA tile of shape (4, TILE_SIZE, TILE_SIZE) as a PNG
+    '''
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', rasterio.errors.NotGeoreferencedWarning)
+        with MemoryFile() as memfile:
+            with memfile.open(
+                driver='PNG', dtype='uint8', count=4, width=TILE_SIZE, height=TILE_SIZE) as dst:
+                dst.write(tile)
+            return memfile.read()
+
+
+def decode_png(data):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', rasterio.errors.NotGeoreferencedWarning)
+        with MemoryFile(data) as memfile:
+            with memfile.open() as src:
+                return src.read()
+
+
+def render_tile(src, task):
+    '''
+    Render a tile at the maximum zoom from the source dataset
+
+    src : the open source dataset (opened with raster_io.open by the thread that renders the tile)
+    task : a tuple of (z, x, y)
+    Returns (z, x, y, PNG bytes), or (z, x, y, None) if the tile is empty
+    '''
+
+    z, x, y = task
+    nodata = src.nodata if src.nodata is not None else 0
+
+    window = from_bounds(*tile_bounds(z, x, y), transform=src.transform)
+    im = src.read(
+        indexes=[1, 2, 3],
+        window=window,
+        out_shape=(3, TILE_SIZE, TILE_SIZE),
+        boundless=True,
+        fill_value=nodata,
+        resampling=Resampling.bilinear)
+
+    alpha = np.any(im != nodata, axis=0)
+    if not alpha.any():
+        return z, x, y, None
+
+    tile = np.concatenate((im.astype('uint8'), (alpha*255).astype('uint8')[None, :, :]), axis=0)
+    return z, x, y, encode_png(tile)
+
+
+def build_tile(task):
+    '''
+    Build a tile from the (up to) four tiles beneath it by averaging each 2x2 block of their pixels
+    (weighted by alpha, so that transparent pixels do not darken the edges of the data)
+
+    task : a tuple of (z, x, y, children), where children is a list of the PNG bytes (or None)
+        of the upper-left, upper-right, lower-left and lower-right child tiles
+    Returns (z, x, y, PNG bytes), or (z, x, y, None) if every child is empty
+    '''
+
+    z, x, y, children = task
+
+    mosaic = np.zeros((4, 2*TILE_SIZE, 2*TILE_SIZE), dtype='float32')
+    for ind, data in enumerate(children):
+        if data is None:
+            continue
+        row, col = (ind // 2)*TILE_SIZE, (ind % 2)*TILE_SIZE
+        mosaic[:, row:row + TILE_SIZE, col:col + TILE_SIZE] = decode_png(data)
+
+    blocks = mosaic.reshape(4, TILE_SIZE, 2, TILE_SIZE, 2)
+    alpha = blocks[3]
+    weight = alpha.sum(axis=(1, 3))
+    if not weight.any():
+        return z, x, y, None
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rgb = (blocks[:3]*alpha).sum(axis=(2, 4))/weight
+
+    tile = np.zeros((4, TILE_SIZE, TILE_SIZE), dtype='uint8')
+    tile[:3] = np.round(np.nan_to_num(rgb))
+    tile[3] = np.where(weight > 0, 255, 0)
+    return z, x, y, encode_png(tile)
+
+
+class XYZStore(object):
+    '''
+    Tiles stored as {z}/{x}/{y}.png files in a directory
+    '''
+
+    def __init__(self, dirpath):
+        self.dirpath = dirpath
+        os.makedirs(self.dirpath, exist_ok=True)
+
+
+    def path(self, z, x, y):
+        return os.path.join(self.dirpath, str(z), str(x), '%d.png' % y)
+
+
+    def get(self, z, x, y):
+        path = self.path(z, x, y)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as file:
+            return file.read()
+
+
+    def put(self, z, x, y, data):
+        path = self.path(z, x, y)
+        if data is None:
+            if os.path.isfile(path):
+                os.remove(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(data)
+
+
+    def set_metadata(self, metadata):
+        pass
+
+
+    def close(self):
+        pass
+
+
+class MBTilesStore(object):
+    '''
+    Tiles stored in an MBTiles (SQLite) file
+    (note that MBTiles uses TMS tile rows, which are flipped relative to XYZ rows)
+    '''
+
+    def __init__(self, filepath):
+        self.connection = sqlite3.connect(filepath)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS tiles '
+            '(zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)')
+        self.connection.execute(
+            'CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)')
+
+
+    @staticmethod
+    def _row(z, y):
+        return 2**z - 1 - y
+
+
+    def get(self, z, x, y):
+        result = self.connection.execute(
+            'SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?',
+            (z, x, self._row(z, y))).fetchone()
+        return bytes(result[0]) if result else None
+
+
+    def put(self, z, x, y, data):
+        if data is None:
+            self.connection.execute(
+                'DELETE FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?',
+                (z, x, self._row(z, y)))
+        else:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)',
+                (z, x, self._row(z, y), sqlite3.Binary(data)))
+
+
+    def set_metadata(self, metadata):
+        self.connection.execute('DELETE FROM metadata')
+        self.connection.executemany(
+            'INSERT INTO metadata VALUES (?, ?)', [(key, str(value)) for key, value in metadata.items()])
+
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+def open_store(dataset):
+    if dataset.format == 'mbtiles':
+        return MBTilesStore(dataset.path)
+    return XYZStore(dataset.path)
@@ -1,10 +1,15 @@
 
 import os
+import re
 import sys
 import json
+import time
+import queue
+import threading
 import subprocess
 import numpy as np
 
+from . import windows
 from . import settings
 
 
@@ -77,22 +82,114 @@ def format_rio_option(option):
     return '--' + option
 
 
-def run_command(command=None, verbose=True):
+class CommandCancelled(Exception):
+    pass
 
-    result = subprocess.run(
+
+# GDAL-style progress ticks (e.g., '0...10...20...30' or '100 - done.')
+_progress_pattern = re.compile(rb'(\d+)(?:\.\.\.| - done)')
+
+
+def _stream_reader(stream, name, chunks):
+    '''
+    Read a stream in chunks (not lines, because GDAL prints its progress ticks without newlines)
+    and put (name, chunk) tuples in a queue, followed by (name, None) at EOF
+    '''
+    for chunk in iter(lambda: stream.read1(4096), b''):
+        chunks.put((name, chunk))
+    chunks.put((name, None))
+
+
+def run_command(command=None, verbose=True, env=None, timeout=None, progress=None, cancel_event=None):
+    '''
+    Run a command, streaming its output as it is printed
+
+    env : the environment of the command (defaults to settings.RIO_ENV)
+    timeout : the maximum run time in seconds (if exceeded, the command is killed and
+        subprocess.TimeoutExpired is raised)
+    progress : an optional function called with the percent complete whenever the command
+        prints GDAL-style progress ticks
+    cancel_event : an optional threading.Event; if it is set while the command is running,
+        the command is killed and CommandCancelled is raised
+
+    Raises subprocess.CalledProcessError if the command exits with a non-zero return code
+    Returns a subprocess.CompletedProcess with the (bytes) stdout and stderr
+    '''
+
+    if env is None:
+        env = settings.RIO_ENV
+
+    process = subprocess.Popen(
         command, 
-        stdin=subprocess.PIPE, 
+        stdin=subprocess.DEVNULL, 
         stderr=subprocess.PIPE, 
         stdout=subprocess.PIPE,
-        env=settings.RIO_ENV)
+        env=env)
 
-    if verbose:
-        if result.stderr:
-            print(result.stderr)
-        if result.stdout:
-            print(result.stdout)
-            
-    return result
+    chunks = queue.Queue()
+    readers = [
+        threading.Thread(target=_stream_reader, args=(process.stdout, 'stdout', chunks), daemon=True),
+        threading.Thread(target=_stream_reader, args=(process.stderr, 'stderr', chunks), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+
+    output = {'stdout': b'', 'stderr': b''}
+    partial_lines = {'stdout': b'', 'stderr': b''}
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    try:
+        num_open = len(readers)
+        while num_open:
+            if cancel_event is not None and cancel_event.is_set():
+                raise CommandCancelled('Command cancelled: %s' % command)
+            if deadline is not None and time.monotonic() > deadline:
+                raise subprocess.TimeoutExpired(command, timeout, output['stdout'], output['stderr'])
+
+            try:
+                name, chunk = chunks.get(timeout=.1)
+            except queue.Empty:
+                continue
+
+            # the end of a stream
+            if chunk is None:
+                num_open -= 1
+                if verbose and partial_lines[name]:
+                    print(partial_lines[name].decode(errors='replace'))
+                continue
+
+            output[name] += chunk
+
+            if progress is not None:
+                percents = _progress_pattern.findall(chunk)
+                if percents:
+                    progress(int(percents[-1]))
+
+            # print complete lines as they arrive
+            lines = (partial_lines[name] + chunk).split(b'\n')
+            partial_lines[name] = lines.pop()
+            if verbose:
+                for line in lines:
+                    print(line.decode(errors='replace'))
+
+        process.wait()
+
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+
+    finally:
+        for reader in readers:
+            reader.join()
+        process.stdout.close()
+        process.stderr.close()
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(
+            process.returncode, command, output=output['stdout'], stderr=output['stderr'])
+
+    return subprocess.CompletedProcess(command, process.returncode, output['stdout'], output['stderr'])
 
 
 def current_commit():
@@ -139,14 +236,16 @@ def autoscale(im, percentile=None, minn=None, maxx=None, gamma=None, dtype=None)
     im = im.astype(float)
 
     # default to min/max
-    if percentile is None:
-        percentile = 100
-    pmin, pmax = np.percentile(im[:], [100 - percentile, percentile])
+    # (the percentiles are only calculated if minn or maxx is missing)
+    if minn is None or maxx is None:
+        if percentile is None:
+            percentile = 100
+        pmin, pmax = np.percentile(im[:], [100 - percentile, percentile])
 
-    if minn is None:
-        minn = pmin
-    if maxx is None:
-        maxx = pmax
+        if minn is None:
+            minn = pmin
+        if maxx is None:
+            maxx = pmax
 
     im -= minn
     im /= (maxx - minn)
@@ -160,4 +259,58 @@ def autoscale(im, percentile=None, minn=None, maxx=None, gamma=None, dtype=None)
         im *= max_vals[dtype]
         im = im.astype(dtype)
 
-    return im
\ No newline at end of file
+    return im
+
+
+def band_histogram(src, band):
+    '''
+    Calculate the exact histogram of a band of an 8- or 16-bit integer dataset,
+    reading the band window-by-window
+
+    src : an open rasterio dataset
+
+    Returns (values, counts), where values are the distinct values in the band, in ascending order
+    '''
+
+    dtype = np.dtype(src.dtypes[band - 1])
+    if not np.issubdtype(dtype, np.integer) or dtype.itemsize > 2:
+        raise ValueError('Exact histograms require 8- or 16-bit integer data')
+
+    offset = int(np.iinfo(dtype).min)
+    counts = np.zeros(int(np.iinfo(dtype).max) - offset + 1, dtype='int64')
+    for window in windows.block_windows(src.width, src.height):
+        im = src.read(band, window=window).astype('int64') - offset
+        counts += np.bincount(im.ravel(), minlength=len(counts))
+
+    values = np.arange(len(counts)) + offset
+    nonzero = counts > 0
+    return values[nonzero], counts[nonzero]
+
+
+def histogram_percentiles(values, counts, percentiles):
+    '''
+    Calculate percentiles from a histogram of exact values
+
+    This is equivalent to calling `np.percentile` (with its default linear interpolation)
+    on the data from which the histogram was calculated
+
+    values : the distinct values, in ascending order
+    counts : the number of occurrences of each value
+    percentiles : a list of percentiles between 0 and 100
+    '''
+
+    cumulative_counts = np.cumsum(counts)
+    num_values = cumulative_counts[-1]
+
+    def _value(rank):
+        return values[np.searchsorted(cumulative_counts, rank, side='right')]
+
+    results = []
+    for percentile in percentiles:
+        position = percentile/100*(num_values - 1)
+        lower = int(np.floor(position))
+        upper = min(lower + 1, num_values - 1)
+        results.append(_value(lower) + (position - lower)*(_value(upper) - _value(lower)))
+
+    return results
+
@@ -0,0 +1,175 @@
+'''
+Reading vector features (from vector files or GeoJSON) for rasterization and masking
+
+Features are streamed from vector files with fiona (which is imported only when it is needed),
+filtered by their attributes and by a bounding box as they are read, and reprojected to the CRS
+of the target raster; only the features that pass the filters are kept in memory.
+
+A BoundsIndex is a minimal spatial index over the bounding boxes of the features,
+used to select the features that intersect each window of a raster.
+'''
+
+import numpy as np
+
+from rasterio import features
+from rasterio import warp
+from rasterio.crs import CRS
+
+
+# the CRS of GeoJSON geometries that are given directly (rather than read from a file)
+GEOJSON_CRS = 'EPSG:4326'
+
+
+def _matches(properties, where):
+    '''
+    Whether a feature's properties match an attribute filter
+
+    where : a dict of {property name: value or list of values}
+    '''
+    for name, values in where.items():
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+        if properties.get(name) not in values:
+            return False
+    return True
+
+
+def _as_features(geojson):
+    '''
+    A list of GeoJSON features from a FeatureCollection, a single feature or geometry,
+    or a list of features or geometries
+    '''
+
+    if isinstance(geojson, dict):
+        if geojson.get('type') == 'FeatureCollection':
+            return list(geojson['features'])
+        geojson = [geojson]
+
+    return [
+        item if item.get('type') == 'Feature' else {'type': 'Feature', 'geometry': item, 'properties': {}}
+        for item in geojson]
+
+
+def read_features(vectors, dst_crs, bounds=None, where=None, crs=None):
+    '''
+    Read the features that match an attribute filter and intersect bounds,
+    with their geometries reprojected to a destination CRS
+
+    vectors : the path to a vector file (any format that fiona can read, e.g., a shapefile),
+        or GeoJSON (a FeatureCollection, or a feature or geometry, or a list of features or geometries)
+    dst_crs : the CRS of the target raster
+    bounds : optional (left, bottom, right, top) bounds in dst_crs; features whose bounding boxes
+        do not intersect them are skipped (for vector files, by fiona, before the features are parsed)
+    where : an optional attribute filter (a dict of {property name: value or list of values})
+    crs : the CRS of GeoJSON geometries (defaults to EPSG:4326, per the GeoJSON spec)
+
+    Returns a list of GeoJSON-like features whose geometries are in dst_crs
+    '''
+
+    dst_crs = CRS.from_user_input(dst_crs)
+
+    if isinstance(vectors, str):
+        try:
+            import fiona
+        except ImportError:
+            raise ImportError('fiona is required to read vector files')
+
+        with fiona.open(vectors, 'r') as collection:
+            src_crs = CRS.from_user_input(collection.crs_wkt or GEOJSON_CRS)
+
+            # the spatial prefilter (applied by OGR, using the file's spatial index if it has one)
+            if bounds is not None:
+                collection_ = collection.filter(bbox=warp.transform_bounds(dst_crs, src_crs, *bounds))
+            else:
+                collection_ = collection
+
+            selected = []
+            for feature in collection_:
+                properties = dict(feature['properties'])
+                if where and not _matches(properties, where):
+                    continue
+                geometry = feature['geometry']
+                if geometry is None:
+                    continue
+                selected.append({'type': 'Feature', 'geometry': dict(geometry), 'properties': properties})
+    else:
+        src_crs = CRS.from_user_input(crs or GEOJSON_CRS)
+        selected = [
+            feature for feature in _as_features(vectors)
+            if feature.get('geometry') and not (where and not _matches(feature.get('properties') or {}, where))]
+
+    if src_crs != dst_crs:
+        selected = [
+            dict(feature, geometry=warp.transform_geom(src_crs, dst_crs, feature['geometry']))
+            for feature in selected]
+
+    # filter GeoJSON geometries (and the features from files whose bounding boxes were only approximate)
+    if bounds is not None and selected:
+        index = BoundsIndex([feature['geometry'] for feature in selected])
+        selected = [selected[ind] for ind in index.query(bounds)]
+
+    return selected
+
+
+class BoundsIndex(object):
+    '''
+    A spatial index of the bounding boxes of a list of geometries
+
+    The bounding boxes are stored in a single (n, 4) array, so a query is a vectorized comparison
+    (this is all that is required to select the features that intersect each window of a raster)
+    '''
+
+    def __init__(self, geometries):
+        self.bounds = np.array([features.bounds(geometry) for geometry in geometries], dtype='float64')
+        if not len(self.bounds):
+            self.bounds = np.zeros((0, 4))
+
+
+    def query(self, bounds):
+        '''
+        The indices of the geometries whose bounding boxes intersect (left, bottom, right, top) bounds
+        '''
+        left, bottom, right, top = bounds
+        hits = (
+            (self.bounds[:, 0] <= right) & (self.bounds[:, 2] >= left) &
+            (self.bounds[:, 1] <= top) & (self.bounds[:, 3] >= bottom))
+        return np.flatnonzero(hits)
+
+
+    def total_bounds(self, indices=None):
+        '''
+        The union of the bounding boxes of the geometries (or of a subset of them)
+        '''
+        bounds = self.bounds if indices is None else self.bounds[indices]
+        return (
+            bounds[:, 0].min(), bounds[:, 1].min(), bounds[:, 2].max(), bounds[:, 3].max())
+
+
+def window_bounds(window, transform):
+    '''
+    The (left, bottom, right, top) bounds of a window of a raster
+    '''
+    left, top = transform*(window.col_off, window.row_off)
+    right, bottom = transform*(window.col_off + window.width, window.row_off + window.height)
+    return min(left, right), min(bottom, top), max(left, right), max(bottom, top)
+
+
+def dilate(im, width):
+    '''
+    Dilate an image with a square structuring element of a given width in pixels
+    (a running maximum over each axis, which is equivalent to a grayscale dilation)
+    '''
+
+    if width is None or width <= 1:
+        return im
+
+    before = (width - 1)//2
+    after = width - 1 - before
+    result = im
+    for axis in (0, 1):
+        padded = np.pad(result, [(before, after) if ax == axis else (0, 0) for ax in (0, 1)], mode='constant')
+        length = result.shape[axis]
+        result = np.take(padded, np.arange(length), axis=axis)
+        for offset in range(1, width):
+            result = np.maximum(result, np.take(padded, np.arange(offset, offset + length), axis=axis))
+    return result
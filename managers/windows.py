@@ -0,0 +1,134 @@
+import os
+import threading
+import collections
+import concurrent.futures
+
+from rasterio.windows import Window
+
+from . import raster_io
+
+
+# the number of windows per worker thread that map_windows keeps in flight (being processed,
+# or processed but not yet consumed), so that the memory used by windowed operations is bounded
+IN_FLIGHT_PER_WORKER = 2
+
+# default edge length, in pixels, of the square blocks used by windowed operations
+# (must be a multiple of 16 to be a valid GeoTIFF block size)
+BLOCK_SIZE = 512
+
+
+def block_windows(width, height, block_size=None):
+    '''
+    Tile a raster of the given shape into square windows, in row-major order
+    (windows on the right and bottom edges are clipped to the raster)
+    '''
+
+    if block_size is None:
+        block_size = BLOCK_SIZE
+
+    for row_off in range(0, height, block_size):
+        for col_off in range(0, width, block_size):
+            yield Window(
+                col_off,
+                row_off,
+                min(block_size, width - col_off),
+                min(block_size, height - row_off))
+
+
+def tiled_profile(profile, block_size=None):
+    '''
+    Modify a rasterio profile so that it describes a tiled, pixel-interleaved GeoTIFF
+    whose tiles match the windows generated by `block_windows`
+    '''
+
+    if block_size is None:
+        block_size = BLOCK_SIZE
+
+    profile = dict(profile)
+    profile.update({
+        'driver': 'GTiff',
+        'tiled': True,
+        'blockxsize': block_size,
+        'blockysize': block_size,
+        'interleave': 'pixel',
+    })
+    return profile
+
+
+def map_windows(func, windows, max_workers=None):
+    '''
+    Apply a function to each of a sequence of windows (or of tasks that include windows)
+    in a pool of worker threads, yielding the results in the same order as the windows
+
+    Reading (with rasterio) and most numpy operations release the GIL,
+    so threads are enough to process windows in parallel
+
+    At most IN_FLIGHT_PER_WORKER windows per worker are in flight at once: a window is submitted
+    only when the result of an earlier window has been consumed, so results never pile up
+    behind a slow consumer (e.g., the thread that writes them), and the memory used is bounded
+    by the size of the windows rather than by the size of the raster
+    '''
+
+    if max_workers is None:
+        max_workers = min(32, (os.cpu_count() or 1) + 4)
+    max_in_flight = IN_FLIGHT_PER_WORKER*max_workers
+
+    windows = iter(windows)
+    pending = collections.deque()
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for window in windows:
+            pending.append(executor.submit(func, window))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # if the consumer stops early (or a window fails), the windows not yet started are cancelled
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+class ThreadLocalReaders(object):
+    '''
+    Datasets opened for reading (with raster_io.open) once per thread
+    (rasterio dataset objects cannot be shared between threads)
+
+    Usage:
+        with ThreadLocalReaders() as readers:
+            src = readers.get(filepath)
+    '''
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._opened = []
+
+
+    def get(self, path):
+
+        srcs = getattr(self._local, 'srcs', None)
+        if srcs is None:
+            srcs = self._local.srcs = {}
+
+        if path not in srcs:
+            srcs[path] = raster_io.open(path)
+            with self._lock:
+                self._opened.append(srcs[path])
+        return srcs[path]
+
+
+    def close(self):
+        with self._lock:
+            for src in self._opened:
+                src.close()
+            self._opened = []
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
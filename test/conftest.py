@@ -0,0 +1,120 @@
+'''
+Fixtures for the tests
+
+The tests use small synthetic Landsat 8 scenes (all eleven bands, with a pan band at twice the resolution)
+rather than the downsampled scenes in test/datasets, which lack the pan band and require a merge of every band,
+and small synthetic GOES scans (on the GOES-17 fixed grid)
+'''
+
+import os
+import sys
+import pytest
+import numpy as np
+import rasterio
+
+from rasterio.transform import Affine
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from managers import settings
+settings.RIO_ENV = dict(os.environ)
+
+from managers import managers
+from managers.resources import Resources
+
+
+SCENES = [
+    # name, (left, top) of the scene
+    ('LC08_L1TP_042034_20180907_20180912_01_T1', (300000, 4200000)),
+    ('LC08_L1TP_041034_20180916_20180928_01_T1', (302400, 4198800)),
+]
+
+# the shape and resolution of the multispectral bands
+SHAPE = (96, 112)
+RES = 30
+
+
+def write_scene(root, name, origin, seed, shape=SHAPE):
+    '''
+    Write a synthetic scene, with a border of nodata (zero) pixels, to root/name/<name>_B<band>.TIF
+    '''
+
+    rng = np.random.default_rng(seed)
+    path = os.path.join(root, name)
+    os.makedirs(path, exist_ok=True)
+
+    for band in range(1, 12):
+        scale = 2 if band == 8 else 1
+        height, width = shape[0]*scale, shape[1]*scale
+        im = rng.integers(5000, 30000, size=(height, width), dtype='uint16')
+        im[:4*scale, :] = 0
+        im[:, -6*scale:] = 0
+
+        profile = dict(
+            driver='GTiff', width=width, height=height, count=1, dtype='uint16', nodata=0,
+            crs='EPSG:32611', transform=Affine.translation(*origin)*Affine.scale(RES/scale, -RES/scale))
+        with rasterio.open(os.path.join(path, '%s_B%d.TIF' % (name, band)), 'w', **profile) as dst:
+            dst.write(im, 1)
+    return path
+
+
+# the GOES-17 fixed grid, the upper-left corner of the synthetic sector, and the resolution of the 1km bands
+GOES_CRS = '+proj=geos +h=35786023 +lon_0=-137 +sweep=x +ellps=GRS80 +units=m +no_defs'
+GOES_ORIGIN = (-1500000, 4000000)
+GOES_RES = 1000
+GOES_SHAPE = (40, 56)
+
+# the relative resolution of the bands of the synthetic scans
+GOES_BANDS = {1: 1, 2: .5, 3: 1, 4: 2}
+
+
+def write_goes_scan(root, minute, seed, bands=None, shape=GOES_SHAPE):
+    '''
+    Write a synthetic GOES scan (with the bands that have the resolutions in GOES_BANDS)
+    to root/<scan>/OR_ABI-L1b-RadC-M6C<band>_G17_s...nc.tif, with nodata (zero) pixels in one corner
+    '''
+
+    if bands is None:
+        bands = GOES_BANDS
+
+    rng = np.random.default_rng(seed)
+    timestamp = '2019243%02d%02d000' % (14, minute)
+    path = os.path.join(root, 's%s' % timestamp)
+    os.makedirs(path, exist_ok=True)
+
+    for band, rel_res in bands.items():
+        height, width = int(shape[0]/rel_res), int(shape[1]/rel_res)
+        rows, cols = np.mgrid[0:height, 0:width]*rel_res
+        im = (1000 + 500*np.sin(cols/7 + seed)*np.cos(rows/5) + rng.normal(0, 20, (height, width))).astype('uint16')
+        im[:int(4/rel_res), :int(6/rel_res)] = 0
+
+        filename = 'OR_ABI-L1b-RadC-M6C%02d_G17_s%s_e%s_c%s.nc.tif' % (band, timestamp, timestamp, timestamp)
+        profile = dict(
+            driver='GTiff', width=width, height=height, count=1, dtype='uint16', nodata=0, crs=GOES_CRS,
+            transform=Affine.translation(*GOES_ORIGIN)*Affine.scale(GOES_RES*rel_res, -GOES_RES*rel_res))
+        with rasterio.open(os.path.join(path, filename), 'w', **profile) as dst:
+            dst.write(im, 1)
+    return path
+
+
+@pytest.fixture(scope='session')
+def scene_paths(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp('landsat'))
+    return [write_scene(root, name, origin, seed) for seed, (name, origin) in enumerate(SCENES)]
+
+
+@pytest.fixture
+def project(tmp_path, scene_paths):
+    os.makedirs(managers.RasterProject._tmp_dir, exist_ok=True)
+    return managers.LandsatProject(
+        str(tmp_path / 'project'), dataset_paths=scene_paths, reset=True, resources=Resources(threads=2))
+
+
+@pytest.fixture
+def goes_project(tmp_path):
+    '''
+    A GOES project of three consecutive scans of the same sector
+    '''
+    paths = [write_goes_scan(str(tmp_path / 'goes'), minute, seed) for seed, minute in enumerate([1, 6, 11])]
+    return managers.GOESProject(
+        str(tmp_path / 'project'), dataset_paths=paths, reset=True, resources=Resources(threads=2))
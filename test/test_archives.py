@@ -0,0 +1,59 @@
+import os
+import tarfile
+import pytest
+
+from managers import managers
+from managers.resources import Resources
+
+from conftest import SCENES, write_scene
+
+
+@pytest.fixture
+def archive_project(tmp_path):
+    '''
+    A project whose raw scenes are gzipped archives
+    '''
+    archive_paths = []
+    for seed, (name, origin) in enumerate(SCENES):
+        scene_path = write_scene(str(tmp_path / 'scenes'), name, origin, seed)
+        archive_path = str(tmp_path / ('%s.tar.gz' % name))
+        with tarfile.open(archive_path, 'w:gz') as archive:
+            for filename in sorted(os.listdir(scene_path)):
+                archive.add(os.path.join(scene_path, filename), arcname=filename)
+        archive_paths.append(archive_path)
+
+    return managers.LandsatProject(
+        str(tmp_path / 'project'), dataset_paths=archive_paths, reset=True, resources=Resources(threads=2))
+
+
+def extracted_bands(dataset):
+    directory = os.path.join(os.path.dirname(dataset.path), '%s_extracted' % dataset.name)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(int(filename.split('_B')[1].split('.')[0]) for filename in os.listdir(directory))
+
+
+def test_merge_extracts_only_its_bands(archive_project):
+
+    project = archive_project
+    with pytest.raises(ValueError):
+        project.merge(project.raw_datasets, bands=[12])
+
+    project.merge(project.raw_datasets, bands=[4, 3, 2])
+
+    for dataset in project.raw_datasets:
+        assert extracted_bands(dataset) == [2, 3, 4]
+
+    # the root dataset, which has no band 1, is validated when the project is reloaded
+    project = managers.LandsatProject(project.project_root)
+    assert project._existing(project.operations[0].destination).extant_bands == [2, 3, 4]
+    assert project.operations[0].kwargs['bands'] == [4, 3, 2]
+
+
+def test_composite_extracts_only_its_bands(archive_project):
+
+    project = archive_project
+    project.composite(project.raw_datasets, bands=[5])
+
+    for dataset in project.raw_datasets:
+        assert extracted_bands(dataset) == [5]
@@ -0,0 +1,89 @@
+import numpy as np
+import rasterio
+
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+
+from managers import cache
+from managers import raster_io
+from managers import windows
+
+
+def _filepath(scene_paths):
+    return '%s/%s_B4.TIF' % (scene_paths[0], scene_paths[0].split('/')[-1])
+
+
+def test_reads_are_keyed_by_their_options(scene_paths):
+
+    filepath = _filepath(scene_paths)
+    block_cache = cache.BlockCache()
+    window = Window(0, 0, 64, 48)
+
+    reads = [
+        dict(),
+        dict(masked=True),
+        dict(out_shape=(1, 48, 64), masked=True),
+        dict(boundless=True, fill_value=0, window=Window(-8, -8, 64, 48)),
+    ]
+
+    with rasterio.open(filepath) as src:
+        expected = [src.read(**dict(dict(indexes=[1], window=window), **kwargs)) for kwargs in reads]
+
+    for _ in range(2):
+        with cache.CachedReader(rasterio.open(filepath), cache=block_cache) as src:
+            results = [src.read(**dict(dict(indexes=[1], window=window), **kwargs)) for kwargs in reads]
+
+        for kwargs, im, expected_im in zip(reads, results, expected):
+            assert type(im) is type(expected_im)
+            assert np.array_equal(im, expected_im)
+            if kwargs.get('masked'):
+                assert np.array_equal(np.ma.getmaskarray(im), np.ma.getmaskarray(expected_im))
+
+    assert block_cache.stats()['misses'] == len(reads)
+    assert block_cache.stats()['hits'] == len(reads)
+
+    # the arrays returned by misses and hits are not the cached arrays, so that callers can modify them
+    with cache.CachedReader(rasterio.open(filepath), cache=block_cache) as src:
+        im = src.read([1], window=Window(0, 0, 32, 32), masked=True)
+        im[:] = np.ma.masked
+        im = src.read([1], window=Window(0, 0, 32, 32), masked=True)
+        assert not np.ma.getmaskarray(im).all()
+        im[:] = np.ma.masked
+        assert not np.ma.getmaskarray(src.read([1], window=Window(0, 0, 32, 32), masked=True)).all()
+
+
+def test_large_and_resampled_reads_are_not_cached(scene_paths, monkeypatch):
+
+    filepath = _filepath(scene_paths)
+    block_cache = cache.BlockCache()
+    monkeypatch.setattr(windows, 'BLOCK_SIZE', 32)
+
+    reads = [
+        dict(),
+        dict(window=Window(0, 0, 64, 48)),
+        dict(window=Window(0, 0, 32, 32), out_shape=(1, 16, 16)),
+        dict(window=Window(0, 0, 32, 32), out_shape=(1, 32, 32), resampling=Resampling.bilinear),
+    ]
+
+    with rasterio.open(filepath) as src:
+        expected = [src.read(**dict(dict(indexes=[1]), **kwargs)) for kwargs in reads]
+
+    for _ in range(2):
+        with cache.CachedReader(rasterio.open(filepath), cache=block_cache) as src:
+            for kwargs, expected_im in zip(reads, expected):
+                assert np.array_equal(src.read(**dict(dict(indexes=[1]), **kwargs)), expected_im)
+
+    stats = block_cache.stats()
+    assert stats['hits'] == 0 and stats['misses'] == 0 and stats['entries'] == 0
+
+
+def test_merge_reads_are_cached(project):
+
+    # (the statistics of each new destination would be read once, uncached)
+    project.compute_stats = False
+    project.merge(project.raw_datasets, bands=[4, 3], log=False)
+    cache.block_cache.reset_stats()
+
+    project.merge(project.raw_datasets, bands=[4, 3], log=False)
+    stats = cache.stats()
+    assert stats['hits'] > 0 and stats['misses'] == 0
@@ -0,0 +1,93 @@
+import os
+import numpy as np
+import pytest
+import rasterio
+
+from managers import landsat
+from managers import managers
+from managers.resources import Resources
+
+from conftest import SCENES, write_scene
+
+
+SUN_ELEVATION = 52.5
+
+MTL = '''GROUP = L1_METADATA_FILE
+  GROUP = IMAGE_ATTRIBUTES
+    SUN_ELEVATION = %s
+  END_GROUP = IMAGE_ATTRIBUTES
+  GROUP = RADIOMETRIC_RESCALING
+%s
+  END_GROUP = RADIOMETRIC_RESCALING
+END_GROUP = L1_METADATA_FILE
+END
+'''
+
+
+def _coefficients(band):
+    return 2.0e-5*(1 + band/10), -0.1 + band/100
+
+
+@pytest.fixture
+def project(tmp_path):
+    name, origin = SCENES[0]
+    path = write_scene(str(tmp_path / 'landsat'), name, origin, seed=0)
+
+    # the thermal bands (10 and 11) have no reflectance coefficients
+    lines = []
+    for band in range(1, 10):
+        mult, add = _coefficients(band)
+        lines.append('    REFLECTANCE_MULT_BAND_%d = %r' % (band, mult))
+        lines.append('    REFLECTANCE_ADD_BAND_%d = %r' % (band, add))
+    with open(os.path.join(path, '%s_MTL.txt' % name), 'w') as file:
+        file.write(MTL % (SUN_ELEVATION, '\n'.join(lines)))
+
+    return managers.LandsatProject(
+        str(tmp_path / 'project'), dataset_paths=[path], reset=True, resources=Resources(threads=2))
+
+
+def _read(filepath):
+    with rasterio.open(filepath) as src:
+        return src.read(1), src.profile
+
+
+def test_read_mtl(project):
+
+    metadata = landsat.read_mtl(project.raw_datasets[0].mtl_filepath())
+    assert metadata['SUN_ELEVATION'] == SUN_ELEVATION
+    assert landsat.reflectance_coefficients(metadata, 4) == _coefficients(4)
+    assert landsat.reflectance_coefficients(metadata, 10) is None
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'uint16'])
+def test_calibrate(project, dtype):
+
+    scene = project.raw_datasets[0]
+    destination = project.calibrate(scene, bands=[4, 8, 10], dtype=dtype).destination
+
+    for band in [4, 8]:
+        dn, _ = _read(scene.filepath(band))
+        im, profile = _read(destination.filepath(band))
+        assert profile['dtype'] == dtype and profile['tiled']
+
+        mult, add = _coefficients(band)
+        expected = ((mult*dn.astype(float) + add)/np.sin(np.deg2rad(SUN_ELEVATION)))
+        expected[dn == 0] = 0
+        if dtype == 'uint16':
+            expected *= landsat.REFLECTANCE_SCALE
+            # (the reflectance is calculated in float32)
+            assert np.abs(im - expected).max() < .51
+            assert ((im == 0) == (dn == 0)).all()
+        else:
+            assert np.allclose(im, expected, rtol=1e-5)
+
+    # the thermal band is skipped
+    assert not os.path.exists(destination.filepath(10))
+
+
+def test_calibrate_requires_an_mtl_file(project):
+
+    scene = project.raw_datasets[0]
+    os.remove(scene.mtl_filepath())
+    with pytest.raises(FileNotFoundError):
+        project.calibrate(scene)
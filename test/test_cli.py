@@ -0,0 +1,36 @@
+import json
+
+from managers import cli
+
+
+def test_run_merge_with_one_source(project, scene_paths, capsys):
+
+    project.merge(project.raw_datasets)
+
+    argv = ['run', project.project_root, 'merge', '--source-type', 'landsat', '--source', scene_paths[0]]
+    assert cli.main(argv) == 0
+
+    assert cli.main(['ls', project.project_root]) == 0
+    lines = capsys.readouterr().out.strip().split('\n')
+    assert [line.split()[2] for line in lines[-2:]] == ['merge', 'merge']
+
+
+def test_run_failure_is_reported(project, capsys):
+
+    project.merge(project.raw_datasets)
+    project.stack(project.operations[0].destination, bands=[4, 3, 2])
+
+    # merge asserts that its sources are raw datasets, which the stack is not
+    argv = ['run', project.project_root, 'merge', '--source', '1']
+    assert cli.main(argv) == 1
+    assert capsys.readouterr().err.startswith('Error: run failed (AssertionError')
+
+
+def test_run_on_a_new_project(project, scene_paths, capsys):
+
+    argv = ['run', project.project_root, 'merge', '--source-type', 'landsat', '--source', scene_paths[0]]
+    assert cli.main(argv) == 0
+
+    assert cli.main(['ls', project.project_root]) == 0
+    lines = capsys.readouterr().out.strip().split('\n')
+    assert lines[-1].split()[2] == 'merge'
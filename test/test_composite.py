@@ -0,0 +1,55 @@
+import tracemalloc
+import numpy as np
+import pytest
+
+from managers import cache
+from managers import managers
+from managers import raster_io
+from managers.resources import Resources
+
+from conftest import SCENES, write_scene
+
+
+@pytest.fixture
+def large_project(tmp_path):
+    '''
+    A project of two overlapping scenes whose bands are 2 MB each
+    (statistics are not computed, and blocks are not cached, since only the memory used by composite is measured)
+    '''
+    max_size = cache.block_cache.max_size
+    cache.configure(0)
+    paths = [
+        write_scene(str(tmp_path / 'landsat'), name, origin, seed, shape=(1024, 1024))
+        for seed, (name, origin) in enumerate(SCENES)]
+    project = managers.LandsatProject(
+        str(tmp_path / 'project'), dataset_paths=paths, reset=True, resources=Resources(threads=2))
+    project.compute_stats = False
+    yield project
+    cache.configure(max_size)
+
+
+@pytest.mark.parametrize('method, max_memory', [('least_cloud', 1), ('median', 2)])
+def test_composite_memory_is_bounded(large_project, method, max_memory):
+
+    project = large_project
+    bands = [4, 3, 2]
+
+    tracemalloc.start()
+    project.composite(project.raw_datasets, bands=bands, method=method, max_memory=max_memory, log=False)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # the composite itself is 3 x 2 MB, and its sources are 6 x 2 MB
+    assert peak < 2*max_memory*2**20
+
+
+def test_composite_does_not_depend_on_block_size(project):
+
+    results = []
+    for max_memory in [.05, 100]:
+        operation = project.composite(project.raw_datasets, bands=[4, 3], max_memory=max_memory, log=False)
+        with raster_io.open(operation.destination.filepath(4)) as src:
+            results.append((src.profile['blockxsize'], src.read()))
+
+    assert results[0][0] < results[1][0]
+    assert np.array_equal(results[0][1], results[1][1])
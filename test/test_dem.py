@@ -0,0 +1,48 @@
+import os
+import shutil
+import numpy as np
+import rasterio
+
+from rasterio.transform import Affine
+
+from managers import managers
+from managers.resources import Resources
+
+
+def write_dem(path):
+    im = np.linspace(0, 1000, 64*64, dtype='float32').reshape(64, 64)
+    profile = dict(
+        driver='GTiff', width=64, height=64, count=1, dtype='float32', nodata=None,
+        crs='EPSG:32611', transform=Affine.translation(300000, 4200000)*Affine.scale(10, -10))
+    with rasterio.open(path, 'w', **profile) as dst:
+        dst.write(im, 1)
+
+
+def test_scratch_dirs(tmp_path, monkeypatch):
+    '''
+    Each operation writes its intermediates to a directory of its own, which is removed afterwards
+    '''
+
+    dem_path = str(tmp_path / 'dem.tif')
+    write_dem(dem_path)
+    project = managers.DEMProject(
+        str(tmp_path / 'project'), dataset_paths=[dem_path], reset=True, resources=Resources(threads=2))
+    project._tmp_dir = str(tmp_path / 'tmp')
+
+    # stand in for gdaldem, which writes its output from its input
+    scratch_paths = []
+    def run_command(command, verbose=True, step=None):
+        for path in command[2:-1]:
+            assert os.path.isfile(path)
+            scratch_paths.append(path)
+        shutil.copy(command[2], command[-1])
+    monkeypatch.setattr(project, '_run_command', run_command)
+
+    project.slope_shade(project.raw_datasets[0])
+    project.color_relief(project.raw_datasets[0], colormap=[
+        {'elevation': 0, 'color': (0, 0, 0)}, {'elevation': 3000, 'color': (255, 255, 255)}])
+
+    scratch_dirs = set(os.path.dirname(path) for path in scratch_paths if path != dem_path)
+    assert len(scratch_dirs) == 2
+    assert all(os.path.dirname(path) == project._tmp_dir for path in scratch_dirs)
+    assert os.listdir(project._tmp_dir) == []
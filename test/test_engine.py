@@ -0,0 +1,212 @@
+import os
+import sys
+import types
+import subprocess
+import functools
+import numpy as np
+import pytest
+import rasterio
+
+from managers import engine
+from managers import datasets
+from managers import kernels
+from managers import windows
+from managers import raster_io
+from managers import managers
+from managers import utils
+from managers.resources import Resources
+
+
+@pytest.fixture
+def rgb_path(tmp_path):
+    rng = np.random.default_rng(0)
+    im = rng.integers(0, 2**12, size=(3, 700, 900), dtype='uint16')
+    profile = windows.tiled_profile(dict(
+        driver='GTiff', width=900, height=700, count=3, dtype='uint16', nodata=None,
+        crs='EPSG:32611', transform=rasterio.transform.from_origin(0, 0, 30, 30)))
+    path = str(tmp_path / 'rgb.tif')
+    with rasterio.open(path, 'w', **profile) as dst:
+        dst.write(im)
+    return path
+
+
+def test_processes_match_threads(rgb_path, tmp_path):
+
+    threads = engine.ChunkedEngine(max_memory=2, max_workers=2, executor='threads')
+    processes = engine.ChunkedEngine(max_memory=2, max_workers=2, executor='processes')
+    assert len(threads._chunks([raster_io.open(rgb_path)], 0)) > 1
+
+    limits = [engine.percentile_limits(chunked, rgb_path, 98) for chunked in [threads, processes]]
+    assert limits[0] == limits[1]
+
+    with raster_io.open(rgb_path) as src:
+        profile = windows.tiled_profile(src.profile)
+    profile['dtype'] = 'uint8'
+
+    results = []
+    for chunked in [threads, processes]:
+        path = str(tmp_path / ('%s.tif' % chunked.executor))
+        chunked.map([rgb_path], functools.partial(kernels.scale, limits=limits[0], dtype='uint8'), path, profile)
+        with raster_io.open(path) as src:
+            results.append(src.read())
+    assert np.array_equal(results[0], results[1])
+
+    engine.shutdown()
+    assert not engine._process_pools
+    assert not [name for name in os.listdir('/dev/shm') if name.startswith('psm_')]
+
+
+
+def _box_filter(images, window):
+    '''
+    The 3x3 mean of the first band (of a chunk padded by a halo of one pixel)
+    '''
+    im = images[0][0]
+    result = np.zeros_like(im)
+    for row in [-1, 0, 1]:
+        for col in [-1, 0, 1]:
+            result[1:-1, 1:-1] += im[1 + row:im.shape[0] - 1 + row, 1 + col:im.shape[1] - 1 + col]/9
+    return result[np.newaxis, :, :]
+
+
+def test_chunk_size_fits_the_budget():
+
+    chunked = engine.ChunkedEngine(max_memory=1024, max_workers=4)
+    size = chunked.chunk_size(4)
+    assert size % windows.BLOCK_SIZE == 0
+    assert 4*4*chunked._copies_per_chunk*size**2*4 <= 1024*2**20
+    assert size > windows.BLOCK_SIZE
+
+    # the halo is within the budget too, and chunks are never smaller than a block
+    assert chunked.chunk_size(4, halo=2*windows.BLOCK_SIZE) < size
+    assert engine.ChunkedEngine(max_memory=1, max_workers=4).chunk_size(4) == windows.BLOCK_SIZE
+
+
+def test_map_with_halo_matches_whole_image(rgb_path, tmp_path):
+
+    chunked = engine.ChunkedEngine(max_memory=2, max_workers=2, executor='threads')
+    with raster_io.open(rgb_path) as src:
+        assert len(chunked._chunks([src], 1)) > 1
+        im = src.read(1).astype('float32')
+        profile = windows.tiled_profile(src.profile)
+    profile.update({'count': 1, 'dtype': 'float32'})
+
+    path = str(tmp_path / 'filtered.tif')
+    chunked.map([rgb_path], _box_filter, path, profile, halo=1)
+
+    # the edges of the grid are padded by repeating the edge pixels
+    expected = _box_filter([np.pad(im, 1, mode='edge')[np.newaxis, :, :]], None)[0, 1:-1, 1:-1]
+    with raster_io.open(path) as src:
+        assert np.allclose(src.read(1), expected, atol=1e-3)
+
+
+def test_reduce_and_percentile_limits_match_whole_image(rgb_path):
+
+    chunked = engine.ChunkedEngine(max_memory=2, max_workers=2, executor='threads')
+    with raster_io.open(rgb_path) as src:
+        im = src.read()
+
+    ranges = chunked.reduce([rgb_path], functools.partial(kernels.min_max, each_band=False))
+    assert len(ranges) > 1
+    assert min(result[0][0] for result in ranges) == im.min()
+    assert max(result[0][1] for result in ranges) == im.max()
+
+    # the limits of 16-bit data are exact
+    limits = engine.percentile_limits(chunked, rgb_path, 98)
+    for band, (minn, maxx) in zip(im, limits):
+        assert np.allclose([minn, maxx], np.percentile(band, [2, 98]))
+
+    limits, = engine.percentile_limits(chunked, rgb_path, 98, each_band=False)
+    assert np.allclose(limits, np.percentile(im, [2, 98]))
+
+
+
+def test_chunked_autogain_matches_whole_image(rgb_path, tmp_path, scene_paths):
+
+    # a memory budget in which the image is processed in several chunks
+    project = managers.LandsatProject(
+        str(tmp_path / 'project'), dataset_paths=scene_paths, reset=True,
+        resources=Resources(threads=2, memory=4))
+    assert len(project._engine()._chunks([raster_io.open(rgb_path)], 0, extra_bands=3)) > 1
+
+    source = datasets.new_dataset('tif', rgb_path, exists=True)
+    for each_band in [True, False]:
+        destination = project.autogain(source, percentile=98, each_band=each_band).destination
+
+        with raster_io.open(rgb_path) as src:
+            im = src.read()
+        if each_band:
+            expected = np.array([utils.autoscale(band, percentile=98) for band in im])
+        else:
+            expected = utils.autoscale(im, percentile=98)
+
+        with raster_io.open(destination.path) as dst:
+            assert np.abs(dst.read().astype(float) - expected*255).max() <= 1
+
+
+def test_process_pool_uses_no_fork():
+    pool = engine._process_pool(2)
+    assert pool._mp_context.get_start_method() in ['forkserver', 'spawn']
+    engine.shutdown()
+
+
+SCRIPT = '''
+import os
+import sys
+import types
+import subprocess
+import sys
+sys.path.insert(0, %(root)r)
+sys.path.insert(0, %(test_dir)r)
+
+from managers import engine
+from managers import datasets
+from managers import settings
+settings.RIO_ENV = dict(os.environ)
+settings.ENGINE_EXECUTOR = %(executor)r
+
+from managers import managers
+from managers.resources import Resources
+from conftest import SCENES, write_scene
+
+paths = [write_scene(%(tmp)r, name, origin, seed) for seed, (name, origin) in enumerate(SCENES)]
+project = managers.LandsatProject(
+    os.path.join(%(tmp)r, 'project'), dataset_paths=paths, reset=True, resources=Resources(threads=2))
+project.merge(project.raw_datasets)
+project.stack(project.operations[0].destination, bands=[4, 3, 2])
+assert not engine._process_pools
+print('done')
+'''
+
+
+@pytest.mark.parametrize('executor', ['threads', 'auto'])
+def test_unguarded_script(tmp_path, executor):
+    '''
+    A script without an `if __name__ == '__main__':` guard runs operations (which compute statistics
+    with the engine) without starting worker processes, which would re-run the script
+    '''
+
+    test_dir = os.path.dirname(__file__)
+    script = tmp_path / 'script.py'
+    script.write_text(SCRIPT % dict(
+        root=os.path.dirname(test_dir), test_dir=test_dir, tmp=str(tmp_path), executor=executor))
+
+    result = subprocess.run([sys.executable, str(script)], capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().endswith('done')
+
+
+def test_auto_executor_in_package_main(monkeypatch):
+
+    chunked = engine.ChunkedEngine(max_workers=2, executor='auto')
+    func = functools.partial(kernels.min_max, each_band=True)
+
+    main = types.ModuleType('__main__')
+    main.__file__ = '/tmp/script.py'
+    monkeypatch.setitem(sys.modules, '__main__', main)
+    assert not chunked._use_processes(func)
+
+    main.__spec__ = types.SimpleNamespace(name='managers.__main__')
+    assert chunked._use_processes(func)
+
+    assert not engine.ChunkedEngine(max_workers=2)._use_processes(func)
@@ -0,0 +1,118 @@
+import os
+import json
+import numpy as np
+import pytest
+import rasterio
+import rasterio.warp
+
+from PIL import Image
+from rasterio.enums import Resampling
+
+from managers import datasets
+from managers import managers
+from managers import raster_io
+from managers.resources import Resources
+
+from conftest import write_goes_scan
+
+
+# visible, near-IR and IR bands at each of the three native resolutions
+BANDS = {1: 1, 2: .5, 5: 1, 7: 2, 13: 2}
+
+
+@pytest.fixture
+def scan_path(tmp_path):
+    return write_goes_scan(str(tmp_path / 'goes'), 1, 0, bands=BANDS)
+
+
+def test_scan_bands(scan_path):
+
+    scan = datasets.GOESScene(scan_path, is_raw=True, exists=True)
+    assert scan.extant_bands == [1, 2, 5, 7, 13]
+    assert os.path.basename(scan.filepath(13)).startswith('OR_ABI-L1b-RadC-M6C13_G17_')
+    assert {band: scan.rel_band_res.get(band, 1) for band in BANDS} == BANDS
+    assert [band for band in range(1, 17) if band not in scan.rel_band_res] == [1, 3, 5]
+
+
+def test_warped_bands_are_found(tmp_path, scan_path):
+
+    project = managers.GOESProject(
+        str(tmp_path / 'project'), dataset_paths=[scan_path], reset=True, resources=Resources(threads=2))
+    destination = project.warp(project.raw_datasets[0], crs='EPSG:3857', res=1500).destination
+
+    # the bands of a warped dataset keep their relative resolutions
+    warped = datasets.GOESScene(destination.path, exists=True)
+    assert warped.extant_bands == [1, 2, 5, 7, 13]
+    for band in BANDS:
+        with rasterio.open(warped.filepath(band)) as src:
+            assert np.isclose(src.res[0], 1500*BANDS[band])
+
+
+def test_harmonize_bands(tmp_path, scan_path):
+    '''
+    Harmonized bands of each resolution match bands warped separately onto the same grid
+    '''
+
+    project = managers.GOESProject(
+        str(tmp_path / 'project'), dataset_paths=[scan_path], reset=True, resources=Resources(threads=2))
+    scan = project.raw_datasets[0]
+    bands = [13, 2, 1]
+    destination = project.harmonize(scan, bands=bands, crs='EPSG:3857', res=1000).destination
+
+    with rasterio.open(destination.path) as dst:
+        assert dst.count == len(bands)
+        assert dst.profile['interleave'] == 'pixel'
+        im = dst.read().astype(float)
+        profile = dst.profile
+
+    for ind, band in enumerate(bands):
+        with rasterio.open(scan.filepath(band)) as src:
+            expected = np.zeros(im.shape[1:], dtype='float32')
+            rasterio.warp.reproject(
+                src.read(1), expected, src_transform=src.transform, src_crs=src.crs, src_nodata=0,
+                dst_transform=profile['transform'], dst_crs=profile['crs'], dst_nodata=0,
+                resampling=Resampling.bilinear)
+
+        valid = (im[ind] > 0) & (expected > 0)
+        assert valid.sum() > .5*valid.size
+        assert np.median(np.abs(im[ind] - expected)[valid]) < 5
+
+
+def test_animate_series(goes_project):
+    '''
+    Warp and harmonize a series of scans and animate them (in worker threads, after other operations
+    have started threads of their own)
+    '''
+
+    project = goes_project
+    scans = project.raw_datasets
+
+    for scan in scans[:2]:
+        project.warp(scan, crs='EPSG:3857', res=2000)
+
+    harmonized = [
+        project.harmonize(scan, bands=[2, 3, 1], crs='EPSG:3857', res=1000).destination for scan in scans]
+
+    future = project.submit(
+        'animate', harmonized, bands=[1, 2, 3], percentile=99, gamma=.8, animation='gif', max_workers=2)
+    frames = future.result(timeout=120).destination
+
+    frame_filepaths = sorted(filename for filename in os.listdir(frames.path) if filename.endswith('.png'))
+    assert len(frame_filepaths) == len(scans)
+
+    with Image.open(frames.animation_path('gif')) as gif:
+        assert gif.n_frames == len(scans)
+
+    # frames of different scans differ, and are in the order of the scans
+    with raster_io.open(harmonized[1].path) as src:
+        shape = src.shape
+    ims = []
+    for filename in frame_filepaths:
+        with Image.open(os.path.join(frames.path, filename)) as frame:
+            ims.append(np.array(frame))
+        assert ims[-1].shape == shape + (3,)
+    assert not np.array_equal(ims[0], ims[1])
+
+    with open(frames.manifest_path, 'r') as file:
+        assert [frame['source'] for frame in json.load(file)['frames']] == \
+            [dataset.path for dataset in harmonized]
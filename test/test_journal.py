@@ -0,0 +1,83 @@
+import os
+import json
+
+from managers import journal
+from managers import managers
+
+
+def _operations(project):
+    return [operation.serialize() for operation in project.operations]
+
+
+def _snapshot_operations(project):
+    with open(project.props_path, 'r') as file:
+        return json.load(file)['operations']
+
+
+def test_reload_replays_the_journal(project):
+
+    project.merge(project.raw_datasets)
+    project.stack(project.operations[0].destination, bands=[4, 3, 2])
+    project.update(0, res=60)
+    expected = _operations(project)
+
+    # the operations are in the journal, not in the snapshot
+    assert _snapshot_operations(project) == []
+    assert [entry['index'] for entry in project.journal.entries()] == [0, 1, 0, 1]
+
+    project = managers.LandsatProject(project.project_root)
+    assert _operations(project) == expected
+
+
+def test_incomplete_entry_is_ignored(project):
+
+    project.merge(project.raw_datasets)
+    expected = _operations(project)
+
+    # an entry that was being written during a crash
+    with open(project.journal.path, 'a') as file:
+        file.write('{"index": 1, "operation": {"method"')
+
+    project = managers.LandsatProject(project.project_root)
+    assert _operations(project) == expected
+
+    # new entries are appended after the last complete entry
+    project.stack(project.operations[0].destination, bands=[4, 3, 2])
+    expected = _operations(project)
+    project = managers.LandsatProject(project.project_root)
+    assert _operations(project) == expected
+
+
+def test_compaction(project):
+
+    project._journal_compaction_interval = 2
+    project.merge(project.raw_datasets)
+    project.stack(project.operations[0].destination, bands=[4, 3, 2])
+    expected = _operations(project)
+
+    # the journal was compacted into the snapshot
+    assert not os.path.exists(project.journal.path)
+    assert _snapshot_operations(project) == expected
+
+    project.stack(project.operations[0].destination, bands=[5, 4, 3])
+    expected = _operations(project)
+    project = managers.LandsatProject(project.project_root)
+    assert _operations(project) == expected
+
+
+def test_replay_is_idempotent(tmp_path):
+
+    log = journal.Journal(str(tmp_path / 'operations.jsonl'))
+    for index, name in [(0, 'a'), (1, 'b'), (0, 'c')]:
+        log.append(index, {'name': name})
+
+    operations = log.replay([])
+    assert operations == [{'name': 'c'}, {'name': 'b'}]
+    assert log.replay(operations) == operations
+
+
+def test_reopen_new_project(project):
+
+    # a project is saved on creation, before its first operation
+    reopened = managers.LandsatProject(project.project_root)
+    assert reopened.operations == []
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+import rasterio
+import rasterio.merge
+import rasterio.warp
+
+from managers import utils
+from managers import raster_io
+
+
+@pytest.mark.parametrize('res', [None, 60, 45])
+def test_merge_matches_rasterio_merge(project, res):
+
+    project.compute_stats = False
+    operation = project.merge(project.raw_datasets, res=res, log=False)
+
+    for band in [4, 8]:
+        filepaths = [dataset.filepath(band) for dataset in project.raw_datasets]
+
+        # the pan band is merged at half the resolution
+        band_res = res/2 if res and band == 8 else res
+        expected, expected_transform = rasterio.merge.merge(filepaths, res=band_res)
+
+        with raster_io.open(operation.destination.filepath(band)) as src:
+            assert src.transform.almost_equals(expected_transform)
+            assert np.array_equal(src.read(), expected)
+
+
+def test_merge_with_bounds_matches_rasterio_merge(project):
+
+    project.compute_stats = False
+
+    # lat/lon bounds within the union of the scenes
+    src_bounds = (300500, 4196500, 304500, 4199500)
+    bounds = list(rasterio.warp.transform_bounds('EPSG:32611', 'EPSG:4326', *src_bounds))
+    operation = project.merge(project.raw_datasets, res=60, bounds=bounds, log=False)
+
+    filepaths = [dataset.filepath(4) for dataset in project.raw_datasets]
+    expected, expected_transform = rasterio.merge.merge(
+        filepaths, res=60, bounds=utils.transform(bounds, filepaths[0]))
+
+    with raster_io.open(operation.destination.filepath(4)) as src:
+        assert src.transform.almost_equals(expected_transform)
+        assert np.array_equal(src.read(), expected)
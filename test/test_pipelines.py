@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from managers import pipelines
+
+
+IMAGES = [np.arange(1, 13, dtype='float32').reshape(3, 2, 2)]
+
+
+@pytest.mark.parametrize('expression, expected', [
+    ('(b2 - b1)/(b2 + b1)', lambda b1, b2, b3: (b2 - b1)/(b2 + b1)),
+    ('np.where((b1 > 2) & (b3 < 12), np.sqrt(b2), -1)', lambda b1, b2, b3: np.where((b1 > 2) & (b3 < 12), np.sqrt(b2), -1)),
+    ('0 < b1 <= 2', lambda b1, b2, b3: (0 < b1) & (b1 <= 2)),
+    ('maximum(b1, 3)**2', lambda b1, b2, b3: np.maximum(b1, 3)**2),
+])
+def test_band_math(expression, expected):
+    result = pipelines.band_math([im.copy() for im in IMAGES], expression=expression)
+    assert np.allclose(result[0][0], expected(*IMAGES[0]))
+
+
+@pytest.mark.parametrize('expression', [
+    "().__class__.__base__.__subclasses__()",
+    "__import__('os').system('true')",
+    "np.load('file.npy')",
+    "b1.__class__",
+    "np.sqrt.__self__",
+    "[b1 for b1 in b2]",
+    "b1 if b2 else b3",
+    "lambda: b1",
+    "np.where(b1, b2, out=b3)",
+    "'string'",
+    "x + 1",
+])
+def test_band_math_rejects_unsafe_expressions(expression):
+    with pytest.raises(ValueError):
+        pipelines.Pipeline([{'method': 'band_math', 'expression': expression}])
+    with pytest.raises(ValueError):
+        pipelines.band_math([im.copy() for im in IMAGES], expression=expression)
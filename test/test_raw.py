@@ -0,0 +1,95 @@
+import os
+import numpy as np
+import pytest
+import rasterio
+
+from rasterio.transform import Affine
+from rasterio.windows import Window
+
+from managers import managers
+from managers import raster_io
+from managers.resources import Resources
+
+
+def test_raw_dataset_round_trip(tmp_path):
+
+    path = str(tmp_path / 'array.npy')
+    profile = dict(
+        driver='raw', dtype='uint16', nodata=0, width=40, height=30, count=2,
+        crs='EPSG:32611', transform=Affine.translation(300000, 4200000)*Affine.scale(30, -30))
+    im = np.arange(2*30*40, dtype='uint16').reshape(2, 30, 40)
+
+    with raster_io.open(path, 'w', **profile) as dst:
+        dst.write(im[0], 1)
+        dst.write(im[1:], [2])
+
+    window = Window(5, 10, 20, 15)
+    with raster_io.open(path) as src:
+        assert src.count == 2 and src.shape == (30, 40)
+        assert src.crs == rasterio.crs.CRS.from_epsg(32611)
+        assert src.transform == profile['transform'] and src.nodata == 0
+        assert np.array_equal(src.read(), im)
+        assert np.array_equal(src.read([2, 1], window=window), im[::-1, 10:25, 5:25])
+
+        # reads of one band or of all bands are views of the memory-mapped file
+        band = src.read(1, window=window)
+        assert np.array_equal(band, im[0, 10:25, 5:25])
+        assert isinstance(band.base, np.memmap) or isinstance(band, np.memmap)
+
+        with pytest.raises(ValueError):
+            src.read(1, masked=True)
+
+
+@pytest.fixture
+def projects(tmp_path, scene_paths):
+    '''
+    A project whose intermediate datasets are raw arrays and one whose intermediate datasets are GeoTIFFs
+    '''
+    return [
+        managers.LandsatProject(
+            str(tmp_path / intermediate_format), dataset_paths=scene_paths, reset=True,
+            resources=Resources(threads=2), intermediate_format=intermediate_format)
+        for intermediate_format in ['raw', 'tif']]
+
+
+def test_raw_intermediates_match_tifs(projects):
+
+    results = []
+    for project in projects:
+        merged = project.merge(project.raw_datasets).destination
+        stack = project.stack(merged, bands=[4, 3, 2]).destination
+        autogained = project.autogain(stack, percentile=99).destination
+        exported = project.export(autogained).destination
+        results.append((stack, autogained, exported))
+
+    (raw_stack, raw_autogained, raw_exported), (tif_stack, tif_autogained, tif_exported) = results
+    assert raw_stack.type == 'raw' and raw_autogained.type == 'raw'
+    assert raw_autogained.path.endswith('.npy')
+    assert tif_autogained.type == 'tif' and raw_exported.type == 'tif'
+
+    for raw, tif in [(raw_stack, tif_stack), (raw_autogained, tif_autogained)]:
+        with raster_io.open(raw.path) as src, raster_io.open(tif.path) as tif_src:
+            assert np.array_equal(src.read(), tif_src.read())
+            assert src.transform == tif_src.transform and src.crs == tif_src.crs
+
+    # the export of a raw dataset is a tiled GeoTIFF
+    with rasterio.open(raw_exported.path) as src, rasterio.open(tif_autogained.path) as tif_src:
+        assert src.profile['tiled'] and src.count == 3
+        assert np.array_equal(src.read(), tif_src.read())
+        assert src.transform == tif_src.transform and src.crs == tif_src.crs
+
+
+def test_reload_raw_project(projects):
+
+    project = projects[0]
+    merged = project.merge(project.raw_datasets).destination
+    project.stack(merged, bands=[4, 3, 2])
+
+    # (the intermediate format applies to new datasets, so it is not saved with the project)
+    reloaded = managers.LandsatProject(project.project_root, intermediate_format='raw')
+    stack = reloaded.operations[1].destination
+    assert stack.type == 'raw' and os.path.isfile(stack.path)
+
+    autogained = reloaded.autogain(stack, percentile=99).destination
+    with raster_io.open(autogained.path) as src:
+        assert src.count == 3 and src.dtypes[0] == 'uint8'
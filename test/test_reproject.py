@@ -0,0 +1,102 @@
+import os
+import numpy as np
+import pytest
+import rasterio
+import rasterio.warp
+
+from rasterio.enums import Resampling
+from rasterio.transform import Affine
+from rasterio.windows import Window
+
+from managers import reproject
+
+from conftest import GOES_CRS, GOES_ORIGIN, GOES_RES
+
+
+SRC_TRANSFORM = Affine.translation(*GOES_ORIGIN)*Affine.scale(GOES_RES, -GOES_RES)
+SRC_SHAPE = (40, 56)
+
+
+def _grid():
+    return reproject.destination_grid(GOES_CRS, SRC_TRANSFORM, SRC_SHAPE, 'EPSG:3857', res=1500)
+
+
+def test_pixel_map_interpolates_bilinearly():
+    '''
+    Bilinear interpolation reproduces a source image that is linear in the source pixel coordinates
+    '''
+
+    dst_transform, dst_shape = _grid()
+    window = Window(0, 0, dst_shape[1], dst_shape[0])
+    xs, ys = reproject.project_pixels('EPSG:3857', dst_transform, window, GOES_CRS)
+    pixel_map = reproject.PixelMap.from_coords(xs, ys, SRC_TRANSFORM, SRC_SHAPE)
+
+    rows, cols = np.mgrid[0:SRC_SHAPE[0], 0:SRC_SHAPE[1]]
+    im = (3*rows + 2*cols + 100).astype('float32')
+    result = pixel_map.apply(im, dst_nodata=-1)
+
+    src_cols, src_rows = ~SRC_TRANSFORM * (np.asarray(xs), np.asarray(ys))
+    expected = 3*(src_rows - .5) + 2*(src_cols - .5) + 100
+
+    valid = pixel_map.rows >= 0
+    assert valid.sum() > .5*valid.size
+    assert np.allclose(result[valid], expected[valid], atol=1e-3)
+    assert (result[~valid] == -1).all()
+
+
+def test_goes_warp_matches_rasterio(goes_project):
+
+    project = goes_project
+    scan = project.raw_datasets[0]
+    destination = project.warp(scan, crs='EPSG:3857', res=1500).destination
+
+    with rasterio.open(destination.filepath(1)) as dst:
+        im = dst.read(1).astype(float)
+        profile = dst.profile
+
+    with rasterio.open(scan.filepath(1)) as src:
+        expected = np.zeros(im.shape, dtype='float32')
+        rasterio.warp.reproject(
+            src.read(1), expected, src_transform=src.transform, src_crs=src.crs, src_nodata=0,
+            dst_transform=profile['transform'], dst_crs=profile['crs'], dst_nodata=0,
+            resampling=Resampling.bilinear)
+
+    # GDAL's warper approximates the coordinate transformation, so only compare pixels away from the edges
+    valid = (im > 0) & (expected > 0)
+    assert valid.sum() > .5*valid.size
+    assert np.median(np.abs(im - expected)[valid]) < 5
+
+
+def test_pixel_maps_are_reused_across_scans(goes_project, monkeypatch):
+
+    project = goes_project
+    first, second = project.raw_datasets[:2]
+    project.warp(first, crs='EPSG:3857', res=1500)
+
+    cache_dir = os.path.join(project.project_root, project._pixel_map_dir)
+    keys = sorted(os.listdir(cache_dir))
+
+    # the 1km bands share one map, and the 0.5 and 2km bands have their own
+    assert len(keys) == 3
+
+    def _build(*args, **kwargs):
+        raise AssertionError('a cached pixel map was rebuilt')
+
+    monkeypatch.setattr(reproject.PixelMapCache, '_build', _build)
+    project.warp(second, crs='EPSG:3857', res=1500)
+    assert sorted(os.listdir(cache_dir)) == keys
+
+
+def test_failed_rename_removes_the_temporary_directory(tmp_path):
+
+    cache = reproject.PixelMapCache(str(tmp_path / 'cache'))
+    dst_transform, dst_shape = _grid()
+    key = cache.key(GOES_CRS, SRC_TRANSFORM, SRC_SHAPE, 'EPSG:3857', dst_transform, dst_shape)
+
+    # another process cached the same map first
+    cache._build({key: (SRC_TRANSFORM, SRC_SHAPE)}, GOES_CRS, 'EPSG:3857', dst_transform, dst_shape)
+    cache._build({key: (SRC_TRANSFORM, SRC_SHAPE)}, GOES_CRS, 'EPSG:3857', dst_transform, dst_shape)
+
+    assert os.listdir(cache.cache_dir) == [key]
+    pixel_map, = cache.get(GOES_CRS, [(SRC_TRANSFORM, SRC_SHAPE)], 'EPSG:3857', dst_transform, dst_shape)
+    assert pixel_map.shape == tuple(dst_shape)
@@ -0,0 +1,68 @@
+import sys
+import time
+import threading
+import pytest
+import rasterio
+
+from managers import managers
+from managers.resources import Resources
+
+
+def test_budgets():
+
+    resources = Resources(threads=3, memory=1000, max_operations=2)
+    assert resources.budgets() == {'threads': 3, 'memory': 1000, 'gdal_cache': 250, 'warp_memory': 250}
+    assert resources.engine_memory == 500
+
+    # by default, the CPUs are divided between the operations
+    assert Resources(max_operations=2).threads >= 1
+    with pytest.raises(ValueError):
+        Resources(max_operations=0)
+
+
+def test_budgets_are_passed_to_both_backends(project):
+
+    project.resources = Resources(threads=3, memory=400)
+
+    # CLI commands
+    command = [sys.executable, '-c', 'import os; print(os.environ["GDAL_NUM_THREADS"], os.environ["GDAL_CACHEMAX"])']
+    result = project._run_command(command, verbose=False)
+    assert result.stdout.decode().split() == ['3', '100']
+
+    # in-process operations
+    with project.resources.rasterio_env():
+        options = rasterio.env.getenv()
+    assert options['GDAL_NUM_THREADS'] == 3 and options['GDAL_CACHEMAX'] == 100
+
+
+def test_budgets_are_recorded(project):
+
+    project.resources = Resources(threads=3, memory=400)
+    operation = project.merge(project.raw_datasets)
+    assert operation.resources == project.resources.budgets()
+
+    reloaded = managers.LandsatProject(project.project_root)
+    assert reloaded.operations[0].resources == project.resources.budgets()
+
+
+def test_operations_wait_for_a_slot():
+
+    resources = Resources(threads=1, memory=100, max_operations=1)
+    events = []
+
+    def _operation(name):
+        with resources:
+            # nested operations (e.g., the statistics of an operation's destination) do not wait for a second slot
+            with resources:
+                events.append((name, 'start'))
+                time.sleep(.1)
+                events.append((name, 'end'))
+
+    threads = [threading.Thread(target=_operation, args=(name,)) for name in ['a', 'b']]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    # the operations did not overlap
+    assert [event for _, event in events] == ['start', 'end', 'start', 'end']
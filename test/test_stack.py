@@ -0,0 +1,54 @@
+import numpy as np
+
+from managers import raster_io
+from managers import utils
+
+
+def _read(path, band=None):
+    with raster_io.open(path) as src:
+        return src.read(band), src.profile
+
+
+def test_stack_copies_the_bands(project):
+
+    merged = project.merge(project.raw_datasets).destination
+    stack = project.stack(merged, bands=[4, 3, 2]).destination
+
+    im, profile = _read(stack.path)
+    assert profile['tiled'] and profile['interleave'] == 'pixel'
+    for ind, band in enumerate([4, 3, 2]):
+        assert np.array_equal(im[ind], _read(merged.filepath(band), 1)[0])
+
+
+def test_stack_casts_and_scales(project):
+
+    merged = project.merge(project.raw_datasets).destination
+    stack = project.stack(merged, bands=[5], dtype='float32', scale=.5).destination
+
+    im, profile = _read(stack.path)
+    assert profile['dtype'] == 'float32'
+    assert np.array_equal(im[0], _read(merged.filepath(5), 1)[0].astype('float32')*.5)
+
+
+def test_stack_autogains_each_band(project):
+
+    merged = project.merge(project.raw_datasets).destination
+    stack = project.stack(merged, bands=[4, 3, 2], percentile=98).destination
+
+    im, profile = _read(stack.path)
+    assert profile['dtype'] == 'uint8'
+    for ind, band in enumerate([4, 3, 2]):
+        expected = utils.autoscale(_read(merged.filepath(band), 1)[0], percentile=98)*255
+        assert np.array_equal(im[ind], expected.astype('uint8'))
+
+
+def test_autoscale_with_limits_skips_the_percentiles(monkeypatch):
+
+    def _percentile(*args, **kwargs):
+        raise AssertionError('np.percentile was called')
+
+    im = np.arange(100).reshape(10, 10)
+    monkeypatch.setattr(np, 'percentile', _percentile)
+    scaled = utils.autoscale(im, percentile=99, minn=10, maxx=90)
+    assert scaled.min() == 0 and scaled.max() == 1
+    assert scaled[5, 0] == .5
@@ -0,0 +1,17 @@
+from managers import stats
+
+
+def test_stats_are_computed_in_the_operation_slot(project, monkeypatch):
+
+    write = stats.write
+    depths = []
+    def _write(filepath, chunked):
+        depths.append(getattr(project.resources._local, 'depth', 0))
+        return write(filepath, chunked)
+    monkeypatch.setattr(stats, 'write', _write)
+
+    operation = project.merge(project.raw_datasets, bands=[4, 3])
+
+    assert depths and all(depth > 0 for depth in depths)
+    assert getattr(project.resources._local, 'depth', 0) == 0
+    assert stats.load(operation.destination.filepath(4)) is not None
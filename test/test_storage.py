@@ -0,0 +1,57 @@
+import os
+import numpy as np
+import pytest
+
+from managers import managers
+from managers import raster_io
+
+
+@pytest.mark.parametrize('num_scenes', [1, 2])
+def test_evict_and_regenerate_merge(project, num_scenes):
+
+    project.merge(project.raw_datasets[:num_scenes])
+    merged = project.operations[0].destination
+    with raster_io.open(merged.filepath(4)) as src:
+        expected = src.read()
+
+    project.storage.evict(project.operations[0])
+    assert project.operations[0].evicted
+    assert not os.path.exists(merged.filepath(4))
+
+    # using the evicted dataset as a source regenerates it at its original path
+    project.stack(merged, bands=[4, 3, 2])
+    assert not project.operations[0].evicted
+    with raster_io.open(merged.filepath(4)) as src:
+        assert np.array_equal(src.read(), expected)
+    assert project.operations[1]._source[0].path == merged.path
+
+
+def test_access_times_are_journaled(project):
+
+    storage = project.storage
+    project.merge(project.raw_datasets)
+    merged = project.operations[0].destination
+
+    # operations append to the journal instead of rewriting storage.json
+    project.stack(merged, bands=[4, 3, 2])
+    project.stack(merged, bands=[5, 4, 3])
+    assert not os.path.exists(storage._access_times_path)
+    with open(storage._access_journal_path, 'r') as file:
+        assert len(file.read().strip().split('\n')) == 3
+
+    # an incomplete final entry is ignored when the journal is replayed
+    with open(storage._access_journal_path, 'a') as file:
+        file.write('{"/incomplete')
+
+    access_times = dict(storage.access_times)
+    reloaded = managers.LandsatProject(project.project_root).storage
+    assert reloaded.access_times == access_times
+    assert not os.path.exists(reloaded._access_journal_path)
+
+    # evicted datasets are forgotten, and the journal is compacted once it is long enough
+    reloaded._journal_compaction_interval = 2
+    reloaded.evict(project.operations[2])
+    assert project.operations[2].destination.path not in reloaded.access_times
+    reloaded.touch([merged])
+    assert not os.path.exists(reloaded._access_journal_path)
+    assert managers.LandsatProject(project.project_root).storage.access_times == reloaded.access_times
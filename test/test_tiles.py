@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+import rasterio
+import rasterio.warp
+
+from rasterio.enums import Resampling
+from rasterio.windows import from_bounds
+
+from managers import tiles
+
+
+@pytest.fixture
+def rgb(project):
+    '''
+    A uint8 RGB tif of a scene in EPSG:3857
+    '''
+    warped = project.warp(project.raw_datasets[0], crs='EPSG:3857', res=30).destination
+    return project.stack(warped, bands=[4, 3, 2], percentile=99).destination
+
+
+@pytest.mark.parametrize('format', ['xyz', 'mbtiles'])
+def test_export_tiles(project, rgb, format):
+
+    max_zoom = 13
+    operation = project.export_tiles(rgb, format=format, min_zoom=9, max_zoom=max_zoom)
+    store = tiles.open_store(operation.destination)
+
+    with rasterio.open(rgb.path) as src:
+        region = tuple(src.bounds)
+        top_tiles = tiles.tile_range(region, max_zoom)
+        assert len(top_tiles) > 1
+
+        # the tiles at max_zoom are rendered from the source
+        for x, y in top_tiles:
+            data = store.get(max_zoom, x, y)
+            assert data is not None
+            tile = tiles.decode_png(data)
+
+            expected = src.read(
+                indexes=[1, 2, 3],
+                window=from_bounds(*tiles.tile_bounds(max_zoom, x, y), transform=src.transform),
+                out_shape=(3, tiles.TILE_SIZE, tiles.TILE_SIZE),
+                boundless=True,
+                fill_value=0,
+                resampling=Resampling.bilinear)
+            assert np.array_equal(tile[:3], expected)
+            assert np.array_equal(tile[3] > 0, (expected != 0).any(axis=0))
+
+    # each lower zoom down to min_zoom has the tiles that contain the tiles beneath it
+    for z in range(9, max_zoom):
+        expected = set(tiles.tile_range(region, z))
+        for x, y in expected:
+            assert store.get(z, x, y) is not None
+    assert store.get(8, *tiles.tile_range(region, 8)[0]) is None
+    store.close()
+
+
+def test_update_tiles_in_place(project, rgb):
+
+    operation = project.export_tiles(rgb, min_zoom=11, max_zoom=12)
+    tiles_path = operation.destination.path
+
+    with rasterio.open(rgb.path) as src:
+        left, bottom, right, top = src.bounds
+    bounds = rasterio.warp.transform_bounds(
+        'EPSG:3857', 'EPSG:4326', left, bottom, left + (right - left)/4, bottom + (top - bottom)/4)
+
+    store = tiles.XYZStore(tiles_path)
+    before = {
+        (z, x, y): store.get(z, x, y)
+        for z in [11, 12] for x, y in tiles.tile_range((left, bottom, right, top), z)}
+
+    project.export_tiles(rgb, min_zoom=11, max_zoom=12, bounds=list(bounds), tiles_path=tiles_path)
+    after = {key: store.get(*key) for key in before.keys()}
+
+    # re-rendering the same source changes nothing
+    assert after == before
+
+
+def test_export_tiles_requires_web_mercator(project):
+
+    project.merge(project.raw_datasets)
+    stack = project.stack(project.operations[0].destination, bands=[4, 3, 2], percentile=99).destination
+    with pytest.raises(ValueError):
+        project.export_tiles(stack)
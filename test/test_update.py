@@ -0,0 +1,43 @@
+import os
+import numpy as np
+import pytest
+
+from managers import managers
+from managers import raster_io
+
+
+def _read(dataset, band):
+    with raster_io.open(dataset.filepath(band)) as src:
+        return src.read()
+
+
+@pytest.mark.parametrize('num_scenes', [1, 2])
+def test_update_merge(project, num_scenes):
+
+    scenes = project.raw_datasets[:num_scenes]
+    project.merge(scenes)
+    project.stack(project.operations[0].destination, bands=[4, 3, 2])
+
+    operation = project.update(0, res=60)
+    assert operation.method == 'merge'
+    assert operation.source_is_list
+    assert len(operation._source) == num_scenes
+
+    # the stack was re-run with the new merge
+    stack = project.operations[1]
+    assert stack._source[0].path == operation.destination.path
+    assert _read(stack.destination, None).shape[1:] == _read(operation.destination, 4).shape[1:]
+
+
+def test_update_after_reload(project):
+
+    project.merge(project.raw_datasets[:1])
+    project.stack(project.operations[0].destination, bands=[4, 3, 2])
+
+    project = managers.LandsatProject(project.project_root)
+    assert project.operations[0].source_is_list
+    assert not project.operations[1].source_is_list
+
+    operation = project.update(0, res=60)
+    assert operation.source_is_list
+    assert project.operations[1]._source[0].path == operation.destination.path
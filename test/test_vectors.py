@@ -0,0 +1,183 @@
+import numpy as np
+import pytest
+import rasterio
+import rasterio.features
+import rasterio.warp
+
+from managers import datasets
+from managers import raster_io
+from managers import vectors
+from managers import windows
+
+# a grid of several blocks
+SHAPE = (700, 900)
+ORIGIN = (300000, 4200000)
+RES = 30
+CRS = 'EPSG:32611'
+
+
+def _x(col):
+    return ORIGIN[0] + col*RES
+
+
+def _y(row):
+    return ORIGIN[1] - row*RES
+
+
+def _line(cols, rows):
+    # (the vertices are offset from the pixel corners, which a line touches or not depending on rounding)
+    return {'type': 'LineString', 'coordinates': [(_x(col + .37), _y(row + .21)) for col, row in zip(cols, rows)]}
+
+
+def _box(col_start, row_start, col_stop, row_stop):
+    corners = [(col_start, row_start), (col_stop, row_start), (col_stop, row_stop), (col_start, row_stop)]
+    return {'type': 'Polygon', 'coordinates': [[(_x(col), _y(row)) for col, row in corners + corners[:1]]]}
+
+
+ROADS = [
+    ('motorway', _line([10, 890], [20, 680])),
+    ('trunk', _line([450, 460], [0, 699])),
+    ('residential', _line([0, 899], [600, 590])),
+    ('footway', _line([100, 800], [300, 310])),
+
+    # outside of the grid
+    ('motorway', _line([1000, 1200], [0, 10])),
+]
+
+
+@pytest.fixture
+def source(tmp_path):
+    rng = np.random.default_rng(0)
+    im = rng.integers(1, 2**12, size=(2,) + SHAPE, dtype='uint16')
+    profile = windows.tiled_profile(dict(
+        driver='GTiff', width=SHAPE[1], height=SHAPE[0], count=2, dtype='uint16', nodata=0, crs=CRS,
+        transform=rasterio.transform.from_origin(*ORIGIN, RES, RES)))
+    path = str(tmp_path / 'source.tif')
+    with rasterio.open(path, 'w', **profile) as dst:
+        dst.write(im)
+    return datasets.new_dataset('tif', path, exists=True)
+
+
+@pytest.fixture
+def roads_path(tmp_path):
+    import fiona
+
+    schema = {'geometry': 'LineString', 'properties': {'fclass': 'str'}}
+    path = str(tmp_path / 'roads.geojson')
+    with fiona.open(path, 'w', driver='GeoJSON', crs=CRS, schema=schema) as collection:
+        for fclass, geometry in ROADS:
+            collection.write({'geometry': geometry, 'properties': {'fclass': fclass}})
+    return path
+
+
+def test_read_features(roads_path):
+
+    bounds = (_x(0), _y(SHAPE[0]), _x(SHAPE[1]), _y(0))
+    features = vectors.read_features(roads_path, CRS, bounds=bounds, where={'fclass': ['motorway', 'trunk']})
+    assert [feature['properties']['fclass'] for feature in features] == ['motorway', 'trunk']
+
+    # GeoJSON geometries are in EPSG:4326
+    geometry = rasterio.warp.transform_geom(CRS, 'EPSG:4326', ROADS[1][1])
+    feature, = vectors.read_features(geometry, CRS, bounds=bounds)
+    assert np.allclose(feature['geometry']['coordinates'], ROADS[1][1]['coordinates'])
+
+
+def test_rasterize_matches_whole_image(project, source, roads_path):
+
+    values = {'motorway': 255, 'trunk': 200}
+    widths = {'motorway': 5, 'trunk': 3}
+    destination = project.rasterize(
+        source, features=roads_path, where={'fclass': ['motorway', 'trunk', 'residential']},
+        property='fclass', values=values, widths=widths, default_value=100).destination
+
+    # rasterize the whole grid at once, in order of increasing value
+    transform = rasterio.transform.from_origin(*ORIGIN, RES, RES)
+    expected = np.zeros(SHAPE, dtype='uint8')
+    for fclass, value in [('residential', 100), ('trunk', 200), ('motorway', 255)]:
+        geometries = [geometry for fclass_, geometry in ROADS[:4] if fclass_ == fclass]
+        burned = rasterio.features.rasterize(
+            [(geometry, value) for geometry in geometries], out_shape=SHAPE, transform=transform,
+            all_touched=True, fill=0, dtype='uint8')
+        np.maximum(expected, vectors.dilate(burned, widths.get(fclass, 1)), out=expected)
+
+    with raster_io.open(destination.path) as src:
+        im = src.read(1)
+        assert src.transform == transform and src.count == 1
+    assert np.array_equal(im, expected)
+    assert set(np.unique(im)) == {0, 100, 200, 255}
+
+
+def test_rasterize_requires_a_property_for_classes(project, source, roads_path):
+    with pytest.raises(ValueError):
+        project.rasterize(source, features=roads_path, values={'motorway': 255})
+
+
+def _polygons():
+    # one polygon that spans several blocks and one within a single block
+    return [_box(100, 200, 700, 650), _box(820, 30, 880, 90)]
+
+
+def _features():
+    return [
+        {'type': 'Feature', 'geometry': rasterio.warp.transform_geom(CRS, 'EPSG:4326', polygon), 'properties': {'id': ind}}
+        for ind, polygon in enumerate(_polygons())]
+
+
+def _expected(source, polygons, dst, invert=False):
+    '''
+    The masked source, read in full, in the window of the source grid that the destination covers
+    '''
+    with rasterio.open(source.path) as src:
+        im = src.read()
+        inside = rasterio.features.geometry_mask(polygons, out_shape=src.shape, transform=src.transform, invert=True)
+        window = rasterio.windows.from_bounds(*dst.bounds, transform=src.transform).round_offsets().round_lengths()
+
+    keep = ~inside if invert else inside
+    im = np.where(keep[None, :, :], im, 0)
+    rows, cols = window.toslices()
+    return im[:, rows, cols]
+
+
+@pytest.mark.parametrize('invert', [False, True])
+def test_mask_matches_whole_image(project, source, invert):
+
+    destination = project.mask(source, features=_features(), invert=invert).destination
+
+    with raster_io.open(destination.path) as dst:
+        im = dst.read()
+        expected = _expected(source, _polygons(), dst, invert=invert)
+        if invert:
+            assert dst.shape == SHAPE
+        else:
+            # cropped to the bounds of the features
+            # (which may grow by a pixel on each side, after their round trip through EPSG:4326)
+            assert np.abs(np.array(dst.shape) - (620, 780)).max() <= 2
+    assert np.array_equal(im, expected)
+
+
+def test_mask_per_feature(project, source):
+
+    destinations = project.mask(source, features=_features(), per_feature=True).destination
+    assert len(destinations) == 2
+
+    for destination, polygon, shape in zip(destinations, _polygons(), [(450, 600), (60, 60)]):
+        with raster_io.open(destination.path) as dst:
+            assert np.abs(np.array(dst.shape) - shape).max() <= 2
+            assert np.array_equal(dst.read(), _expected(source, [polygon], dst))
+
+
+def test_mask_reads_only_feature_blocks(project, source, monkeypatch):
+
+    windows_read = []
+    read = raster_io.cache.CachedReader.read
+
+    def _read(self, indexes=None, window=None, **kwargs):
+        windows_read.append(window)
+        return read(self, indexes=indexes, window=window, **kwargs)
+
+    monkeypatch.setattr(raster_io.cache.CachedReader, 'read', _read)
+
+    # the small polygon is within one block
+    project.compute_stats = False
+    project.mask(source, features=_features()[1:])
+    assert len(windows_read) == 1
@@ -0,0 +1,76 @@
+import os
+import numpy as np
+import rasterio
+import rasterio.warp
+
+from rasterio.enums import Resampling
+from rasterio.transform import Affine
+
+from managers import managers
+from managers.resources import Resources
+
+from conftest import SCENES, RES
+
+
+def write_smooth_scene(root, name, origin, shape):
+    '''
+    Write a scene whose bands vary smoothly (by at most about 150 DN from pixel to pixel)
+    '''
+    path = os.path.join(root, name)
+    os.makedirs(path)
+    for band in range(1, 12):
+        scale = 2 if band == 8 else 1
+        rows, cols = np.mgrid[0:shape[0]*scale, 0:shape[1]*scale]/scale
+        im = (10000 + 4000*np.sin(cols/37)*np.cos(rows/53) + 100*band).astype('uint16')
+
+        profile = dict(
+            driver='GTiff', width=im.shape[1], height=im.shape[0], count=1, dtype='uint16', nodata=0,
+            crs='EPSG:32611', transform=Affine.translation(*origin)*Affine.scale(RES/scale, -RES/scale))
+        with rasterio.open(os.path.join(path, '%s_B%d.TIF' % (name, band)), 'w', **profile) as dst:
+            dst.write(im, 1)
+    return path
+
+
+def test_block_warp_matches_whole_image_warp(tmp_path):
+    '''
+    Warping block-by-block gives the same result as warping the whole image in one call
+
+    The results are not identical: GDAL's warper approximates the coordinate transformation
+    to within an eighth of a source pixel, and the approximation depends on the extent of the destination.
+    So the scene is smooth, and the results may differ by about an eighth of the change between neighboring pixels
+    (on both sides of the seams between the blocks, too).
+    '''
+
+    name, origin = SCENES[0]
+    path = write_smooth_scene(str(tmp_path / 'landsat'), name, origin, shape=(600, 700))
+    project = managers.LandsatProject(
+        str(tmp_path / 'project'), dataset_paths=[path], reset=True, resources=Resources(threads=2))
+    project.compute_stats = False
+
+    source = project.raw_datasets[0]
+    operation = project.warp(source, crs='EPSG:3857', res=40)
+
+    # the multispectral bands and the pan band are warped in separate groups, on grids of more than one block
+    for band in [4, 8]:
+        with rasterio.open(operation.destination.filepath(band)) as dst:
+            assert dst.width > 512 and dst.height > 512
+            im = dst.read(1)
+            dst_transform, dst_crs = dst.transform, dst.crs
+
+        with rasterio.open(source.filepath(band)) as src:
+            expected = np.zeros(im.shape, dtype=im.dtype)
+            rasterio.warp.reproject(
+                src.read(1),
+                expected,
+                src_transform=src.transform,
+                src_crs=src.crs,
+                src_nodata=0,
+                dst_transform=dst_transform,
+                dst_crs=dst_crs,
+                dst_nodata=0,
+                resampling=Resampling.lanczos)
+
+        valid = (im != 0) & (expected != 0)
+        assert valid.mean() > .9
+        assert np.abs(im.astype('int32') - expected)[valid].max() <= 20
+        assert ((im == 0) != (expected == 0)).mean() < 1e-3
@@ -0,0 +1,60 @@
+import time
+import threading
+import tracemalloc
+import numpy as np
+
+from managers import windows
+
+
+def test_map_windows_order():
+    results = windows.map_windows(lambda ind: ind**2, range(100), max_workers=4)
+    assert list(results) == [ind**2 for ind in range(100)]
+
+
+def test_map_windows_bounds_windows_in_flight():
+    '''
+    With a slow consumer, the number of windows that have been processed but not consumed
+    (and so the memory they use) stays bounded, however many windows there are
+    '''
+
+    max_workers = 3
+    lock = threading.Lock()
+    state = {'started': 0, 'consumed': 0, 'max_in_flight': 0}
+
+    def func(ind):
+        with lock:
+            state['started'] += 1
+            state['max_in_flight'] = max(state['max_in_flight'], state['started'] - state['consumed'])
+        return np.ones(2**18, dtype='float32')
+
+    tracemalloc.start()
+    for result in windows.map_windows(func, range(200), max_workers=max_workers):
+        time.sleep(.001)
+        with lock:
+            state['consumed'] += 1
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    max_in_flight = windows.IN_FLIGHT_PER_WORKER*max_workers
+    assert state['consumed'] == 200
+    assert state['max_in_flight'] <= max_in_flight
+
+    # one result is 1 MB; the 200 results together are 200 MB
+    assert peak < (max_in_flight + 4)*2**20
+
+
+def test_map_windows_propagates_errors():
+
+    def func(ind):
+        if ind == 5:
+            raise ValueError('window %d failed' % ind)
+        return ind
+
+    results = windows.map_windows(func, range(100), max_workers=2)
+    assert [next(results) for _ in range(5)] == list(range(5))
+    try:
+        next(results)
+    except ValueError as error:
+        assert 'window 5' in str(error)
+    else:
+        assert False